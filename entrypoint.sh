@@ -3,4 +3,9 @@
 python manage.py migrate
 python manage.py collectstatic --noinput
 
-exec gunicorn --bind 0.0.0.0:8000 django_files.wsgi
\ No newline at end of file
+# SERVER_MODE=asgi runs uvicorn workers, the async views then wait on Superset and the database without blocking a worker
+if [ "$SERVER_MODE" = "asgi" ]; then
+    exec gunicorn --bind 0.0.0.0:8000 --workers "${SERVER_WORKERS:-2}" -k uvicorn_worker.UvicornWorker django_files.asgi
+else
+    exec gunicorn --bind 0.0.0.0:8000 --workers "${SERVER_WORKERS:-1}" django_files.wsgi
+fi
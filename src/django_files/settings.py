@@ -144,4 +144,43 @@ MEDIA_ROOT = 'uploads'
 STATIC_URL = '/static/'
 STATIC_ROOT = '/app/static'
 
-DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
\ No newline at end of file
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
+
+# Categorization rule cache
+# Built categorizers are cached per process and rebuilt when the version stamp stored in the database changes. Set
+# CATEGORIZER_CACHE_ALIAS to a shared backend in CACHES (not locmem) to share built categorizers between worker processes
+
+CATEGORIZER_CACHE_SIZE = int(os.getenv('CATEGORIZER_CACHE_SIZE', '128'))
+CATEGORIZER_CACHE_ALIAS = os.getenv('CATEGORIZER_CACHE_ALIAS') or None
+
+# Record per rule hit counts and evaluation times, shown on the category rules page. Rules are evaluated one by one
+# while enabled so categorization is slower.
+
+CATEGORIZER_STATS = os.getenv('CATEGORIZER_STATS', 'False') == 'True'
+
+# Seconds the regex rules may take on one description, regex rules not evaluated in time are treated as not matching
+
+CATEGORIZER_REGEX_BUDGET = float(os.getenv('CATEGORIZER_REGEX_BUDGET', '0.05'))
+
+# Server the app runs under, see entrypoint.sh. Views that wait on Superset or stream responses use async code only under
+# asgi, a wsgi server runs every async view on its own event loop.
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+# Number of rows inserted per query when an upload is committed
+
+UPLOAD_BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', '1000'))
+
+# Number of worker processes parsing the files of a batch upload in parallel, 1 parses them in the job worker
+
+UPLOAD_PROCESSES = int(os.getenv('UPLOAD_PROCESSES', '0')) or os.cpu_count()
+
+# Seconds a running job may go without reporting progress before run_jobs fails it as interrupted
+
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', '1800'))
+
+# Page sizes for remote paginated transaction tables
+
+TABLE_PAGE_SIZE = 100
+TABLE_MAX_PAGE_SIZE = 1000
+TABLE_EXACT_COUNT_LIMIT = 10000
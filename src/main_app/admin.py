@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ParseRule, Category, CategoryRule, Transaction, Bank, Account
+from .models import ParseRule, Category, CategoryRule, Transaction, Bank, Account, Job, MonthlySummary, RuleStats
 
 class DisplayUserAdmin(admin.ModelAdmin):
     list_display = ["__str__", "user"]
@@ -8,6 +8,9 @@ class DisplayUserAdmin(admin.ModelAdmin):
 class CategoryRuleAdmin(admin.ModelAdmin):
     list_display = ["__str__", "category__user"]
 
+class RuleStatsAdmin(admin.ModelAdmin):
+    list_display = ["__str__", "evaluations", "eval_time", "rule__category__user"]
+
 class AccountAdmin(admin.ModelAdmin):
     list_display = ["__str__", "bank__user"]
 
@@ -17,3 +20,6 @@ admin.site.register(CategoryRule, CategoryRuleAdmin)
 admin.site.register(Transaction, DisplayUserAdmin)
 admin.site.register(Bank, DisplayUserAdmin)
 admin.site.register(Account, AccountAdmin)
+admin.site.register(Job, DisplayUserAdmin)
+admin.site.register(MonthlySummary, DisplayUserAdmin)
+admin.site.register(RuleStats, RuleStatsAdmin)
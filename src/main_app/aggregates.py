@@ -0,0 +1,44 @@
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+
+# Totals are computed by the database with GROUP BY queries over a user's transactions, which are served by the
+# (user, category) and (user, date) indexes. PostgreSQL sums the numeric amounts exactly. Each helper takes a Transaction
+# queryset so callers can narrow it first, e.g. with export.filter_export, and returns a values queryset of dicts.
+
+
+def category_totals(txns):
+    """Total amount and transaction count per category"""
+    return txns.order_by().values("category", "category__name").annotate(total=Sum("amount"), count=Count("pk")).order_by("category__name")
+
+
+def monthly_totals(txns):
+    """Total amount and transaction count per month"""
+    return txns.order_by().annotate(month=TruncMonth("date")).values("month").annotate(total=Sum("amount"), count=Count("pk")).order_by("month")
+
+
+def monthly_category_totals(txns):
+    """Total amount and transaction count per month and category"""
+    return (
+        txns.order_by()
+        .annotate(month=TruncMonth("date"))
+        .values("month", "category", "category__name")
+        .annotate(total=Sum("amount"), count=Count("pk"))
+        .order_by("month", "category__name")
+    )
+
+
+def rollup_totals(txns):
+    """Total amount and transaction count per category including its subcategories. Each transaction is counted once for
+    its category and once for every ancestor of it through the category closure table."""
+    return (
+        txns.order_by()
+        .values(category_pk=F("category__ancestor_links__ancestor"), category_name=F("category__ancestor_links__ancestor__name"))
+        .annotate(total=Sum("amount"), count=Count("pk"))
+        .order_by("category_name")
+    )
+
+
+def top_level_totals(txns):
+    """Total amount and transaction count per top level category, counting each transaction under the root of its
+    category"""
+    return rollup_totals(txns.filter(category__ancestor_links__ancestor__parent__isnull=True))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Cache backends whose entries are only visible to the process that wrote them
+PROCESS_LOCAL_CACHES = {"django.core.cache.backends.locmem.LocMemCache", "django.core.cache.backends.dummy.DummyCache"}
+
+
+@register()
+def check_categorizer_cache(app_configs, **kwargs):
+    """The web server workers and the job worker are separate processes, so a categorizer cache alias has to name a
+    backend they all share"""
+    alias = settings.CATEGORIZER_CACHE_ALIAS
+    if alias is None:
+        return []
+    if alias not in settings.CACHES:
+        return [Error(f"CATEGORIZER_CACHE_ALIAS {alias!r} is not defined in CACHES.", id="main_app.E001")]
+    if settings.CACHES[alias]["BACKEND"] in PROCESS_LOCAL_CACHES:
+        return [
+            Error(
+                f"CATEGORIZER_CACHE_ALIAS {alias!r} uses a process local cache backend.",
+                hint="Use a shared backend such as Redis or the database cache, or unset CATEGORIZER_CACHE_ALIAS.",
+                id="main_app.E002",
+            )
+        ]
+    return []
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.core.exceptions import ValidationError
+from .models import Category, CategoryClosure
+
+# The category tree is stored as a closure table holding every (ancestor, descendant, depth) pair, with each category
+# paired with itself at depth 0. Ancestors and descendants are then found with a single indexed lookup and rollups are a
+# join instead of a recursive query.
+
+
+def get_descendant_pks(category_pk, include_self=True):
+    links = CategoryClosure.objects.filter(ancestor_id=category_pk)
+    return set((links if include_self else links.filter(depth__gt=0)).values_list("descendant_id", flat=True))
+
+
+def get_ancestor_pks(category_pk, include_self=True):
+    links = CategoryClosure.objects.filter(descendant_id=category_pk)
+    return set((links if include_self else links.filter(depth__gt=0)).values_list("ancestor_id", flat=True))
+
+
+def check_parent(category, parent):
+    """Raise a ValidationError if making parent the parent of category would create a cycle"""
+    if parent is not None and category.pk is not None and (parent.pk == category.pk or parent.pk in get_descendant_pks(category.pk)):
+        raise ValidationError("A category cannot be nested under itself or one of its subcategories.", code="input_error")
+
+
+def move_category(category):
+    """Link a saved category and its subtree under its current parent, if it is not already. Category.save checks the
+    parent with check_parent before the row is written."""
+    subtree = dict(CategoryClosure.objects.filter(ancestor=category).values_list("descendant_id", "depth"))
+    current_parent = CategoryClosure.objects.filter(descendant=category, depth=1).values_list("ancestor_id", flat=True).first()
+    if subtree and current_parent == category.parent_id:
+        return
+
+    with transaction.atomic():
+        if not subtree:
+            subtree = {category.pk: 0}
+            CategoryClosure.objects.create(ancestor=category, descendant=category, depth=0)
+        # Cut the subtree from its old ancestors, then link it to every ancestor of the new parent
+        CategoryClosure.objects.filter(descendant__in=subtree).exclude(ancestor__in=subtree).delete()
+        if category.parent_id is not None:
+            ancestors = CategoryClosure.objects.filter(descendant_id=category.parent_id).values_list("ancestor_id", "depth")
+            CategoryClosure.objects.bulk_create(
+                [
+                    CategoryClosure(ancestor_id=ancestor_pk, descendant_id=descendant_pk, depth=ancestor_depth + descendant_depth + 1)
+                    for ancestor_pk, ancestor_depth in ancestors
+                    for descendant_pk, descendant_depth in subtree.items()
+                ]
+            )
+
+
+def detach_children(category):
+    """Make the subcategories of a category about to be deleted top level categories, as its SET_NULL parent key does"""
+    descendants = CategoryClosure.objects.filter(ancestor=category, depth__gt=0).values("descendant")
+    ancestors = CategoryClosure.objects.filter(descendant=category).values("ancestor")
+    CategoryClosure.objects.filter(descendant__in=descendants, ancestor__in=ancestors).delete()
+
+
+def rebuild_category_closure(user_pk):
+    """Recompute the closure rows of a user's categories from their parent keys, e.g. after a bulk_create"""
+    parents = dict(Category.objects.filter(user_id=user_pk).values_list("pk", "parent_id"))
+    links = []
+    for category_pk in parents:
+        ancestor_pk, depth, seen = category_pk, 0, set()
+        # seen stops the walk at a cycle introduced outside the app
+        while ancestor_pk is not None and ancestor_pk not in seen:
+            seen.add(ancestor_pk)
+            links.append(CategoryClosure(ancestor_id=ancestor_pk, descendant_id=category_pk, depth=depth))
+            ancestor_pk, depth = parents.get(ancestor_pk), depth + 1
+    with transaction.atomic():
+        CategoryClosure.objects.filter(descendant__user_id=user_pk).delete()
+        CategoryClosure.objects.bulk_create(links)
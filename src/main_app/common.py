@@ -1,30 +1,563 @@
 import re
-from .models import Category
+import time
+import regex
+import logging
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Q
+from .models import Category, CategorizerVersion, CategoryRule, RuleStats, Transaction
+from .summaries import get_month, refresh_monthly_summaries
+from .regex_rules import compile_rule_regex, get_regex_error
 
+logger = logging.getLogger(__name__)
 
-def evaluate_rule(rule, description_text):
-    match rule.match_type:
+RECATEGORIZE_BATCH_SIZE = 1000
+# Added rules past this many select every transaction instead of ORing a leading wildcard lookup per rule, which is
+# slower than scanning all of the user's transactions and can exceed SQLite's expression depth limit
+MAX_FILTER_RULES = 50
+
+
+class _Trie:
+    """Character trie storing the lowest category rank of the patterns ending at each node."""
+
+    def __init__(self):
+        self.children = [{}]
+        self.ranks = [None]
+
+    def add(self, text, rank):
+        node = 0
+        for char in text:
+            next_node = self.children[node].get(char)
+            if next_node is None:
+                next_node = len(self.children)
+                self.children[node][char] = next_node
+                self.children.append({})
+                self.ranks.append(None)
+            node = next_node
+        if self.ranks[node] is None or rank < self.ranks[node]:
+            self.ranks[node] = rank
+
+    def best_prefix_rank(self, text, best):
+        """Return the lowest rank of any pattern that is a prefix of text, or best if that is lower."""
+        children, ranks = self.children, self.ranks
+        node = 0
+        if ranks[0] is not None and ranks[0] < best:
+            best = ranks[0]
+        for char in text:
+            node = children[node].get(char)
+            if node is None:
+                break
+            rank = ranks[node]
+            if rank is not None and rank < best:
+                best = rank
+        return best
+
+
+class _AhoCorasick(_Trie):
+    """Multi-pattern substring matcher. Each node's rank also covers the patterns reachable through its failure links."""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = None
+
+    def build(self):
+        self.fail = [0] * len(self.children)
+        queue = list(self.children[0].values())
+        for node in queue:
+            for char, child in self.children[node].items():
+                fallback = self.fail[node]
+                while fallback and char not in self.children[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.children[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                inherited = self.ranks[self.fail[child]]
+                if inherited is not None and (self.ranks[child] is None or inherited < self.ranks[child]):
+                    self.ranks[child] = inherited
+                queue.append(child)
+        # Patterns found at the root (the empty string) match everything
+        if self.ranks[0] is not None:
+            self.ranks = [rank if rank is not None and rank < self.ranks[0] else self.ranks[0] for rank in self.ranks]
+
+    def best_rank(self, text, best):
+        """Return the lowest rank of any pattern contained in text, or best if that is lower."""
+        children, ranks, fail = self.children, self.ranks, self.fail
+        node = 0
+        if ranks[0] is not None and ranks[0] < best:
+            best = ranks[0]
+        for char in text:
+            while node and char not in children[node]:
+                node = fail[node]
+            node = children[node].get(char, 0)
+            rank = ranks[node]
+            if rank is not None and rank < best:
+                best = rank
+                if best == 0:
+                    break
+        return best
+
+
+class Categorizer:
+    """Compiled form of a user's category rules.
+
+    Rules are grouped by match type into a single lookup structure each, and every rule is tagged with the rank of its
+    category in priority order. The category assigned to a description is the one with the lowest matching rank, which
+    gives the same "first category in priority order wins" result as evaluating the rules one by one. Regex rules saved
+    before their patterns were validated, which check_regex now rejects, are skipped and listed in skipped_rules.
+    A built categorizer is never changed, apart from its memo of categorized descriptions.
+    """
+
+    # Patterns using backreferences or conditional group references cannot be safely merged into the combined alternation
+    # since the group numbers shift
+    _BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+    # Memoized descriptions kept by categorize_many before the memo is cleared
+    MEMO_SIZE = 100000
+
+    def __init__(self, categories, uncategorized):
+        self.categories = []
+        self.rule_sets = []
+        self.rules = []
+        self.uncategorized = uncategorized
+        self.equals = {}
+        self.contains = _AhoCorasick()
+        self.prefixes = _Trie()
+        self.suffixes = _Trie()
+        self.memo = {}
+        self.skipped_rules = []
+        regexes = []
+
+        for rank, (cat, rules) in enumerate(categories):
+            self.categories.append(cat)
+            self.rule_sets.append(frozenset((rule.match_type, rule.match_text) for rule in rules))
+            self.rules.append([(rule.pk, rule.match_type, rule.match_text) for rule in rules])
+            for rule in rules:
+                match_text = rule.match_text.lower()
+                match rule.match_type:
+                    case "equals":
+                        self.equals.setdefault(match_text, rank)
+                    case "contains":
+                        self.contains.add(match_text, rank)
+                    case "starts_with":
+                        self.prefixes.add(match_text, rank)
+                    case "ends_with":
+                        self.suffixes.add(match_text[::-1], rank)
+                    case "regex":
+                        if compile_rule_regex(rule.match_text) is not None:
+                            regexes.append((rank, rule.match_text))
+                        else:
+                            error = get_regex_error(rule.match_text)
+                            logger.warning("Skipping regex rule %s of category %s: %s", rule.pk, cat.pk, error)
+                            self.skipped_rules.append({"rule": rule.pk, "category": cat, "match_text": rule.match_text, "error": error})
+        self.contains.build()
+        self._compile_regexes(regexes)
+
+    def _compile_regexes(self, regexes):
+        """Merge the regex rules into one anchored alternation in rank order.
+
+        Each alternative is prefixed with an empty marker group and a lazy ".*?", so matching the alternation at the
+        start of a description tries each pattern as a search in turn and the first alternative to succeed is the
+        lowest ranked match. Patterns that cannot be merged are kept as individually compiled fallbacks.
+        """
+        self.regex = None
+        self.regex_markers = []
+        self.regex_fallbacks = []
+        self.regex_rules = [(rank, compile_rule_regex(pattern)) for rank, pattern in regexes]
+        alternatives = []
+        group_count = 0
+        for rank, compiled in self.regex_rules:
+            pattern = compiled.pattern
+            if self._BACKREF_RE.search(pattern):
+                self.regex_fallbacks.append((rank, compiled))
+                continue
+            group_count += 1
+            self.regex_markers.append((group_count, rank))
+            alternatives.append(f"()(?s:.*?)(?:{pattern})")
+            group_count += compiled.groups
+        if alternatives:
+            try:
+                self.regex = regex.compile("|".join(alternatives))
+            except regex.error:
+                self.regex = None
+                self.regex_fallbacks = self.regex_rules
+                self.regex_markers = []
+
+    def _best_regex_rank(self, description_text, best):
+        """Lower best to the rank of the first matching regex rule within the CATEGORIZER_REGEX_BUDGET seconds allowed per
+        description. The merged alternation gets half of the budget. If it times out the rules are searched one by one
+        with the rest, and once that runs out the remaining regex rules are treated as not matching."""
+        budget = settings.CATEGORIZER_REGEX_BUDGET
+        deadline = time.perf_counter() + budget
+        fallbacks = self.regex_fallbacks
+        if self.regex is not None:
+            try:
+                match = self.regex.match(description_text, timeout=budget / 2)
+            except TimeoutError:
+                match, fallbacks = None, self.regex_rules
+            if match is not None:
+                for group, rank in self.regex_markers:
+                    if rank >= best:
+                        break
+                    if match.start(group) != -1:
+                        best = rank
+                        break
+        for rank, compiled in fallbacks:
+            if rank >= best:
+                break
+            try:
+                if compiled.search(description_text, timeout=max(deadline - time.perf_counter(), 0)) is not None:
+                    best = rank
+                    break
+            except TimeoutError:
+                category_pk = self.categories[rank].pk
+                logger.warning("Regex rule %r of category %s timed out, later regex rules were not evaluated", compiled.pattern, category_pk)
+                break
+        return best
+
+    def get_rank(self, description_text):
+        """Return the rank of the category assigned to description_text, or None if no rule matches."""
+        lowered = description_text.lower()
+        no_match = len(self.categories)
+        best = self.equals.get(lowered, no_match)
+        if best:
+            best = self.contains.best_rank(lowered, best)
+        if best:
+            best = self.prefixes.best_prefix_rank(lowered, best)
+        if best:
+            best = self.suffixes.best_prefix_rank(lowered[::-1], best)
+        if best:
+            best = self._best_regex_rank(description_text, best)
+        return best if best < no_match else None
+
+    def get_category(self, description_text):
+        rank = self.get_rank(description_text)
+        return self.uncategorized if rank is None else self.categories[rank]
+
+    def explain(self, description_text):
+        """Evaluate the rules one by one in priority order, stopping at the first match.
+
+        Returns (category, trace) where trace lists a dict for every rule evaluated with its pk, category, match type and
+        text, whether it matched and the seconds it took. The category is the same one get_category returns.
+        """
+        trace = []
+        lowered = description_text.lower()
+        for cat, rules in zip(self.categories, self.rules):
+            for rule_pk, match_type, match_text in rules:
+                start = time.perf_counter()
+                matched = _rule_matches(match_type, match_text, description_text, lowered)
+                trace.append(
+                    {
+                        "rule": rule_pk,
+                        "category": cat,
+                        "match_type": match_type,
+                        "match_text": match_text,
+                        "matched": matched,
+                        "seconds": time.perf_counter() - start,
+                    }
+                )
+                if matched:
+                    return cat, trace
+        return self.uncategorized, trace
+
+    def categorize_many(self, descriptions):
+        """Return the pk of the category assigned to each description of a list or array of descriptions.
+
+        Bank exports repeat the same merchant strings heavily, so each distinct description is only categorized once and
+        the results are memoized on the categorizer for later calls. With CATEGORIZER_STATS enabled every distinct
+        description is explained instead and the rule statistics are recorded.
+        """
+        descriptions = list(descriptions)
+        if settings.CATEGORIZER_STATS:
+            return self._categorize_many_with_stats(descriptions)
+        memo = self.memo
+        category_pks = dict.fromkeys(descriptions)
+        for description in category_pks:
+            category_pk = memo.get(description)
+            if category_pk is None:
+                category_pk = self.get_category(description).pk
+                if len(memo) >= self.MEMO_SIZE:
+                    memo.clear()
+                memo[description] = category_pk
+            category_pks[description] = category_pk
+        return [category_pks[description] for description in descriptions]
+
+    def _categorize_many_with_stats(self, descriptions):
+        category_pks = {}
+        for description, count in Counter(descriptions).items():
+            cat, trace = self.explain(description)
+            rule_stats.record(trace, count)
+            category_pks[description] = cat.pk
+        return [category_pks[description] for description in descriptions]
+
+
+def _rule_matches(match_type, match_text, description_text, lowered):
+    """Evaluate a single rule the way the compiled categorizer does"""
+    match match_type:
         case "equals":
-            return rule.match_text.lower() == description_text.lower()
+            return lowered == match_text.lower()
         case "contains":
-            return rule.match_text.lower() in description_text.lower()
-        case "regex":
-            return re.search(rule.match_text, description_text) is not None
+            return match_text.lower() in lowered
         case "starts_with":
-            return description_text.lower().startswith(rule.match_text.lower())
+            return lowered.startswith(match_text.lower())
         case "ends_with":
-            return description_text.lower().endswith(rule.match_text.lower())
+            return lowered.endswith(match_text.lower())
+        case "regex":
+            compiled = compile_rule_regex(match_text)
+            try:
+                return compiled is not None and compiled.search(description_text, timeout=settings.CATEGORIZER_REGEX_BUDGET) is not None
+            except TimeoutError:
+                return False
+    return False
+
+
+class RuleStatsCollector:
+    """Accumulate rule hit counts and evaluation times in memory and add them to the RuleStats table in batches.
+
+    Hits, evaluations and evaluation time are all counted per transaction: a description shared by several transactions
+    is only explained once, but counts as one evaluation of each rule in its trace for every transaction, so hits never
+    exceed evaluations and eval_time / evaluations is the average time of one evaluation.
+
+    Pending statistics are flushed once FLUSH_SIZE rule evaluations are pending or FLUSH_INTERVAL seconds have passed
+    since the last flush, and at the end of every upload, recategorization and job, so statistics are not left pending
+    in an idle process.
+    """
+
+    FLUSH_SIZE = 10000
+    FLUSH_INTERVAL = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pending_evaluations = 0
+        self.last_flush = time.monotonic()
+
+    def record(self, trace, count=1):
+        """Add the rules evaluated in a trace. count is the number of transactions the trace's description stands for."""
+        with self.lock:
+            for entry in trace:
+                stats = self.pending.setdefault(entry["rule"], [0, 0, 0.0])
+                stats[0] += count if entry["matched"] else 0
+                stats[1] += count
+                stats[2] += entry["seconds"] * count
+            self.pending_evaluations += len(trace) * count
+            due = self.pending_evaluations >= self.FLUSH_SIZE or time.monotonic() - self.last_flush >= self.FLUSH_INTERVAL
+        if due:
+            self.flush()
 
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.pending_evaluations = 0
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+        # Rules may have been deleted since they were evaluated
+        rule_pks = set(CategoryRule.objects.filter(pk__in=pending).values_list("pk", flat=True))
+        with transaction.atomic():
+            RuleStats.objects.bulk_create([RuleStats(rule_id=rule_pk) for rule_pk in rule_pks], ignore_conflicts=True)
+            for rule_pk in rule_pks:
+                hits, evaluations, eval_time = pending[rule_pk]
+                RuleStats.objects.filter(rule_id=rule_pk).update(
+                    hits=F("hits") + hits, evaluations=F("evaluations") + evaluations, eval_time=F("eval_time") + eval_time
+                )
 
-def get_user_categorization_dicts(user_in):
+
+rule_stats = RuleStatsCollector()
+
+
+def get_rule_stats_report(user_in, limit=5):
+    """Return the user's most hit rules, rules that were evaluated but never matched, and rules with the highest average
+    evaluation time"""
+    stats = RuleStats.objects.filter(rule__category__user=user_in, evaluations__gt=0).select_related("rule__category")
     return {
-        "dicts": [{"cat": cat, "rules": cat.rule_set.all()} for cat in Category.objects.filter(user=user_in)],
-        "un_categorized": Category.get_uncategorized(user_in),
+        "hot": list(stats.filter(hits__gt=0).order_by("-hits")[:limit]),
+        "dead": list(stats.filter(hits=0).order_by("-evaluations")[:limit]),
+        "slow": list(stats.annotate(avg_time=F("eval_time") / F("evaluations")).order_by("-avg_time")[:limit]),
     }
 
 
-def get_category(categorization_dicts, description_text):
-    for dict in categorization_dicts["dicts"]:
-        if any(evaluate_rule(rule, description_text) for rule in dict["rules"]):
-            return dict["cat"]
-    return categorization_dicts["un_categorized"]
+def _rule_q(match_type, match_text):
+    """Return a Q object selecting descriptions matched by a rule, or None if it cannot be expressed as a DB lookup"""
+    match match_type:
+        case "equals":
+            return Q(description__iexact=match_text)
+        case "contains":
+            return Q(description__icontains=match_text)
+        case "starts_with":
+            return Q(description__istartswith=match_text)
+        case "ends_with":
+            return Q(description__iendswith=match_text)
+    return None
+
+
+def get_recategorization_changes(old_categorizer, new_categorizer):
+    """Compare two categorizers for the same user and describe which transactions could be categorized differently.
+
+    Returns None if nothing can change, otherwise a JSON serializable dict with the pks of the categories whose
+    transactions need re-evaluating and the [match_type, match_text] rules that may claim any transaction.
+    """
+    old_rules = {cat.pk: rules for cat, rules in zip(old_categorizer.categories, old_categorizer.rule_sets)}
+    new_rules = {cat.pk: rules for cat, rules in zip(new_categorizer.categories, new_categorizer.rule_sets)}
+    old_order = [cat.pk for cat in old_categorizer.categories]
+    new_order = [cat.pk for cat in new_categorizer.categories]
+
+    # Transactions currently in a category that lost rules may now fall through to a different category. Transactions of
+    # removed categories have already been moved to uncategorized.
+    candidate_categories = set()
+    # Rules that were added, or whose category moved ahead of another category, may claim any transaction. This also
+    # covers transactions of categories that were moved back, since they can only change to one of those categories.
+    added_rules = set()
+
+    if old_rules.keys() - new_rules.keys():
+        candidate_categories.add(new_categorizer.uncategorized.pk)
+    for cat_pk, rules in new_rules.items():
+        old = old_rules.get(cat_pk, frozenset())
+        added_rules |= rules - old
+        if old - rules:
+            candidate_categories.add(cat_pk)
+        if cat_pk in old_rules and (set(old_order[: old_order.index(cat_pk)]) - set(new_order[: new_order.index(cat_pk)])) & new_rules.keys():
+            added_rules |= rules
+
+    if not candidate_categories and not added_rules:
+        return None
+    return {"categories": sorted(candidate_categories), "rules": sorted([list(rule) for rule in added_rules])}
+
+
+def get_recategorization_filter(changes):
+    """Return a Q object selecting the transactions described by get_recategorization_changes. An empty Q, selecting
+    every transaction, is returned when the rules can not be expressed as a short DB filter."""
+    if len(changes["rules"]) > MAX_FILTER_RULES:
+        return Q()
+    q = Q(category__in=changes["categories"])
+    for match_type, match_text in changes["rules"]:
+        rule_q = _rule_q(match_type, match_text)
+        if rule_q is None:
+            return Q()
+        q |= rule_q
+    return q
+
+
+def recategorize_transactions(user_in, new_categorizer, txn_filter=Q(), progress=None):
+    """Re-run categorization for the user's non-override transactions selected by txn_filter and save the ones whose
+    category changed, one batch at a time so memory use does not depend on the number of transactions. Batches are read
+    in pk order after the last pk of the previous one, so the rows already written do not disturb the read. progress is
+    called with the number of transactions processed and their total after each batch. Returns the number of updated
+    transactions."""
+    txns = Transaction.objects.filter(Q(user=user_in) & Q(category_override=False)).filter(txn_filter).order_by("pk")
+    total = txns.count() if progress else None
+    processed = updated = 0
+    last_pk = 0
+    while batch := list(txns.filter(pk__gt=last_pk).values_list("pk", "description", "category_id", "date")[:RECATEGORIZE_BATCH_SIZE]):
+        last_pk = batch[-1][0]
+        changed = []
+        months = set()
+        for (pk, description, category_pk, txn_date), new_category_pk in zip(batch, new_categorizer.categorize_many(row[1] for row in batch)):
+            if new_category_pk != category_pk:
+                changed.append(Transaction(pk=pk, category_id=new_category_pk))
+                months.add(get_month(txn_date))
+        if changed:
+            with transaction.atomic():
+                Transaction.objects.bulk_update(changed, ["category"])
+                refresh_monthly_summaries(user_in.pk, months)
+        processed += len(batch)
+        updated += len(changed)
+        if progress:
+            progress(min(processed, total), total)
+    rule_stats.flush()
+    return updated
+
+
+def recategorize_changed_rules(user_in, old_categorizer, new_categorizer):
+    """Recategorize only the transactions that could be affected by switching from old_categorizer to new_categorizer"""
+    changes = get_recategorization_changes(old_categorizer, new_categorizer)
+    if changes is None:
+        return 0
+    return recategorize_transactions(user_in, new_categorizer, get_recategorization_filter(changes))
+
+
+def build_user_categorizer(user_in):
+    categories = list(Category.objects.filter(user=user_in).order_by("priority", "pk").prefetch_related("rule_set"))
+    uncategorized = next((cat for cat in categories if cat.name == "Uncategorized"), None) or Category.get_uncategorized(user_in)
+    return Categorizer([(cat, cat.rule_set.all()) for cat in categories], uncategorized)
+
+
+class CategorizerCache:
+    """LRU cache of built categorizers keyed by user pk and a version stamp.
+
+    The version stamp changes whenever a user's categories or rules are modified and is checked on every get, so stale
+    entries are never returned and simply age out of the LRU. Stamps are stored in the CategorizerVersion table, which
+    every web and job worker process reads, unless a Django cache alias is given. The stamps and the built categorizers
+    are then stored in that cache so the worker processes can also share the categorizers they build.
+    """
+
+    def __init__(self, max_size, cache_alias=None):
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def shared_cache(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def get_version(self, user_pk):
+        shared_cache = self.shared_cache
+        if shared_cache is None:
+            return CategorizerVersion.objects.filter(user_id=user_pk).values_list("version", flat=True).first() or ""
+        key = f"categorizer:version:{user_pk}"
+        version = shared_cache.get(key)
+        if version is None:
+            shared_cache.add(key, uuid.uuid4().hex, timeout=None)
+            version = shared_cache.get(key)
+        return version
+
+    def invalidate(self, user_pk):
+        shared_cache = self.shared_cache
+        if shared_cache is None:
+            # Written in the current transaction, so other processes see the new stamp when they see the changed rules
+            version = uuid.uuid4().hex
+            if not CategorizerVersion.objects.filter(user_id=user_pk).update(version=version):
+                CategorizerVersion.objects.bulk_create([CategorizerVersion(user_id=user_pk, version=version)], ignore_conflicts=True)
+        else:
+            # The shared cache is not transactional, a stamp changed before the commit could be used to cache a
+            # categorizer built from the old rules
+            key = f"categorizer:version:{user_pk}"
+            transaction.on_commit(lambda: shared_cache.set(key, uuid.uuid4().hex, timeout=None))
+
+    def get(self, user_in):
+        key = (user_in.pk, self.get_version(user_in.pk))
+        with self.lock:
+            categorizer = self.entries.get(key)
+            if categorizer is not None:
+                self.entries.move_to_end(key)
+                return categorizer
+
+        shared_cache = self.shared_cache
+        if shared_cache is not None:
+            shared_key = f"categorizer:{key[0]}:{key[1]}"
+            categorizer = shared_cache.get(shared_key)
+            if categorizer is None:
+                categorizer = build_user_categorizer(user_in)
+                shared_cache.set(shared_key, categorizer)
+        else:
+            categorizer = build_user_categorizer(user_in)
+
+        with self.lock:
+            self.entries[key] = categorizer
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return categorizer
+
+
+categorizer_cache = CategorizerCache(settings.CATEGORIZER_CACHE_SIZE, settings.CATEGORIZER_CACHE_ALIAS)
+
+
+def get_user_categorizer(user_in):
+    return categorizer_cache.get(user_in)
+
+
+def invalidate_user_categorizer(user_pk):
+    categorizer_cache.invalidate(user_pk)
@@ -0,0 +1,139 @@
+import io
+import csv
+from datetime import datetime
+from itertools import islice
+from django.core.exceptions import ValidationError
+from .models import ParseRule
+from .pipeline import parse_rows
+from .readers import read_rows
+
+# Number of bytes read from the start of an upload to detect its parse rule
+SNIFF_SIZE = 4096
+# Number of rows of a workbook checked against a parse rule
+SAMPLE_ROWS = 50
+DELIMITERS = ",;\t|"
+# Date formats suggested when no parse rule matches an upload
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d", "%m/%d/%y", "%d/%m/%y", "%d-%m-%Y", "%m-%d-%Y", "%Y%m%d", "%d %b %Y", "%b %d, %Y"]
+
+
+def read_sample(file):
+    """Return the complete lines within the first SNIFF_SIZE bytes of a binary upload, leaving the file at its start"""
+    data = file.read(SNIFF_SIZE)
+    file.seek(0)
+    if len(data) == SNIFF_SIZE and b"\n" in data:
+        data = data[: data.rindex(b"\n") + 1]
+    return data
+
+
+def sniff_format(sample):
+    """Return the file format of a binary sample, XLSX workbooks are zip archives and OFX documents start with a header"""
+    if sample.startswith(b"PK\x03\x04"):
+        return "xlsx"
+    head = sample[:1024].upper()
+    if b"OFXHEADER" in head or b"<OFX>" in head:
+        return "ofx"
+    return "csv"
+
+
+def read_sample_rows(file, parse_rule):
+    """Return the (line, row) pairs at the start of a binary upload read with parse_rule, leaving the file at its start.
+    Workbooks can only be read whole, so their first SAMPLE_ROWS rows are read from the file itself."""
+    if parse_rule.file_format != "xlsx":
+        return list(read_rows(io.BytesIO(read_sample(file)), parse_rule))
+    rows = read_rows(file, parse_rule)
+    try:
+        return list(islice(rows, SAMPLE_ROWS))
+    finally:
+        rows.close()
+        file.seek(0)
+
+
+def sniff_sample(sample):
+    """Return the (delimiter, has_header) sniffed from a sample, falling back to a comma delimited file"""
+    sniffer = csv.Sniffer()
+    try:
+        delimiter = sniffer.sniff(sample, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ","
+    try:
+        has_header = sniffer.has_header(sample)
+    except csv.Error:
+        has_header = False
+    return delimiter, has_header
+
+
+def guess_date_format(values):
+    """Return the first of DATE_FORMATS that parses every value, or None"""
+    for date_fmt in DATE_FORMATS:
+        try:
+            for value in values:
+                datetime.strptime(value.strip(), date_fmt)
+            return date_fmt
+        except ValueError:
+            continue
+    return None
+
+
+def check_sample(parse_rule, file):
+    """Parse the start of a binary upload with parse_rule, raising the ValidationError of the first row that fails.
+    Returns the number of rows parsed."""
+    try:
+        rows = read_sample_rows(file, parse_rule)
+    except UnicodeDecodeError:
+        raise ValidationError("The uploaded file contains invalid utf-8 bytes.", code="input_error")
+    except csv.Error as e:
+        raise ValidationError("The uploaded file could not be read as CSV: %(error)s", params={"error": e}, code="input_error")
+    for _ in parse_rows(rows, parse_rule):
+        pass
+    return len(rows)
+
+
+def score_parse_rule(parse_rule, file, file_format, delimiter, has_header):
+    """Score how well parse_rule fits the start of an upload between 0 and 1. The rule must target the sniffed file
+    format and every sample row must parse for a non zero score, the sniffed CSV delimiter and header then break ties
+    between rules that parse the same rows."""
+    if parse_rule.file_format != file_format:
+        return 0
+    try:
+        if not check_sample(parse_rule, file):
+            return 0
+    except ValidationError:
+        return 0
+    if file_format != "csv":
+        return 1
+    score = 0.5
+    score += 0.25 if (parse_rule.csv_delim or ",") == delimiter else 0
+    score += 0.25 if has_header == (parse_rule.start_line > 0) else 0
+    return score
+
+
+def detect_parse_rule(file, user_in):
+    """Pick the parse rule of user_in that fits the start of a binary upload best.
+
+    Raises a ValidationError if no rule can parse the sample or several rules fit equally well, before the whole file
+    is parsed.
+    """
+    data = read_sample(file)
+    file_format = sniff_format(data)
+    sample = data.decode("utf-8-sig", errors="ignore") if file_format == "csv" else ""
+    delimiter, has_header = sniff_sample(sample)
+    parse_rules = ParseRule.objects.filter(user=user_in, file_format=file_format)
+    scores = {parse_rule: score_parse_rule(parse_rule, file, file_format, delimiter, has_header) for parse_rule in parse_rules}
+    best = max(scores.values(), default=0)
+    if best == 0 and file_format != "csv":
+        raise ValidationError(
+            "No parse rule matches the uploaded %(format)s file.", params={"format": dict(ParseRule.FORMAT_CHOICES)[file_format]}, code="input_error"
+        )
+    if best == 0:
+        rows = list(csv.reader(io.StringIO(sample), delimiter=delimiter))[1 if has_header else 0 :]
+        date_fmts = [guess_date_format([row[col] for row in rows]) for col in range(min(map(len, rows), default=0))]
+        hint = next((f" The file looks {delimiter!r} delimited with dates formatted as {date_fmt}." for date_fmt in date_fmts if date_fmt), "")
+        raise ValidationError("No parse rule matches the uploaded file.%(hint)s", params={"hint": hint}, code="input_error")
+    matches = [parse_rule for parse_rule, score in scores.items() if score == best]
+    if len(matches) > 1:
+        raise ValidationError(
+            "The uploaded file matches several parse rules (%(rules)s), select one.",
+            params={"rules": ", ".join(sorted(rule.name for rule in matches))},
+            code="input_error",
+        )
+    return matches[0]
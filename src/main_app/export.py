@@ -0,0 +1,67 @@
+import csv
+import json
+from datetime import date
+from django.core.serializers.json import DjangoJSONEncoder
+from .pipeline import batched
+
+EXPORT_FIELDS = ["pk", "date", "account__name", "description", "category__name", "amount"]
+EXPORT_KEYS = ["id", "date", "account", "description", "category", "amount"]
+EXPORT_CHUNK_SIZE = 2000
+
+
+class ExportError(ValueError):
+    pass
+
+
+class _Echo:
+    """File-like object returning what is written so csv.writer can be used to build individual lines"""
+
+    def write(self, value):
+        return value
+
+
+def filter_export(txns, params):
+    """Apply the optional start and end dates (ISO format, inclusive) and account pks of an export request"""
+    try:
+        if params.get("start"):
+            txns = txns.filter(date__gte=date.fromisoformat(params["start"]))
+        if params.get("end"):
+            txns = txns.filter(date__lte=date.fromisoformat(params["end"]))
+        if params.getlist("account"):
+            txns = txns.filter(account__in=[int(account) for account in params.getlist("account")])
+    except ValueError:
+        raise ExportError("Invalid export filter")
+    return txns
+
+
+def iter_export_rows(txns):
+    """Stream the export columns from a server side cursor"""
+    return txns.values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(["Date", "Account", "Description", "Category", "Amount"])
+    for batch in batched(rows, EXPORT_CHUNK_SIZE):
+        yield "".join(writer.writerow(row[1:]) for row in batch)
+
+
+def stream_ndjson(rows):
+    """One JSON object per transaction and line"""
+    for batch in batched(rows, EXPORT_CHUNK_SIZE):
+        yield "".join(json.dumps(dict(zip(EXPORT_KEYS, row)), cls=DjangoJSONEncoder) + "\n" for row in batch)
+
+
+def stream_json_columns(rows):
+    """Columnar batches, one JSON object of column arrays per line. This is not Parquet, which would need pyarrow, but
+    the batches can be loaded one column at a time the same way."""
+    for batch in batched(rows, EXPORT_CHUNK_SIZE):
+        yield json.dumps(dict(zip(EXPORT_KEYS, zip(*batch))), cls=DjangoJSONEncoder) + "\n"
+
+
+# Export format: (stream function, content type, file extension)
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv", "csv"),
+    "ndjson": (stream_ndjson, "application/x-ndjson", "ndjson"),
+    "json-columns": (stream_json_columns, "application/x-ndjson", "columns.ndjson"),
+}
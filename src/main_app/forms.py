@@ -1,16 +1,19 @@
-import csv
-import io
 import os
 import json
-from datetime import datetime
+import uuid
 from jsonschema import validate
 from django import forms
 from django.conf import settings
 from django.db.models import Q
-from django.core.files.storage import default_storage
 from django.core.exceptions import ValidationError
 from .models import ParseRule, Category, Account, Bank
-from .common import get_category, get_user_categorization_dicts
+from .common import get_user_categorizer, rule_stats
+from .regex_rules import check_regex
+from .detect import detect_parse_rule, check_sample
+from .closure import get_descendant_pks
+from .readers import read_rows
+from .pipeline import parse_rows, categorize_rows, fingerprint_rows, flag_duplicate_rows, write_staged_rows
+from .staging import StagingWriter, get_staging_path, delete_stale_uploads
 
 
 class ParseRuleForm(forms.ModelForm):
@@ -19,6 +22,7 @@ class ParseRuleForm(forms.ModelForm):
         exclude = ["user"]
         labels = {
             "name": "Name",
+            "file_format": "File format",
             "date_fmt_str": "Date format string",
             "csv_delim": "CSV delimiter",
             "start_line": "CSV start line",
@@ -27,7 +31,11 @@ class ParseRuleForm(forms.ModelForm):
             "sub_desc_col": "Sub-description column",
             "amount_col": "Amount column",
             "txn_type_col": "Credit/Debit indicator",
+            "debit_values": "Debit indicator values (e.g. DR,Debit)",
+            "credit_values": "Credit indicator values (e.g. CR,Credit)",
+            "credit_col": "Credit amount column (the amount column holds debits)",
             "negate_amount": "Negate Amount",
+            "decimal_comma": "Decimal comma (1.234,56)",
         }
 
     def __init__(self, *args, **kwargs):
@@ -36,105 +44,89 @@ class ParseRuleForm(forms.ModelForm):
         for field in self.fields.values():
             field.label_suffix = ""
         self.fields["account"].queryset = Account.objects.filter(bank__user=self.user)
+        # Rules default to CSV files like the ones created before other formats were supported
+        self.fields["file_format"].required = False
 
     def clean(self):
         cleaned_data = super().clean()
+        cleaned_data["file_format"] = cleaned_data.get("file_format") or "csv"
         cols = [field_value for (field_name, field_value) in cleaned_data.items() if isinstance(field_value, int) and field_name.endswith("_col")]
         if len(cols) != len(set(cols)):
             raise ValidationError("The same column index cannot be used more than once.", code="input_error")
+        if cleaned_data.get("txn_type_col") is not None:
+            if cleaned_data.get("credit_col") is not None:
+                raise ValidationError("A credit amount column cannot be combined with a credit/debit indicator.", code="input_error")
+            if not cleaned_data.get("debit_values") and not cleaned_data.get("credit_values"):
+                raise ValidationError("Enter the debit or credit indicator values.", code="input_error")
         return cleaned_data
 
 
 class FileSelectForm(forms.Form):
 
     file = forms.FileField()
-    choice = forms.ChoiceField()
+    choice = forms.ChoiceField(required=False)
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop("user", None)
+        # When deferred, only the form fields are checked and the file is validated later by an upload job
+        self.defer_upload = kwargs.pop("defer_upload", False)
         super().__init__(*args, **kwargs)
-        self.fields["choice"].choices = {rule.pk: rule.name for rule in ParseRule.objects.filter(user=self.user)}
+        self.fields["choice"].choices = {"": "Auto-detect", **{rule.pk: rule.name for rule in ParseRule.objects.filter(user=self.user)}}
 
     def clean(self):
         cleaned_data = super().clean()
 
         if self.errors:
             return cleaned_data
+        # The parse rule is detected, or the selected one checked, from the start of the file so a wrong rule fails
+        # before the whole file is parsed
+        if not cleaned_data["choice"]:
+            cleaned_data["choice"] = str(detect_parse_rule(cleaned_data["file"], self.user).pk)
+        elif self.defer_upload:
+            check_sample(ParseRule.objects.get(pk=cleaned_data["choice"]), cleaned_data["file"])
+        if self.defer_upload:
+            return cleaned_data
 
-        self.validate_upload(io.TextIOWrapper(cleaned_data["file"], encoding="utf-8-sig"), cleaned_data["choice"])
+        self.validate_upload(cleaned_data["file"], cleaned_data["choice"])
         return cleaned_data
 
-    def validate_upload(self, file, choice_idx):
-        """Validate the uploaded file given the selected parse rule. choice_idx corresponds to the pk of the parse rule."""
+    def validate_upload(self, file, choice_idx, progress=None, upload_id=None, categorizer=None):
+        """Validate the uploaded file given the selected parse rule and stage it under upload_id, or a new id stored in
+        self.upload_id. choice_idx corresponds to the pk of the parse rule. progress is called periodically with the
+        number of rows processed so far. Rows are categorized with categorizer, by default the user's cached one."""
 
-        row_index = 0
         try:
             try:
                 parse_rule = ParseRule.objects.get(pk=choice_idx)
             except ParseRule.DoesNotExist:
                 raise ValidationError("The parse rule %(rule)s does not exist.", params={"rule": self.choice.label}, code="internal_error")
 
-            csv_rows = [["idx", "date", "desc", "cat", "amnt", "accnt"]]
-            reader = csv.reader(file)
-            if parse_rule.start_line:
-                for x in range(parse_rule.start_line):
-                    next(reader)
-                row_index = parse_rule.start_line
-
-            csv_col_num = 0
-            categorization_dicts = get_user_categorization_dicts(self.user)
-            for row in reader:
-                # Check all rows have same number of columns
-                if csv_col_num != len(row) and csv_col_num != 0:
-                    raise ValidationError("Invalid CSV file, all rows must have the same number of columns.", params={"line": row_index}, code="input_error")
-                csv_col_num = len(row)
-
-                # Check date, will raise ValueError if parsing fails
-                try:
-                    datetime.strptime(row[parse_rule.date_col], parse_rule.date_fmt_str)
-                except ValueError:
-                    raise ValidationError("Error parsing date on line %(line)s.", params={"line": row_index}, code="input_error")
-
-                # Check the column pointed to by amount_col is actually a number
-                row[parse_rule.amount_col] = row[parse_rule.amount_col].replace("$", "").replace(",", "")
-                try:
-                    float(row[parse_rule.amount_col])
-                except ValueError:
-                    raise ValidationError(
-                        "The value (%(val)s) on line %(line)s column %(column)s is not a number. The amount column should only contain numbers",
-                        params={"line": row_index, "column": parse_rule.amount_col, "val": row[parse_rule.amount_col]},
-                        code="input_error",
-                    )
-
-                description = row[parse_rule.desc_col].strip()
-                if parse_rule.sub_desc_col:
-                    description += " " + row[parse_rule.sub_desc_col].strip()
-                csv_rows.append(
-                    [
-                        row_index - parse_rule.start_line,
-                        datetime.strptime(row[parse_rule.date_col], parse_rule.date_fmt_str).isoformat(),
-                        description,
-                        get_category(categorization_dicts, description).pk,
-                        float(row[parse_rule.amount_col]) * (-1 if parse_rule.negate_amount else 1),
-                        parse_rule.account.pk,
-                    ]
-                )
-                row_index += 1
-
-            if not os.path.exists(settings.MEDIA_ROOT):
-                os.makedirs(settings.MEDIA_ROOT)
-            with default_storage.open(f"{self.user.pk}", "w") as file:
-                writer = csv.writer(file)
-                writer.writerows(csv_rows)
-                file.close()
+            # Rows are streamed from the upload to a new staged upload so memory use does not depend on the file size
+            rows = read_rows(file, parse_rule)
+            rows = categorize_rows(parse_rows(rows, parse_rule), categorizer or get_user_categorizer(self.user))
+            rows = flag_duplicate_rows(fingerprint_rows(rows, parse_rule.account.pk))
+            self.upload_id = upload_id or str(uuid.uuid4())
+            delete_stale_uploads(self.user.pk)
+            with StagingWriter(get_staging_path(self.user.pk, self.upload_id)) as writer:
+                self.row_count = write_staged_rows(rows, writer, parse_rule.account.pk, progress)
         except ValidationError:
             raise
-        except IndexError:
-            raise ValidationError("Indexing error present on line %(line)s.", params={"line": row_index}, code="input_error")
         except UnicodeDecodeError:
             raise ValidationError("The uploaded file contains invalid utf-8 bytes.", code="input_error")
         except Exception as e:
             raise ValidationError("Internal server error.", code="internal_error")
+        finally:
+            rule_stats.flush()
+
+
+class BatchFileForm(FileSelectForm):
+    """One file of a batch upload, the files are validated by a batch upload job. Rows left blank are ignored."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, defer_upload=True, **kwargs)
+
+
+BatchUploadFormset = forms.formset_factory(BatchFileForm, extra=2, min_num=1, validate_min=True)
 
 
 class CategoryForm(forms.ModelForm):
@@ -147,8 +139,9 @@ class CategoryForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
 
         if self.instance.pk:
+            # A category can not be nested under itself or its subcategories
             self.fields["parent"].queryset = Category.objects.filter(
-                Q(user=self.user) & ~Q(pk=Category.get_uncategorized(self.user).pk) & ~Q(pk=self.instance.pk)
+                Q(user=self.user) & ~Q(pk=Category.get_uncategorized(self.user).pk) & ~Q(pk__in=get_descendant_pks(self.instance.pk))
             )
         else:
             self.fields["parent"].queryset = Category.objects.filter(Q(user=self.user) & ~Q(pk=Category.get_uncategorized(self.user).pk))
@@ -178,6 +171,17 @@ class CategoryJsonFileForm(forms.Form):
                     validate(self.json_data, schema)
             except Exception as e:
                 raise ValidationError("Invalid JSON file: %(schema_error)s", params={"schema_error": e.message}, code="input_error")
+            for json_entry in self.json_data:
+                for rule in json_entry["rules"]:
+                    if rule["match_type"] == "regex":
+                        try:
+                            check_regex(rule["match_text"])
+                        except ValidationError as e:
+                            raise ValidationError(
+                                "Invalid rule %(rule)s in category %(name)s: %(error)s",
+                                params={"rule": rule["match_text"], "name": json_entry["name"], "error": " ".join(e.messages)},
+                                code="input_error",
+                            )
         return json_file
 
 
@@ -0,0 +1,143 @@
+import django
+import logging
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.utils import timezone
+from django.db import transaction, connections
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from .models import Job
+from .common import build_user_categorizer, get_recategorization_filter, recategorize_transactions, rule_stats
+from .staging import get_staging_path, merge_staged_uploads, delete_staged_upload
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+
+def register_job(job_type):
+    def decorator(handler):
+        JOB_HANDLERS[job_type] = handler
+        return handler
+
+    return decorator
+
+
+def enqueue_job(user_in, job_type, **params):
+    return Job.objects.create(user=user_in, job_type=job_type, params=params)
+
+
+def claim_next_job():
+    """Mark the oldest queued job as running and return it. Locked rows are skipped so several workers can share the queue."""
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(status="queued").order_by("created").first()
+        if job is None:
+            return None
+        job.status = "running"
+        job.save(update_fields=["status", "updated"])
+    return job
+
+
+def fail_stale_jobs():
+    """Fail the running jobs whose worker stopped reporting progress for JOB_TIMEOUT seconds, e.g. because it crashed or
+    was restarted. They are not requeued since a job that crashes its worker would do so again. Returns their number."""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    return Job.objects.filter(status="running", updated__lt=cutoff).update(
+        status="failed", error="The job was interrupted, please try again.", updated=timezone.now()
+    )
+
+
+def set_job_progress(job, progress, total=None):
+    job.progress = progress
+    if total is not None:
+        job.total = total
+    # updated shows the job is still alive, see fail_stale_jobs
+    Job.objects.filter(pk=job.pk).update(progress=job.progress, total=job.total, updated=timezone.now())
+
+
+def run_job(job):
+    try:
+        JOB_HANDLERS[job.job_type](job)
+        job.status = "done"
+    except ValidationError as e:
+        job.status = "failed"
+        job.error = " ".join(e.messages)
+    except Exception:
+        job.status = "failed"
+        job.error = "Internal server error."
+        logger.exception("Job %s failed", job.pk)
+    rule_stats.flush()
+    job.save(update_fields=["status", "error", "updated"])
+
+
+@register_job("upload")
+def run_upload_job(job):
+    """Validate and stage a raw upload saved by UploadView"""
+    from .forms import FileSelectForm
+
+    try:
+        with default_storage.open(job.params["file"], "rb") as file:
+            form = FileSelectForm(user=job.user)
+            form.validate_upload(
+                file,
+                job.params["parse_rule"],
+                progress=lambda rows: set_job_progress(job, rows),
+                upload_id=job.params["upload_id"],
+                categorizer=build_user_categorizer(job.user),
+            )
+    finally:
+        default_storage.delete(job.params["file"])
+
+
+def stage_batch_file(user_pk, raw_file, parse_rule_pk, name, part_id):
+    """Validate and stage one file of a batch upload as the staged upload part_id. Returns the number of rows staged.
+    Runs in a worker process of the batch upload pool."""
+    from .forms import FileSelectForm
+
+    user = User.objects.get(pk=user_pk)
+    form = FileSelectForm(user=user)
+    try:
+        with default_storage.open(raw_file, "rb") as file:
+            form.validate_upload(file, parse_rule_pk, upload_id=part_id, categorizer=build_user_categorizer(user))
+    except ValidationError as e:
+        raise ValidationError("%(name)s: %(error)s", params={"name": name, "error": " ".join(e.messages)}, code="input_error")
+    return form.row_count
+
+
+@register_job("batch_upload")
+def run_batch_upload_job(job):
+    """Validate and stage every file of a batch upload saved by UploadView, then merge them into one staged upload.
+    Files are parsed in parallel by up to UPLOAD_PROCESSES worker processes."""
+    files = job.params["files"]
+    part_ids = [f"{job.params['upload_id']}-{idx}" for idx in range(len(files))]
+    args = [(job.user.pk, raw_file, parse_rule_pk, name, part_id) for (raw_file, parse_rule_pk, name), part_id in zip(files, part_ids)]
+    processes = min(settings.UPLOAD_PROCESSES, len(files))
+    rows = 0
+    try:
+        if processes <= 1:
+            for file_args in args:
+                rows += stage_batch_file(*file_args)
+                set_job_progress(job, rows)
+        else:
+            # Workers open their own database connections, forked workers must not reuse the parent's
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=processes, initializer=django.setup) as executor:
+                for row_count in executor.map(stage_batch_file, *zip(*args)):
+                    rows += row_count
+                    set_job_progress(job, rows)
+        merge_staged_uploads([get_staging_path(job.user.pk, part_id) for part_id in part_ids], get_staging_path(job.user.pk, job.params["upload_id"]))
+    finally:
+        for part_id in part_ids:
+            delete_staged_upload(job.user.pk, part_id)
+        for raw_file, _, _ in files:
+            default_storage.delete(raw_file)
+
+
+@register_job("recategorize")
+def run_recategorize_job(job):
+    """Recategorize the transactions selected by the changes from get_recategorization_changes. The categorizer is built
+    from the committed rules rather than taken from the cache, so the job never writes back categories of old rules."""
+    txn_filter = get_recategorization_filter(job.params)
+    recategorize_transactions(job.user, build_user_categorizer(job.user), txn_filter, progress=lambda rows, total: set_job_progress(job, rows, total))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from main_app.summaries import rebuild_monthly_summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly transaction summaries from the transaction table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, help="Only rebuild the summaries of the user with this pk")
+
+    def handle(self, *args, **options):
+        count = rebuild_monthly_summaries(options["user"])
+        self.stdout.write(f"Rebuilt {count} monthly summaries")
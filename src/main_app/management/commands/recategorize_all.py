@@ -0,0 +1,37 @@
+import os
+import django
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from main_app.common import build_user_categorizer, recategorize_transactions
+
+
+def recategorize_user(user_pk):
+    """Recategorize all non-override transactions of a user. Returns (user pk, updated transaction count)."""
+    user = User.objects.get(pk=user_pk)
+    return user_pk, recategorize_transactions(user, build_user_categorizer(user))
+
+
+class Command(BaseCommand):
+    help = "Recategorize every user's transactions with their current category rules"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Number of worker processes, 1 runs in this process")
+
+    def handle(self, *args, **options):
+        user_pks = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        if options["processes"] <= 1:
+            self.report(map(recategorize_user, user_pks), len(user_pks))
+            return
+        # Workers open their own database connections, forked workers must not reuse the parent's
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options["processes"], initializer=django.setup) as executor:
+            self.report(executor.map(recategorize_user, user_pks), len(user_pks))
+
+    def report(self, results, user_count):
+        total = 0
+        for user_pk, count in results:
+            total += count
+            self.stdout.write(f"User {user_pk}: {count} transactions recategorized")
+        self.stdout.write(f"Recategorized {total} transactions for {user_count} users")
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from main_app.jobs import claim_next_job, fail_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued upload and recategorization jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty instead of waiting for new jobs")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait between checks of an empty queue")
+
+    def handle(self, *args, **options):
+        while True:
+            if stale_jobs := fail_stale_jobs():
+                self.stdout.write(f"Failed {stale_jobs} interrupted jobs")
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+            run_job(job)
+            self.stdout.write(f"Finished {job}")
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0003_transaction_main_app_tr_date_f3d21a_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_type', models.CharField(choices=[('upload', 'Upload'), ('recategorize', 'Recategorize')], max_length=50)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('params', models.JSONField(default=dict)),
+                ('progress', models.IntegerField(default=0)),
+                ('total', models.IntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created'],
+                'indexes': [models.Index(fields=['status', 'created'], name='main_app_jo_status_d66292_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:14
+
+import hashlib
+from itertools import islice
+from collections import Counter
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+
+
+def get_fingerprint(occurrences, account_pk, txn_date, amount, description):
+    """Frozen copy of pipeline.Fingerprinter as of this migration. The float amounts stored at this point are rounded to
+    cents like the decimal conversion of 0007, so the fingerprints match the ones computed for the same rows uploaded
+    later."""
+    cents = int(Decimal(str(amount)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+    key = f"{account_pk}|{txn_date:%Y-%m-%d}|{cents}|{' '.join(description.casefold().split())}"
+    occurrences[key] += 1
+    return hashlib.sha1(f"{key}|{occurrences[key]}".encode("utf-8")).hexdigest()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    Transaction = apps.get_model("main_app", "Transaction")
+    occurrences = Counter()
+    txns = Transaction.objects.order_by("pk").only("account_id", "date", "amount", "description").iterator(chunk_size=2000)
+    while batch := list(islice(txns, 1000)):
+        for txn in batch:
+            txn.fingerprint = get_fingerprint(occurrences, txn.account_id, txn.date, txn.amount, txn.description)
+        Transaction.objects.bulk_update(batch, ["fingerprint"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0004_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
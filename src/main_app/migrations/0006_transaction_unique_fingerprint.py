@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0005_transaction_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(fields=('fingerprint',), name='unique_transaction_fingerprint'),
+        ),
+    ]
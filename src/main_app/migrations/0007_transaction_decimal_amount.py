@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0006_transaction_unique_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=15),
+        ),
+    ]
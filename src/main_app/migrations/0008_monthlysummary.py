@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def build_summaries(apps, schema_editor):
+    Transaction = apps.get_model("main_app", "Transaction")
+    MonthlySummary = apps.get_model("main_app", "MonthlySummary")
+    rows = Transaction.objects.order_by().annotate(month=TruncMonth("date")).values("user", "month", "category", "account")
+    MonthlySummary.objects.bulk_create(
+        [
+            MonthlySummary(user_id=row["user"], month=row["month"], category_id=row["category"], account_id=row["account"], total=row["total"], count=row["count"])
+            for row in rows.annotate(total=Sum("amount"), count=Count("pk"))
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0007_transaction_decimal_amount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, max_digits=17)),
+                ('count', models.IntegerField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main_app.account')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='main_app.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Monthly summaries',
+                'ordering': ['month'],
+                'indexes': [models.Index(fields=['user', 'month'], name='main_app_mo_user_id_d26979_idx')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_closure(apps, schema_editor):
+    Category = apps.get_model("main_app", "Category")
+    CategoryClosure = apps.get_model("main_app", "CategoryClosure")
+    parents = dict(Category.objects.values_list("pk", "parent_id"))
+    links = []
+    for category_pk in parents:
+        ancestor_pk, depth, seen = category_pk, 0, set()
+        while ancestor_pk is not None and ancestor_pk not in seen:
+            seen.add(ancestor_pk)
+            links.append(CategoryClosure(ancestor_id=ancestor_pk, descendant_id=category_pk, depth=depth))
+            ancestor_pk, depth = parents.get(ancestor_pk), depth + 1
+    CategoryClosure.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0008_monthlysummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.IntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='main_app.category')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='main_app.category')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_category_closure')],
+            },
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
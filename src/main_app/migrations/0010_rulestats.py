@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0009_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuleStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hits', models.BigIntegerField(default=0)),
+                ('evaluations', models.BigIntegerField(default=0)),
+                ('eval_time', models.FloatField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('rule', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='main_app.categoryrule')),
+            ],
+            options={
+                'verbose_name_plural': 'Rule stats',
+            },
+        ),
+    ]
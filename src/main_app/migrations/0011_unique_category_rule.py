@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:36
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def delete_duplicate_rules(apps, schema_editor):
+    # Re-importing a JSON rule file used to create every rule again
+    CategoryRule = apps.get_model("main_app", "CategoryRule")
+    keep = CategoryRule.objects.values("category", "match_type", "match_text").annotate(keep=Min("pk")).values_list("keep", flat=True)
+    CategoryRule.objects.exclude(pk__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0010_rulestats'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_rules, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='categoryrule',
+            constraint=models.UniqueConstraint(fields=('category', 'match_type', 'match_text'), name='unique_category_rule'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0011_unique_category_rule'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='job_type',
+            field=models.CharField(choices=[('upload', 'Upload'), ('batch_upload', 'Batch upload'), ('recategorize', 'Recategorize')], max_length=50),
+        ),
+    ]
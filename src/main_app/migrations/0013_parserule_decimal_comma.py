@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0012_batch_upload_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parserule',
+            name='decimal_comma',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:56
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0013_parserule_decimal_comma'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parserule',
+            name='credit_col',
+            field=models.IntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='parserule',
+            name='credit_values',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='parserule',
+            name='debit_values',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_app', '0014_parserule_debit_credit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parserule',
+            name='file_format',
+            field=models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'Excel (XLSX)'), ('ofx', 'OFX/QFX')], default='csv', max_length=10),
+        ),
+    ]
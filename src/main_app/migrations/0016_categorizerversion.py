@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('main_app', '0015_parserule_file_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorizerVersion',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.CharField(max_length=32)),
+            ],
+        ),
+    ]
@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete
+from django.core.exceptions import ValidationError
+from django.db.models.signals import pre_delete, post_save, post_delete
 
 
 class Category(models.Model):
@@ -20,10 +21,40 @@ class Category(models.Model):
     def get_uncategorized(current_user):
         return Category.objects.get_or_create(user=current_user, name="Uncategorized", defaults={"priority": -1, "parent": None})[0]
 
+    def clean(self):
+        from .closure import check_parent
+
+        try:
+            check_parent(self, self.parent)
+        except ValidationError as e:
+            raise ValidationError({"parent": e})
+
+    def save(self, *args, **kwargs):
+        from .closure import check_parent
+
+        # A cycle is rejected before the row is written, and the row and its closure links are saved together
+        check_parent(self, self.parent)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
 
+class CategoryClosure(models.Model):
+    """Ancestor and descendant pairs of the category tree, maintained by the signals below, see closure.py"""
+
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="descendant_links")
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="ancestor_links")
+    depth = models.IntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["ancestor", "descendant"], name="unique_category_closure")]
+
+    def __str__(self):
+        return f"{self.ancestor} > {self.descendant} ({self.depth})"
+
+
 class Bank(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
@@ -54,16 +85,38 @@ class Transaction(models.Model):
     category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.DO_NOTHING)
     category_override = models.BooleanField()
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
-    amount = models.FloatField()
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    # Identifies the transaction across uploads of overlapping statements, see pipeline.Fingerprinter
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ["date", "description"]
         indexes = [models.Index(fields=["date"]), models.Index(fields=["user", "date"]), models.Index(fields=["user", "category"])]
+        constraints = [models.UniqueConstraint(fields=["fingerprint"], name="unique_transaction_fingerprint")]
 
     def __str__(self):
         return self.description
 
 
+class MonthlySummary(models.Model):
+    """Transaction totals per user, month, category and account, maintained by summaries.refresh_monthly_summaries"""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()
+    category = models.ForeignKey(Category, null=True, blank=True, on_delete=models.CASCADE)
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    total = models.DecimalField(max_digits=17, decimal_places=2)
+    count = models.IntegerField()
+
+    class Meta:
+        ordering = ["month"]
+        verbose_name_plural = "Monthly summaries"
+        indexes = [models.Index(fields=["user", "month"])]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.category} {self.account}"
+
+
 @receiver(pre_delete, sender=User)
 def delete_uncategorized(sender, **kwargs):
     deleted_user = kwargs["instance"]
@@ -72,14 +125,23 @@ def delete_uncategorized(sender, **kwargs):
 
 @receiver(pre_delete, sender=Category)
 def assign_uncategorized(sender, **kwargs):
+    from .closure import detach_children
+    from .summaries import refresh_monthly_summaries
+
     category = kwargs["instance"]
+    detach_children(category)
+    months = list(category.transaction_set.dates("date", "month"))
     category.transaction_set.update(category=Category.get_uncategorized(category.user))
+    refresh_monthly_summaries(category.user_id, months)
 
 
 class ParseRule(models.Model):
+    FORMAT_CHOICES = [("csv", "CSV"), ("xlsx", "Excel (XLSX)"), ("ofx", "OFX/QFX")]
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     account = models.ForeignKey(Account, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
+    # OFX/QFX statements are read as rows of readers.OFX_COLUMNS
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default="csv")
     date_fmt_str = models.CharField(max_length=30)
     csv_delim = models.CharField(default=",", blank=True, max_length=1)
     start_line = models.IntegerField(default=0, blank=True, validators=[MinValueValidator(0)])
@@ -88,11 +150,28 @@ class ParseRule(models.Model):
     sub_desc_col = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(0)])
     amount_col = models.IntegerField(validators=[MinValueValidator(0)])
     txn_type_col = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(0)])
+    # Comma separated values of txn_type_col marking debits and credits, compared case insensitively
+    debit_values = models.CharField(max_length=100, blank=True, default="")
+    credit_values = models.CharField(max_length=100, blank=True, default="")
+    # When set, amount_col holds the debit amounts and credit_col the credit amounts
+    credit_col = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(0)])
     negate_amount = models.BooleanField(default=False)
+    decimal_comma = models.BooleanField(default=False)
 
     class Meta:
         constraints = [models.UniqueConstraint(fields=["name", "user"], name="unique_parse_rule_name")]
 
+    def get_sign_values(self):
+        """Return ({indicator value: sign}, default sign) for txn_type_col. Values missing from the mapping take the
+        default sign when only debit or credit values are configured, otherwise the default is None. Without any
+        configured values the mapping is empty and the amounts keep the sign they have in the file."""
+        debits = {value.strip().casefold(): -1 for value in self.debit_values.split(",") if value.strip()}
+        credits = {value.strip().casefold(): 1 for value in self.credit_values.split(",") if value.strip()}
+        if not debits and not credits:
+            return {}, None
+        default = None if debits and credits else (1 if debits else -1)
+        return {**debits, **credits}, default
+
     def __str__(self):
         return self.name
 
@@ -103,5 +182,115 @@ class CategoryRule(models.Model):
     match_type = models.CharField(max_length=50, choices=OPERATOR_CHOICES, default="contains")
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="rule_set")
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["category", "match_type", "match_text"], name="unique_category_rule")]
+
+    def clean(self):
+        from .regex_rules import check_regex
+
+        if self.match_type == "regex":
+            try:
+                check_regex(self.match_text)
+            except ValidationError as e:
+                raise ValidationError({"match_text": e})
+
     def __str__(self):
         return f"If {self.match_type} {self.match_text} assign {self.category.name} category"
+
+
+class RuleStats(models.Model):
+    """Aggregated categorization statistics of a rule, recorded when CATEGORIZER_STATS is enabled"""
+
+    rule = models.OneToOneField(CategoryRule, on_delete=models.CASCADE, related_name="stats")
+    hits = models.BigIntegerField(default=0)
+    evaluations = models.BigIntegerField(default=0)
+    eval_time = models.FloatField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Rule stats"
+
+    @property
+    def avg_eval_time(self):
+        return self.eval_time / self.evaluations if self.evaluations else 0
+
+    def __str__(self):
+        return f"{self.rule}: {self.hits} hits"
+
+
+class CategorizerVersion(models.Model):
+    """Version stamp of a user's categories and rules, changed by the signals below so every process rebuilds its cached
+    categorizer, see common.CategorizerCache"""
+
+    # Categories deleted with a user change the stamp while the user is being deleted, so the row is kept without a
+    # constraint and overwritten if a new user reuses the pk
+    user = models.OneToOneField(User, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True)
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.user}: {self.version}"
+
+
+class Job(models.Model):
+    JOB_TYPES = {"upload": "Upload", "batch_upload": "Batch upload", "recategorize": "Recategorize"}
+    STATUS_CHOICES = {"queued": "Queued", "running": "Running", "done": "Done", "failed": "Failed"}
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    job_type = models.CharField(max_length=50, choices=JOB_TYPES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    params = models.JSONField(default=dict)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created"]
+        indexes = [models.Index(fields=["status", "created"])]
+
+    def __str__(self):
+        return f"{self.job_type} job {self.pk} ({self.status})"
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_categorizer(sender, **kwargs):
+    # A new user may reuse the pk of a deleted one
+    if kwargs.get("created", False):
+        from .common import invalidate_user_categorizer
+
+        invalidate_user_categorizer(kwargs["instance"].pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_categorizer(sender, **kwargs):
+    # A newly created category has no rules yet so it cannot change how anything is categorized
+    if not kwargs.get("created", False):
+        from .common import invalidate_user_categorizer
+
+        invalidate_user_categorizer(kwargs["instance"].user_id)
+
+
+@receiver(post_save, sender=Category)
+def update_category_closure(sender, **kwargs):
+    if not kwargs.get("raw", False):
+        from .closure import move_category
+
+        move_category(kwargs["instance"])
+
+
+@receiver(post_save, sender=CategoryRule)
+def reset_rule_stats(sender, **kwargs):
+    # The statistics of an edited rule describe its old pattern
+    if not kwargs.get("created", False):
+        RuleStats.objects.filter(rule=kwargs["instance"]).delete()
+
+
+@receiver(post_save, sender=CategoryRule)
+@receiver(post_delete, sender=CategoryRule)
+def invalidate_rule_categorizer(sender, **kwargs):
+    from .common import invalidate_user_categorizer
+
+    user_pk = Category.objects.filter(pk=kwargs["instance"].category_id).values_list("user_id", flat=True).first()
+    if user_pk is not None:
+        invalidate_user_categorizer(user_pk)
@@ -0,0 +1,102 @@
+import re
+from datetime import datetime
+from decimal import Decimal
+
+# Fixed widths of the numeric strptime directives the fast date path handles
+FIELD_WIDTHS = {"Y": 4, "y": 2, "m": 2, "d": 2, "H": 2, "M": 2, "S": 2}
+DATE_MEMO_SIZE = 10000
+_DIRECTIVE_RE = re.compile(r"%(.)|([^%]+)")
+
+
+class DateParser:
+    """Parse dates of one strptime format with the same results as datetime.strptime.
+
+    Formats made only of zero padded numeric fields and separators, e.g. %Y-%m-%d, are compiled into a slicer reading
+    each field at a fixed offset. Strings of any other length or shape, and other formats, go through strptime. Parsed
+    strings are memoized since statements repeat the same dates many times.
+    """
+
+    def __init__(self, date_fmt):
+        self.date_fmt = date_fmt
+        self.memo = {}
+        self.fields = None
+        self.literals = None
+        self.length = 0
+        fields, literals, offset = [], [], 0
+        for directive, literal in _DIRECTIVE_RE.findall(date_fmt):
+            if literal:
+                # strptime matches whitespace loosely and letters case insensitively
+                if any(char.isspace() or char.isalnum() for char in literal):
+                    return
+                literals.append((offset, literal))
+                offset += len(literal)
+            elif directive in FIELD_WIDTHS:
+                fields.append((directive, offset, offset + FIELD_WIDTHS[directive]))
+                offset += FIELD_WIDTHS[directive]
+            else:
+                return
+        if {directive for directive, _, _ in fields} >= {"m", "d"} and {"Y", "y"} & {directive for directive, _, _ in fields}:
+            self.fields, self.literals, self.length = fields, literals, offset
+
+    def _slice(self, text):
+        """Return the datetime read at the fixed field offsets, or None if text does not have the fixed layout"""
+        if len(text) != self.length or not text.isascii():
+            return None
+        for offset, literal in self.literals:
+            if not text.startswith(literal, offset):
+                return None
+        values = {}
+        for directive, start, stop in self.fields:
+            value = text[start:stop]
+            if not value.isdigit():
+                return None
+            values[directive] = int(value)
+        if "Y" in values:
+            year = values["Y"]
+        else:
+            year = values["y"] + (2000 if values["y"] <= 68 else 1900)
+        return datetime(year, values["m"], values["d"], values.get("H", 0), values.get("M", 0), values.get("S", 0))
+
+    def __call__(self, text):
+        parsed = self.memo.get(text)
+        if parsed is None:
+            parsed = self._slice(text) if self.fields else None
+            if parsed is None:
+                parsed = datetime.strptime(text, self.date_fmt)
+            if len(self.memo) >= DATE_MEMO_SIZE:
+                self.memo.clear()
+            self.memo[text] = parsed
+        return parsed
+
+
+class AmountParser:
+    """Clean and parse amount strings in a single pass.
+
+    Currency signs and thousands separators are removed with one str.translate, giving the same text as the chained
+    str.replace calls it replaces. Accounting style negatives in parentheses, e.g. (12.50), are also accepted. With a
+    decimal comma, periods and spaces are thousands separators and the comma is the decimal point.
+    """
+
+    def __init__(self, decimal_comma=False):
+        if decimal_comma:
+            self.table = str.maketrans({"$": None, ".": None, " ": None, "\u00a0": None, ",": "."})
+        else:
+            self.table = str.maketrans({"$": None, ",": None})
+
+    def clean(self, text):
+        return text.translate(self.table)
+
+    def __call__(self, cleaned):
+        """Return the Decimal of a cleaned amount string, raising InvalidOperation if it is not a number"""
+        stripped = cleaned.strip()
+        if stripped.startswith("(") and stripped.endswith(")"):
+            return -Decimal(stripped[1:-1])
+        return Decimal(cleaned)
+
+
+class RowParser:
+    """Date and amount parsers compiled for one parse rule"""
+
+    def __init__(self, parse_rule):
+        self.parse_date = DateParser(parse_rule.date_fmt_str)
+        self.parse_amount = AmountParser(parse_rule.decimal_comma)
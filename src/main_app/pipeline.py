@@ -0,0 +1,171 @@
+import hashlib
+from itertools import islice
+from collections import Counter
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from django.conf import settings
+from django.db import transaction
+from django.core.exceptions import ValidationError
+from .models import Transaction
+from .parsers import RowParser
+
+CENT = Decimal("0.01")
+# Amounts are stored with 15 digits, 2 after the decimal point
+MAX_AMOUNT = Decimal("1e13")
+
+
+def batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def _parse_amount(parser, text, line, column):
+    amount_text = parser.parse_amount.clean(text)
+    try:
+        # Parsed as a decimal so the stored amount is exactly the one in the file, rounded to cents half up like the
+        # amounts backfilled by migrations 0005 and 0007, so their fingerprints match
+        amount = parser.parse_amount(amount_text).quantize(CENT, rounding=ROUND_HALF_UP)
+        if not amount.is_finite() or abs(amount) >= MAX_AMOUNT:
+            raise InvalidOperation
+    except InvalidOperation:
+        raise ValidationError(
+            "The value (%(val)s) on line %(line)s column %(column)s is not a number. The amount column should only contain numbers",
+            params={"line": line, "column": column, "val": amount_text},
+            code="input_error",
+        )
+    return amount
+
+
+def _has_sign_indicator(parse_rule):
+    # Rules whose txn_type_col was set before indicator values could be configured keep the sign of the file
+    return parse_rule.txn_type_col is not None and bool(parse_rule.get_sign_values()[0])
+
+
+def parse_unsigned_rows(rows, parse_rule):
+    """Validate raw rows against the parse rule and yield (line, date, description, amount, sign key), parsing every
+    value once. With a credit/debit indicator or credit column the amount is unsigned and the sign key selects its sign
+    in get_sign_lookup, otherwise the amount is as written in the file and the sign key is None."""
+    col_num = 0
+    parser = RowParser(parse_rule)
+    sign_indicator = _has_sign_indicator(parse_rule)
+    for line, row in rows:
+        try:
+            # Check all rows have same number of columns
+            if col_num != len(row) and col_num != 0:
+                raise ValidationError("Invalid CSV file, all rows must have the same number of columns.", params={"line": line}, code="input_error")
+            col_num = len(row)
+
+            try:
+                date = parser.parse_date(row[parse_rule.date_col])
+            except ValueError:
+                raise ValidationError("Error parsing date on line %(line)s.", params={"line": line}, code="input_error")
+
+            if parse_rule.credit_col is not None:
+                debit = _parse_amount(parser, row[parse_rule.amount_col], line, parse_rule.amount_col) if row[parse_rule.amount_col].strip() else Decimal(0)
+                credit = _parse_amount(parser, row[parse_rule.credit_col], line, parse_rule.credit_col) if row[parse_rule.credit_col].strip() else Decimal(0)
+                if debit and credit:
+                    raise ValidationError("Line %(line)s has both a debit and a credit amount.", params={"line": line}, code="input_error")
+                amount, sign_key = (abs(debit), "debit") if debit else (abs(credit), "credit")
+            elif sign_indicator:
+                amount = abs(_parse_amount(parser, row[parse_rule.amount_col], line, parse_rule.amount_col))
+                sign_key = row[parse_rule.txn_type_col].strip().casefold()
+            else:
+                amount, sign_key = _parse_amount(parser, row[parse_rule.amount_col], line, parse_rule.amount_col), None
+
+            description = row[parse_rule.desc_col].strip()
+            if parse_rule.sub_desc_col:
+                description += " " + row[parse_rule.sub_desc_col].strip()
+        except IndexError:
+            raise ValidationError("Indexing error present on line %(line)s.", params={"line": line}, code="input_error")
+        yield line, date, description, amount, sign_key
+
+
+def get_sign_lookup(parse_rule):
+    """Return ({sign key: sign}, default sign) for the rows of parse_unsigned_rows, including negate_amount. A default
+    of None means rows with other sign keys are invalid."""
+    if parse_rule.credit_col is not None:
+        signs, default = {"debit": -1, "credit": 1}, None
+    elif _has_sign_indicator(parse_rule):
+        signs, default = parse_rule.get_sign_values()
+    else:
+        signs, default = {None: 1}, None
+    negate = -1 if parse_rule.negate_amount else 1
+    return {sign_key: sign * negate for sign_key, sign in signs.items()}, default and default * negate
+
+
+def apply_signs(rows, parse_rule, batch_size=None):
+    """Sign the amounts of unsigned rows, looking up the signs of a whole batch before applying them"""
+    signs, default = get_sign_lookup(parse_rule)
+    for batch in batched(rows, batch_size or settings.UPLOAD_BATCH_SIZE):
+        batch_signs = [signs.get(row[4], default) for row in batch]
+        if None in batch_signs:
+            line, _, _, _, sign_key = batch[batch_signs.index(None)]
+            raise ValidationError("Unknown credit/debit indicator (%(val)s) on line %(line)s.", params={"line": line, "val": sign_key}, code="input_error")
+        for (line, date, description, amount, _), sign in zip(batch, batch_signs):
+            yield line, date, description, amount * sign
+
+
+def parse_rows(rows, parse_rule):
+    """Validate raw rows against the parse rule and yield (line, date, description, signed amount)"""
+    return apply_signs(parse_unsigned_rows(rows, parse_rule), parse_rule)
+
+
+def categorize_rows(rows, categorizer, batch_size=None):
+    """Append the pk of the assigned category to each parsed row, categorizing a batch of descriptions at a time"""
+    for batch in batched(rows, batch_size or settings.UPLOAD_BATCH_SIZE):
+        for (line, date, description, amount), category_pk in zip(batch, categorizer.categorize_many(row[2] for row in batch)):
+            yield line, date, description, category_pk, amount
+
+
+def normalize_description(description):
+    return " ".join(description.casefold().split())
+
+
+class Fingerprinter:
+    """Compute the duplicate detection fingerprints of transactions taken in statement order.
+
+    A fingerprint hashes the account, date, amount in cents and normalized description. Identical transactions within a
+    statement, e.g. two coffees on the same day, are told apart by counting how many were seen before, so uploading an
+    overlapping statement reproduces the same fingerprints while genuine repeats stay distinct.
+    """
+
+    def __init__(self):
+        self.occurrences = Counter()
+
+    def __call__(self, account_pk, txn_date, amount, description):
+        key = f"{account_pk}|{txn_date:%Y-%m-%d}|{round(amount * 100)}|{normalize_description(description)}"
+        self.occurrences[key] += 1
+        return hashlib.sha1(f"{key}|{self.occurrences[key]}".encode("utf-8")).hexdigest()
+
+
+def fingerprint_rows(rows, account_pk):
+    """Append the fingerprint to each categorized row"""
+    fingerprinter = Fingerprinter()
+    for line, date, description, category_pk, amount in rows:
+        yield line, date, description, category_pk, amount, fingerprinter(account_pk, date, amount, description)
+
+
+def flag_duplicate_rows(rows, batch_size=None):
+    """Append whether each fingerprinted row was already uploaded. Fingerprints are looked up a batch at a time."""
+    for batch in batched(rows, batch_size or settings.UPLOAD_BATCH_SIZE):
+        existing = set(Transaction.objects.filter(fingerprint__in=[row[-1] for row in batch]).values_list("fingerprint", flat=True))
+        for row in batch:
+            yield *row, row[-1] in existing
+
+
+def write_staged_rows(rows, writer, account_pk, progress=None):
+    """Append fingerprinted and flagged rows to a StagingWriter one at a time. Returns the number of rows written."""
+    count = 0
+    for count, (line, date, description, category_pk, amount, fingerprint, duplicate) in enumerate(rows, start=1):
+        writer.append(date, description, category_pk, amount, account_pk, fingerprint, duplicate)
+        if progress and count % 1000 == 0:
+            progress(count)
+    return count
+
+
+def bulk_create_transactions(txns, batch_size=None, ignore_conflicts=False):
+    """Insert an iterable of unsaved transactions in fixed size chunks inside a single database transaction.
+    ignore_conflicts skips transactions whose fingerprint already exists."""
+    with transaction.atomic():
+        for batch in batched(txns, batch_size or settings.UPLOAD_BATCH_SIZE):
+            Transaction.objects.bulk_create(batch, ignore_conflicts=ignore_conflicts)
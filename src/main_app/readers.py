@@ -0,0 +1,112 @@
+import io
+import re
+import html
+import csv
+import zipfile
+from datetime import date
+from itertools import islice
+from django.core.exceptions import ValidationError
+
+# Statement readers turn an uploaded file into (line, row) pairs of string cells for parse_rows. Every reader streams
+# rows from the file instead of loading the whole document.
+READERS = {}
+# Cells of the rows read from OFX/QFX statements, a parse rule targets them by index. Dates are formatted as %Y%m%d.
+OFX_COLUMNS = ["date", "name", "memo", "amount", "type", "id"]
+OFX_CHUNK_SIZE = 64 * 1024
+_OFX_TAG_RE = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+def register_reader(file_format):
+    def decorator(reader):
+        READERS[file_format] = reader
+        return reader
+
+    return decorator
+
+
+def read_rows(file, parse_rule):
+    """Yield (line, row) for every row of an uploaded statement after the parse rule's start line"""
+    return READERS[parse_rule.file_format](file, parse_rule)
+
+
+def _number_rows(rows, parse_rule):
+    return enumerate(islice(rows, parse_rule.start_line, None), start=parse_rule.start_line)
+
+
+@register_reader("csv")
+def read_csv_rows(file, parse_rule):
+    """Read a CSV file, decoding binary files as utf-8"""
+    if not isinstance(file, io.TextIOBase):
+        file = io.TextIOWrapper(file, encoding="utf-8-sig")
+    return _number_rows(csv.reader(file, delimiter=parse_rule.csv_delim or ","), parse_rule)
+
+
+def _xlsx_cell(value, date_fmt):
+    if value is None:
+        return ""
+    if isinstance(value, date):
+        # Date cells are written out in the parse rule's date format so they parse like text dates
+        return value.strftime(date_fmt)
+    return str(value)
+
+
+@register_reader("xlsx")
+def read_xlsx_rows(file, parse_rule):
+    """Read the active sheet of an Excel workbook in read only mode, which loads one row at a time"""
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValidationError("Excel uploads are not supported on this server.", code="internal_error")
+    try:
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, KeyError, OSError):
+        raise ValidationError("The uploaded file is not a valid Excel workbook.", code="input_error")
+    try:
+        sheet = workbook.active
+        width = sheet.max_column or 0
+        rows = (
+            [_xlsx_cell(value, parse_rule.date_fmt_str) for value in row] + [""] * (width - len(row))
+            for row in sheet.iter_rows(values_only=True)
+            if any(value is not None for value in row)
+        )
+        yield from _number_rows(rows, parse_rule)
+    finally:
+        workbook.close()
+
+
+def iter_ofx_transactions(file, chunk_size=OFX_CHUNK_SIZE):
+    """Yield the OFX_COLUMNS cells of every STMTTRN element, reading the document a chunk at a time. Handles both the
+    SGML (OFX 1.x, QFX) and XML (OFX 2.x) variants, which differ in whether leaf elements are closed."""
+    buffer = ""
+    transaction = None
+    while True:
+        chunk = file.read(chunk_size)
+        buffer += chunk
+        # The text of the last tag may continue in the next chunk
+        cut = max(buffer.rfind("<"), 0) if chunk else len(buffer)
+        for closing, tag, value in _OFX_TAG_RE.findall(buffer, 0, cut):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if closing and transaction is not None:
+                    yield [
+                        transaction.get("DTPOSTED", "")[:8],
+                        transaction.get("NAME", ""),
+                        transaction.get("MEMO", ""),
+                        transaction.get("TRNAMT", ""),
+                        transaction.get("TRNTYPE", ""),
+                        transaction.get("FITID", ""),
+                    ]
+                transaction = None if closing else {}
+            elif transaction is not None and not closing:
+                transaction[tag] = html.unescape(value.strip())
+        buffer = buffer[cut:]
+        if not chunk:
+            return
+
+
+@register_reader("ofx")
+def read_ofx_rows(file, parse_rule):
+    """Read the transactions of an OFX or QFX statement as rows of OFX_COLUMNS"""
+    if not isinstance(file, io.TextIOBase):
+        file = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace")
+    return _number_rows(iter_ofx_transactions(file), parse_rule)
@@ -0,0 +1,131 @@
+import re
+import functools
+import regex
+from django.core.exceptions import ValidationError
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", sre_parse.MAX_REPEAT)}
+
+
+def _is_nullable(items):
+    """Whether a parsed sequence can match the empty string, erring on yes"""
+    for op, av in items:
+        if op in _REPEATS:
+            nullable = av[0] == 0 or _is_nullable(av[2])
+        elif op is sre_parse.SUBPATTERN:
+            nullable = _is_nullable(av[-1])
+        elif op is sre_parse.BRANCH:
+            nullable = any(_is_nullable(branch) for branch in av[1])
+        else:
+            nullable = op not in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+        if not nullable:
+            return False
+    return True
+
+
+def _first_chars(items):
+    """Return the set of characters a match of a parsed sequence can start with, or None if it is not known"""
+    chars = set()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            return chars | {chr(av).lower(), chr(av).upper()}
+        elif op is sre_parse.IN and all(item_op is sre_parse.LITERAL for item_op, _ in av):
+            return chars | {case(chr(item_av)) for _, item_av in av for case in (str.lower, str.upper)}
+        elif op in _REPEATS or op is sre_parse.SUBPATTERN or op is sre_parse.BRANCH:
+            subs = [av[2]] if op in _REPEATS else [av[-1]] if op is sre_parse.SUBPATTERN else av[1]
+            for sub in subs:
+                sub_chars = _first_chars(sub)
+                if sub_chars is None:
+                    return None
+                chars |= sub_chars
+            if not _is_nullable([(op, av)]):
+                return chars
+        elif op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            continue
+        else:
+            return None
+    return None
+
+
+def _branches_overlap(branches):
+    """Whether two branches of an alternation may match the same text, e.g. a|a, a|aa or an empty branch"""
+    seen = set()
+    for branch in branches:
+        chars = _first_chars(branch)
+        if chars is None or _is_nullable(branch) or chars & seen:
+            return True
+        seen |= chars
+    return False
+
+
+def _find_dangerous(items, in_repeat=False):
+    """Return a description of the first construct prone to catastrophic backtracking, or None.
+
+    Inside a repeat, a variable length repeat, an alternation whose branches can match the same text or a backreference,
+    e.g. (a+)+, (a?){25}, (a|aa)+ or (\\1)*, can make the regex engine try exponentially many ways of splitting the same
+    text when a match fails.
+    """
+    for op, av in items:
+        if op in _REPEATS:
+            low, high, sub = av
+            if in_repeat and low != high:
+                return "nested repeats"
+            found = _find_dangerous(sub, in_repeat or high > 1)
+        elif op is sre_parse.GROUPREF:
+            found = "a backreference inside a repeat" if in_repeat else None
+        elif op is sre_parse.SUBPATTERN:
+            found = _find_dangerous(av[-1], in_repeat)
+        elif op is sre_parse.BRANCH:
+            if in_repeat and _branches_overlap(av[1]):
+                return "an alternation with overlapping branches inside a repeat"
+            found = next((branch_found for branch in av[1] if (branch_found := _find_dangerous(branch, in_repeat))), None)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            found = _find_dangerous(av[1], in_repeat)
+        elif op is sre_parse.GROUPREF_EXISTS:
+            found = _find_dangerous(av[1], in_repeat) or (av[2] and _find_dangerous(av[2], in_repeat))
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            found = _find_dangerous(av, in_repeat)
+        else:
+            found = None
+        if found:
+            return found
+    return None
+
+
+def check_regex(pattern):
+    """Compile a regex rule pattern, raising a ValidationError if it is invalid or prone to catastrophic backtracking"""
+    try:
+        compiled = re.compile(pattern)
+        dangerous = _find_dangerous(sre_parse.parse(pattern))
+    except re.error as e:
+        raise ValidationError("Invalid regular expression: %(error)s", params={"error": e}, code="input_error")
+    if dangerous:
+        raise ValidationError(
+            "The regular expression uses %(construct)s, which can be very slow to evaluate.", params={"construct": dangerous}, code="input_error"
+        )
+    return compiled
+
+
+def get_regex_error(pattern):
+    """Return the message check_regex rejects a pattern with, or None if it is accepted"""
+    try:
+        check_regex(pattern)
+    except ValidationError as e:
+        return " ".join(e.messages)
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_rule_regex(pattern):
+    """Return the pattern of a regex rule compiled with the regex module, whose searches take a timeout, or None if
+    check_regex rejects it. Rules saved before patterns were validated are skipped this way rather than failing
+    categorization, see Categorizer.skipped_rules."""
+    try:
+        check_regex(pattern)
+        return regex.compile(pattern)
+    except (ValidationError, regex.error):
+        return None
@@ -0,0 +1,48 @@
+from django.db import transaction
+from .models import Category, CategoryRule
+from .closure import rebuild_category_closure
+
+
+def import_category_rules(user_in, json_data):
+    """Upsert the categories and rules of a validated JSON rule file.
+
+    Categories are matched by name and only their priority is updated, rules are matched on (category, match_type,
+    match_text) so importing the same file twice changes nothing. Existing categories and rules missing from the file are
+    kept. Returns a dict counting the created and updated categories and the created and unchanged rules.
+    """
+    priorities = {}
+    file_rules = {}
+    for json_entry in json_data:
+        priorities[json_entry["name"]] = json_entry["priority"]
+        rules = file_rules.setdefault(json_entry["name"], {})
+        rules.update(dict.fromkeys((rule["match_type"], rule["match_text"]) for rule in json_entry["rules"]))
+
+    with transaction.atomic():
+        existing = {cat.name: cat for cat in Category.objects.filter(user=user_in, name__in=priorities).select_for_update()}
+        new_cats = [Category(user=user_in, name=name, priority=priority, parent=None) for name, priority in priorities.items() if name not in existing]
+        changed_cats = []
+        for name, cat in existing.items():
+            if cat.priority != priorities[name]:
+                cat.priority = priorities[name]
+                changed_cats.append(cat)
+        Category.objects.bulk_create(new_cats)
+        Category.objects.bulk_update(changed_cats, ["priority"])
+
+        cat_pks = dict(Category.objects.filter(user=user_in, name__in=priorities).values_list("name", "pk"))
+        existing_rules = set(CategoryRule.objects.filter(category__in=cat_pks.values()).values_list("category_id", "match_type", "match_text"))
+        new_rules = [
+            CategoryRule(category_id=cat_pks[name], match_type=match_type, match_text=match_text)
+            for name, rules in file_rules.items()
+            for match_type, match_text in rules
+            if (cat_pks[name], match_type, match_text) not in existing_rules
+        ]
+        CategoryRule.objects.bulk_create(new_rules, ignore_conflicts=True)
+        if new_cats:
+            rebuild_category_closure(user_in.pk)
+
+    return {
+        "categories_created": len(new_cats),
+        "categories_updated": len(changed_cats),
+        "rules_created": len(new_rules),
+        "rules_unchanged": sum(len(rules) for rules in file_rules.values()) - len(new_rules),
+    }
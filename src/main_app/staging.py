@@ -0,0 +1,175 @@
+import os
+import mmap
+import time
+import shutil
+from array import array
+from datetime import date
+from decimal import Decimal
+from django.conf import settings
+
+# Staged uploads are stored as a directory holding one packed array file per column. Descriptions are stored as a utf-8
+# string table with an offsets column. Arrays use the native byte order since they are written and read on one host.
+# Category and account pks use 64 bit integers to match the BigAutoField primary keys. Amounts are stored as integer
+# cents so they round trip exactly. Fingerprints are stored as fixed width sha1 digests.
+COLUMNS = {"dates": "i", "amounts": "q", "categories": "q", "accounts": "q", "desc_offsets": "q", "duplicates": "b"}
+FINGERPRINT_SIZE = 20
+STAGING_MAX_AGE = 24 * 60 * 60
+
+
+def get_staging_dir(user_pk):
+    return os.path.join(settings.MEDIA_ROOT, "staging", str(user_pk))
+
+
+def get_staging_path(user_pk, upload_id):
+    return os.path.join(get_staging_dir(user_pk), upload_id)
+
+
+def staged_upload_exists(user_pk, upload_id):
+    return os.path.isdir(get_staging_path(user_pk, upload_id))
+
+
+def delete_staged_upload(user_pk, upload_id):
+    shutil.rmtree(get_staging_path(user_pk, upload_id), ignore_errors=True)
+
+
+def delete_stale_uploads(user_pk, max_age=STAGING_MAX_AGE):
+    """Remove staged uploads that were never committed or cancelled"""
+    staging_dir = get_staging_dir(user_pk)
+    if not os.path.isdir(staging_dir):
+        return
+    for entry in os.scandir(staging_dir):
+        if time.time() - entry.stat().st_mtime > max_age:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class StagingWriter:
+    """Write a staged upload one row at a time. Columns are buffered in small arrays and appended to their files in
+    blocks, the staged upload only appears under its final path once all rows have been written."""
+
+    BLOCK_SIZE = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        os.makedirs(self.tmp_path)
+        self.files = {name: open(os.path.join(self.tmp_path, name), "wb") for name in [*COLUMNS, "descriptions", "fingerprints"]}
+        self.buffers = {name: array(code) for name, code in COLUMNS.items()}
+        self.desc_buffer = bytearray()
+        self.fingerprint_buffer = bytearray()
+        self.desc_offset = 0
+        self.count = 0
+        self.buffers["desc_offsets"].append(0)
+
+    def append(self, txn_date, description, category_pk, amount, account_pk, fingerprint, duplicate=False):
+        encoded = description.encode("utf-8")
+        self.desc_offset += len(encoded)
+        self.desc_buffer += encoded
+        self.buffers["dates"].append(txn_date.toordinal())
+        self.buffers["amounts"].append(int(amount.scaleb(2)))
+        self.buffers["categories"].append(category_pk)
+        self.buffers["accounts"].append(account_pk)
+        self.buffers["desc_offsets"].append(self.desc_offset)
+        self.buffers["duplicates"].append(duplicate)
+        self.fingerprint_buffer += bytes.fromhex(fingerprint)
+        self.count += 1
+        if len(self.buffers["dates"]) >= self.BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        for name, buffer in self.buffers.items():
+            buffer.tofile(self.files[name])
+            del buffer[:]
+        self.files["descriptions"].write(self.desc_buffer)
+        self.desc_buffer.clear()
+        self.files["fingerprints"].write(self.fingerprint_buffer)
+        self.fingerprint_buffer.clear()
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            self.close()
+            os.replace(self.tmp_path, self.path)
+        else:
+            self.close()
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def merge_staged_uploads(part_paths, path):
+    """Concatenate staged uploads into a new staged upload at path. Rows whose fingerprint was already staged by an
+    earlier part are flagged as duplicates, so overlapping statements uploaded together are only committed once."""
+    seen = set()
+    with StagingWriter(path) as writer:
+        for part_path in part_paths:
+            with StagedUpload(part_path) as part:
+                for idx in range(len(part)):
+                    txn_date, description, category_pk, amount, account_pk = part.get_row(idx)
+                    fingerprint = part.get_fingerprint(idx)
+                    writer.append(txn_date, description, category_pk, amount, account_pk, fingerprint, part.is_duplicate(idx) or fingerprint in seen)
+                    seen.add(fingerprint)
+    return writer.count
+
+
+class StagedUpload:
+    """Read only view of a staged upload. The column files are memory mapped so rows are read without copying the
+    arrays into memory."""
+
+    def __init__(self, path):
+        self.maps = []
+        self.views = []
+        for name, code in COLUMNS.items():
+            setattr(self, name, self._map(path, name, code))
+        self.descriptions = self._map(path, "descriptions")
+        self.fingerprints = self._map(path, "fingerprints")
+
+    def _map(self, path, name, code=None):
+        with open(os.path.join(path, name), "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                view = memoryview(b"")
+            else:
+                self.maps.append(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+                view = memoryview(self.maps[-1])
+        self.views.append(view)
+        if code is not None:
+            view = view.cast(code)
+            self.views.append(view)
+        return view
+
+    def __len__(self):
+        return len(self.dates)
+
+    def get_description(self, idx):
+        return str(self.descriptions[self.desc_offsets[idx] : self.desc_offsets[idx + 1]], "utf-8")
+
+    def get_row(self, idx):
+        """Return (date, description, category pk, amount, account pk) for the row at idx"""
+        amount = Decimal(self.amounts[idx]).scaleb(-2)
+        return date.fromordinal(self.dates[idx]), self.get_description(idx), self.categories[idx], amount, self.accounts[idx]
+
+    def get_fingerprint(self, idx):
+        return self.fingerprints[idx * FINGERPRINT_SIZE : (idx + 1) * FINGERPRINT_SIZE].hex()
+
+    def is_duplicate(self, idx):
+        """Whether the row matched an existing transaction when it was staged"""
+        return bool(self.duplicates[idx])
+
+    def __iter__(self):
+        return (self.get_row(idx) for idx in range(len(self)))
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        for staging_map in self.maps:
+            staging_map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
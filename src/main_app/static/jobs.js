@@ -0,0 +1,19 @@
+// Poll a background job until it finishes, updating the status element with its progress
+async function pollJob(statusUrl, statusElement, onDone) {
+    const response = await fetch(statusUrl)
+    if (!response.ok) {
+        console.error("Response status: " + response.status);
+        return
+    }
+    const job = await response.json()
+    if (job.status == "done") {
+        onDone()
+    } else if (job.status == "failed") {
+        statusElement.classList.replace("alert-info", "alert-danger")
+        statusElement.textContent = job.error
+    } else {
+        var progressText = job.total ? job.progress + " / " + job.total : job.progress
+        statusElement.textContent = (job.status == "queued" ? "Waiting to start..." : "Processing... " + progressText + " rows")
+        setTimeout(() => pollJob(statusUrl, statusElement, onDone), 1000)
+    }
+}
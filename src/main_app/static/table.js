@@ -4,14 +4,46 @@ var categoryMap = new Map()
 for (category of categories) {
     categoryMap.set(category[1], category[0])
 }
+// Keyset paginated tables load pages progressively while scrolling. Each response carries the cursor of the next page,
+// which is sent back instead of an offset. Sorting and filtering are done by the server.
+var pageCursors = new Map()
+var keysetOptions = {
+    progressiveLoad: "scroll",
+    paginationMode: "remote",
+    paginationSize: pageSize,
+    sortMode: "remote",
+    filterMode: "remote",
+    ajaxURLGenerator: function (url, config, params) {
+        var query = new URLSearchParams({ page: params.page, size: params.size })
+        if (params.page > 1 && pageCursors.has(params.page)) {
+            query.set("cursor", pageCursors.get(params.page))
+        }
+        query.set("sort", JSON.stringify(params.sort || []))
+        query.set("filter", JSON.stringify(params.filter || []))
+        return url + "?" + query.toString()
+    },
+    ajaxResponse: function (url, params, response) {
+        if (response.next_cursor) {
+            pageCursors.set(params.page + 1, response.next_cursor)
+        }
+        return response
+    },
+}
+var pageOptions = {
+    pagination: remotePagination,
+    paginationMode: "remote",
+    paginationSize: pageSize,
+    paginationCounter: "rows",
+}
+
 var table = new Tabulator("#txn-table", {
+    ...(keysetPagination ? keysetOptions : pageOptions),
     dependencies: {
         DateTime: luxon.DateTime,
     },
     height: "90vh",
     index: "idx",
-    ajaxURL: pageUrl,
-    ajaxParams: { getTxnData: "True" },
+    ajaxURL: dataUrl,
     movableRows: false,
     rowHeader: { formatter: "rowSelection", titleFormatter: "plaintext", title: rowSelectTitle, hozAlign: "center", headerSort: false, resizable: false },
     selectableRowsRangeMode: "click",
@@ -25,16 +57,17 @@ var table = new Tabulator("#txn-table", {
                 timezone: "America/Los_Angeles",
             }
         },
-        { title: "Account", field: "accnt", sorter: "string" },
-        { title: "Description", field: "desc", sorter: "string" },
+        { title: "Account", field: "accnt", sorter: "string", headerFilter: "input" },
+        { title: "Description", field: "desc", sorter: "string", headerFilter: "input" },
         { title: "Amount", field: "amnt", sorter: "number" },
         {
             title: "Category", field: "cat", sorter: "string", editor: "list", validator: "required", editorParams: {
                 values: categoryNames,
                 allowEmpty: false,
-            }
+            }, headerFilter: "list", headerFilterFunc: "=", headerFilterParams: { values: categoryNames, clearable: true }
         },
         { title: "Category Override", field: "cat_o", sorter: "boolean", formatter: "tickCross", editor: true },
+        { title: "Duplicate", field: "dup", formatter: "tickCross", formatterParams: { crossElement: false }, visible: showDuplicates },
     ],
 });
 
@@ -42,6 +75,11 @@ var table = new Tabulator("#txn-table", {
 const tooltipTriggerList = document.querySelectorAll('[data-bs-toggle="tooltip"]')
 const tooltipList = [...tooltipTriggerList].map(tooltipTriggerEl => new bootstrap.Tooltip(tooltipTriggerEl))
 
+// With remote pagination only the current page is loaded, so edits and selections are tracked by row index to keep
+// them when moving between pages
+var editedRows = new Map()
+var deletedRows = new Set()
+
 table.on("cellEdited", function (cell) {
     if (cell.getField() == "cat") {
         cell.getRow().update({ "cat_o": true })
@@ -49,6 +87,27 @@ table.on("cellEdited", function (cell) {
     if (cell.getField() == "cat_o") {
         cell.getRow().getCell("cat").restoreInitialValue()
     }
+    var row = cell.getRow()
+    editedRows.set(row.getIndex(), { cat: row.getCell("cat").getValue(), cat_o: row.getCell("cat_o").getValue() })
+});
+
+table.on("rowSelected", function (row) {
+    deletedRows.add(Number(row.getIndex()))
+});
+
+table.on("rowDeselected", function (row) {
+    deletedRows.delete(Number(row.getIndex()))
+});
+
+table.on("dataProcessed", function () {
+    for (row of table.getRows()) {
+        if (editedRows.has(row.getIndex())) {
+            row.update(editedRows.get(row.getIndex()))
+        }
+        if (deletedRows.has(Number(row.getIndex()))) {
+            row.select()
+        }
+    }
 });
 
 async function handleResponse(response) {
@@ -56,33 +115,30 @@ async function handleResponse(response) {
         window.location.href = response.url
     } else {
         console.error("Response status: " + response.status);
+        if (response.headers.get("Content-Type") == "application/json") {
+            const body = await response.json()
+            var messages = Object.entries(body.errors).map(([row, error]) => (row == "__all__" ? "" : "Row " + row + ": ") + error)
+            alert("Changes were not saved:\n" + messages.join("\n"))
+        }
     }
 }
 
 async function confirmChanges() {
-    var deletedRowIndices = table.getSelectedRows().map(row => Number(row.getIndex()))
-    var editedRows = table.getEditedCells().map(cell => cell.getRow())
-    var uniqueEditedRows = []
-    for (row of editedRows) {
-        var uniqueRowIndices = uniqueEditedRows.map(row => row.getIndex())
-        var rowIndex = row.getIndex()
-        if (!uniqueRowIndices.includes(rowIndex) && !deletedRowIndices.includes(rowIndex)) {
-            uniqueEditedRows.push(row)
+    var deletedRowIndices = [...deletedRows]
+    var formattedChanges = {}
+    for (const [index, edit] of editedRows) {
+        if (!deletedRows.has(Number(index))) {
+            formattedChanges[index] = {
+                category: categoryMap.get(edit.cat),
+                override: edit.cat_o
+            }
         }
     }
 
-    var formattedChanges = uniqueEditedRows.reduce((acc, row) => {
-        const index = row.getIndex();
-        acc[index] = {
-            category: categoryMap.get(row.getCell("cat").getValue()),
-            override: row.getCell("cat_o").getValue()
-        };
-        return acc;
-    }, {});
-
+    var keepDuplicates = document.getElementById("keep-duplicates")
     const response = await fetch(pageUrl, {
         method: "POST",
-        body: JSON.stringify({ changes: formattedChanges, deleted: deletedRowIndices }),
+        body: JSON.stringify({ changes: formattedChanges, deleted: deletedRowIndices, keep_duplicates: keepDuplicates ? keepDuplicates.checked : false }),
         headers: {
             "X-CSRFToken": document.querySelector("[name=csrfmiddlewaretoken]").value,
             "Content-Type": "application/json",
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+from .models import MonthlySummary, Transaction
+from .pipeline import batched
+
+
+def get_month(day):
+    return day.replace(day=1)
+
+
+def _next_month(month):
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def _summarize(txns):
+    """Aggregate transactions into unsaved MonthlySummary rows"""
+    rows = txns.order_by().annotate(month=TruncMonth("date")).values("user", "month", "category", "account").annotate(total=Sum("amount"), count=Count("pk"))
+    for row in rows.iterator():
+        yield MonthlySummary(
+            user_id=row["user"], month=row["month"], category_id=row["category"], account_id=row["account"], total=row["total"], count=row["count"]
+        )
+
+
+def refresh_monthly_summaries(user_pk, months):
+    """Recompute a user's summaries for the given months (first day of the month dates) from their transactions.
+
+    Called after transactions are created, edited or deleted with the months they fall in, so only those months are
+    aggregated again. Recomputing rather than adjusting totals keeps the summaries exact when bulk_create skips
+    conflicting rows.
+    """
+    months = sorted(set(months))
+    if not months:
+        return
+    month_q = Q()
+    for month in months:
+        month_q |= Q(date__gte=month, date__lt=_next_month(month))
+    with transaction.atomic():
+        MonthlySummary.objects.filter(user_id=user_pk, month__in=months).delete()
+        for batch in batched(_summarize(Transaction.objects.filter(Q(user_id=user_pk) & month_q)), settings.UPLOAD_BATCH_SIZE):
+            MonthlySummary.objects.bulk_create(batch)
+
+
+def rebuild_monthly_summaries(user_pk=None):
+    """Recompute the summaries of every month, for one user or all users. Returns the number of summary rows."""
+    summaries = MonthlySummary.objects.all()
+    txns = Transaction.objects.all()
+    if user_pk is not None:
+        summaries = summaries.filter(user_id=user_pk)
+        txns = txns.filter(user_id=user_pk)
+    count = 0
+    with transaction.atomic():
+        summaries.delete()
+        for batch in batched(_summarize(txns), settings.UPLOAD_BATCH_SIZE):
+            count += len(MonthlySummary.objects.bulk_create(batch))
+    return count
@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import threading
+import httpx
+import requests
+
+# Lifetimes used when a token does not carry an exp claim, Superset's defaults for access and guest tokens
+ACCESS_TOKEN_LIFETIME = 15 * 60
+GUEST_TOKEN_LIFETIME = 5 * 60
+# Tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 30
+LOOKUP_TTL = 5 * 60
+
+
+def get_token_expiry(token, default_lifetime):
+    """Return the exp claim of a JWT without verifying it, or now + default_lifetime if it cannot be read"""
+    try:
+        payload = token.split(".")[1]
+        return float(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + default_lifetime
+
+
+class BaseSupersetClient:
+    """Token and lookup caches shared by the sync and async Superset clients.
+
+    The admin access and CSRF tokens are cached until shortly before they expire, dashboard/dataset ids and embed uuids
+    are cached for LOOKUP_TTL and guest tokens are cached per user until shortly before they expire, so a warm dashboard
+    view does not call Superset at all.
+    """
+
+    def __init__(self, api_endpoint, username, password, timeout=10):
+        self.api_endpoint = api_endpoint
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.access_token = None
+        self.access_expiry = 0
+        self.csrf_token = None
+        self.lookups = {}
+        self.guest_tokens = {}
+
+    def login_body(self):
+        return {"username": self.username, "password": self.password, "provider": "db"}
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
+        self.access_expiry = get_token_expiry(access_token, ACCESS_TOKEN_LIFETIME)
+
+    def needs_login(self):
+        return self.access_token is None or time.time() > self.access_expiry - TOKEN_REFRESH_MARGIN
+
+    def get_headers(self):
+        return {"Authorization": f"Bearer {self.access_token}", "X-CSRFToken": self.csrf_token}
+
+    def get_lookup(self, key):
+        """Return the cached lookup for key, or None if it is missing or expired"""
+        with self.lock:
+            value, expiry = self.lookups.get(key, (None, 0))
+        return value if time.time() < expiry else None
+
+    def set_lookup(self, key, value):
+        with self.lock:
+            self.lookups[key] = (value, time.time() + LOOKUP_TTL)
+        return value
+
+    def get_cached_guest_token(self, key):
+        with self.lock:
+            token, expiry = self.guest_tokens.get(key, (None, 0))
+        return token if time.time() < expiry - TOKEN_REFRESH_MARGIN else None
+
+    def set_guest_token(self, key, token):
+        with self.lock:
+            now = time.time()
+            self.guest_tokens = {cached_key: cached for cached_key, cached in self.guest_tokens.items() if cached[1] > now}
+            self.guest_tokens[key] = (token, get_token_expiry(token, GUEST_TOKEN_LIFETIME))
+        return token
+
+    @staticmethod
+    def guest_token_body(user, dashboard_id, dataset_id):
+        return {
+            "resources": [{"id": f"{dashboard_id}", "type": "dashboard"}],
+            "rls": [{"clause": f"user_id={user.pk}", "dataset": dataset_id}],
+            "user": {"first_name": user.username, "last_name": user.username, "username": user.username},
+        }
+
+
+class SupersetClient(BaseSupersetClient):
+    """Superset API client sharing one pooled HTTP session between requests"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+
+    def login(self):
+        resp = self.session.post(self.api_endpoint + "security/login", json=self.login_body(), timeout=self.timeout)
+        resp.raise_for_status()
+        self.set_access_token(resp.json()["access_token"])
+
+        resp = self.session.get(self.api_endpoint + "security/csrf_token", headers={"Authorization": f"Bearer {self.access_token}"}, timeout=self.timeout)
+        resp.raise_for_status()
+        self.csrf_token = resp.json()["result"]
+
+    def request(self, method, path, **kwargs):
+        """Make an authenticated API request, logging in again if the cached access token expired or was rejected"""
+        with self.lock:
+            if self.needs_login():
+                self.login()
+            headers = self.get_headers()
+        resp = self.session.request(method, self.api_endpoint + path, headers=headers, timeout=self.timeout, **kwargs)
+        if resp.status_code == 401:
+            with self.lock:
+                self.login()
+                headers = self.get_headers()
+            resp = self.session.request(method, self.api_endpoint + path, headers=headers, timeout=self.timeout, **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+
+    def cached_lookup(self, key, fetch):
+        value = self.get_lookup(key)
+        return self.set_lookup(key, fetch()) if value is None else value
+
+    def get_dashboard_id(self, title):
+        def fetch():
+            return {dashboard["dashboard_title"]: dashboard["id"] for dashboard in self.request("GET", "dashboard/")["result"]}
+
+        return self.cached_lookup("dashboards", fetch).get(title)
+
+    def get_dataset_id(self, table_name):
+        def fetch():
+            return {dataset["table_name"]: dataset["id"] for dataset in self.request("GET", "dataset/")["result"]}
+
+        return self.cached_lookup("datasets", fetch).get(table_name)
+
+    def get_embedded_uuid(self, dashboard_id):
+        return self.cached_lookup(("embedded", dashboard_id), lambda: self.request("GET", f"dashboard/{dashboard_id}/embedded")["result"]["uuid"])
+
+    def get_guest_token(self, user, dashboard_id, dataset_id):
+        key = (user.pk, dashboard_id, dataset_id)
+        token = self.get_cached_guest_token(key)
+        if token is None:
+            response = self.request("POST", "security/guest_token", json=self.guest_token_body(user, dashboard_id, dataset_id))
+            token = self.set_guest_token(key, response["token"])
+        return token
+
+
+class AsyncSupersetClient(BaseSupersetClient):
+    """Superset API client for async views under ASGI. Requests are made with a pooled httpx.AsyncClient so independent
+    lookups can run concurrently without blocking the event loop. The pool belongs to one event loop, so the client is
+    only used when SERVER_MODE is asgi and the loop of each worker process lives as long as the process."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http = None
+        self.http_loop = None
+        self.login_lock = None
+
+    def get_http(self):
+        """Return the HTTP client of the running event loop, pooled connections can not be shared between loops"""
+        loop = asyncio.get_running_loop()
+        if self.http_loop is not loop:
+            if self.http is not None and self.http_loop.is_running():
+                # Close the pooled connections of the previous loop on that loop
+                asyncio.run_coroutine_threadsafe(self.http.aclose(), self.http_loop)
+            self.http = httpx.AsyncClient(timeout=self.timeout)
+            self.http_loop = loop
+            self.login_lock = asyncio.Lock()
+        return self.http
+
+    async def login(self):
+        http = self.get_http()
+        resp = await http.post(self.api_endpoint + "security/login", json=self.login_body())
+        resp.raise_for_status()
+        self.set_access_token(resp.json()["access_token"])
+
+        resp = await http.get(self.api_endpoint + "security/csrf_token", headers={"Authorization": f"Bearer {self.access_token}"})
+        resp.raise_for_status()
+        self.csrf_token = resp.json()["result"]
+
+    async def request(self, method, path, **kwargs):
+        """Make an authenticated API request, logging in again if the cached access token expired or was rejected"""
+        http = self.get_http()
+        async with self.login_lock:
+            if self.needs_login():
+                await self.login()
+        resp = await http.request(method, self.api_endpoint + path, headers=self.get_headers(), **kwargs)
+        if resp.status_code == 401:
+            async with self.login_lock:
+                await self.login()
+            resp = await http.request(method, self.api_endpoint + path, headers=self.get_headers(), **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def cached_lookup(self, key, fetch):
+        value = self.get_lookup(key)
+        return self.set_lookup(key, await fetch()) if value is None else value
+
+    async def get_dashboard_id(self, title):
+        async def fetch():
+            return {dashboard["dashboard_title"]: dashboard["id"] for dashboard in (await self.request("GET", "dashboard/"))["result"]}
+
+        return (await self.cached_lookup("dashboards", fetch)).get(title)
+
+    async def get_dataset_id(self, table_name):
+        async def fetch():
+            return {dataset["table_name"]: dataset["id"] for dataset in (await self.request("GET", "dataset/"))["result"]}
+
+        return (await self.cached_lookup("datasets", fetch)).get(table_name)
+
+    async def get_embedded_uuid(self, dashboard_id):
+        async def fetch():
+            return (await self.request("GET", f"dashboard/{dashboard_id}/embedded"))["result"]["uuid"]
+
+        return await self.cached_lookup(("embedded", dashboard_id), fetch)
+
+    async def get_guest_token(self, user, dashboard_id, dataset_id):
+        key = (user.pk, dashboard_id, dataset_id)
+        token = self.get_cached_guest_token(key)
+        if token is None:
+            resp = await self.request("POST", "security/guest_token", json=self.guest_token_body(user, dashboard_id, dataset_id))
+            token = self.set_guest_token(key, resp["token"])
+        return token
+
+
+_clients = {}
+_client_lock = threading.Lock()
+
+
+def _get_client(client_class):
+    with _client_lock:
+        if client_class not in _clients:
+            api_endpoint = f"{os.getenv('SUPERSET_HOST', '')}:{os.getenv('SUPERSET_PORT', '')}/api/v1/"
+            _clients[client_class] = client_class(api_endpoint, os.getenv("SUPERSET_USERNAME", ""), os.getenv("SUPERSET_PASSWORD", ""))
+        return _clients[client_class]
+
+
+def get_superset_client():
+    """Return the process wide client configured from the SUPERSET_* environment variables"""
+    return _get_client(SupersetClient)
+
+
+def get_async_superset_client():
+    """Return the process wide async client configured from the SUPERSET_* environment variables"""
+    return _get_client(AsyncSupersetClient)
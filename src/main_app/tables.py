@@ -0,0 +1,158 @@
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Server side support for the remote paginated Tabulator tables. Field names are the table column names.
+SORT_FIELDS = {"date": "date", "desc": "description", "amnt": "amount", "cat_o": "category_override", "cat": "cat_name", "accnt": "accnt_name"}
+FILTER_FIELDS = {"date": "date", "desc": "description", "amnt": "amount", "cat_o": "category_override", "cat": "cat_name", "accnt": "accnt_name"}
+FILTER_TYPES = {"=": "exact", "like": "icontains", "starts": "istartswith", "ends": "iendswith", "<": "lt", "<=": "lte", ">": "gt", ">=": "gte"}
+CURSOR_SALT = "main_app.tables.cursor"
+
+
+class TableQueryError(ValueError):
+    pass
+
+
+def get_page_bounds(request, row_count):
+    """Return the (start, stop, last_page) slice for the page requested by a remote paginated Tabulator table. The first
+    page of TABLE_PAGE_SIZE rows is returned if no page is requested."""
+    try:
+        size = min(max(int(request.GET.get("size", settings.TABLE_PAGE_SIZE)), 1), settings.TABLE_MAX_PAGE_SIZE)
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        size, page = settings.TABLE_PAGE_SIZE, 1
+    start = min((page - 1) * size, row_count)
+    return start, min(start + size, row_count), max((row_count + size - 1) // size, 1)
+
+
+def stream_table_data(rows, **fields):
+    """Serialize rows into the response format of a remote paginated Tabulator table one row at a time. fields are
+    added to the response next to the data, e.g. last_page."""
+    yield json.dumps(fields, cls=DjangoJSONEncoder)[:-1] + (', "data": [' if fields else '"data": [')
+    separator = ""
+    for row in rows:
+        yield separator + json.dumps(row, cls=DjangoJSONEncoder)
+        separator = ","
+    yield "]}"
+
+
+async def _aiter_sync(iterator):
+    """Yield the items of a sync iterator, running each step in the sync thread so database cursors and files are never
+    used on the event loop"""
+    get_next = sync_to_async(next)
+    done = object()
+    while (item := await get_next(iterator, done)) is not done:
+        yield item
+
+
+def streaming_content(iterator):
+    """Return a sync iterator as StreamingHttpResponse content of the type the server streams. Django consumes an async
+    iterator under WSGI and a sync iterator under ASGI by buffering the whole response in memory, so under ASGI the
+    iterator is wrapped in an async one."""
+    if settings.SERVER_MODE == "asgi":
+        return _aiter_sync(iter(iterator))
+    return iterator
+
+
+def parse_table_params(request):
+    """Return the (sort, filters, size, page, cursor) requested by a table. sort and filters are JSON encoded lists in
+    the Tabulator format, [{"field": "date", "dir": "asc"}] and [{"field": "desc", "type": "like", "value": "x"}]."""
+    try:
+        sort = json.loads(request.GET.get("sort") or "[]")
+        filters = json.loads(request.GET.get("filter") or "[]")
+        size = min(max(int(request.GET.get("size", settings.TABLE_PAGE_SIZE)), 1), settings.TABLE_MAX_PAGE_SIZE)
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        raise TableQueryError("Invalid table parameters")
+    return sort, filters, size, page, request.GET.get("cursor")
+
+
+def filter_transactions(txns, filters):
+    txns = txns.annotate(cat_name=Coalesce(F("category__name"), Value("")), accnt_name=F("account__name"))
+    for table_filter in filters:
+        try:
+            field = FILTER_FIELDS[table_filter["field"]]
+            if table_filter["type"] == "!=":
+                txns = txns.exclude(**{field: table_filter["value"]})
+            else:
+                txns = txns.filter(**{f"{field}__{FILTER_TYPES[table_filter['type']]}": table_filter["value"]})
+        except (KeyError, TypeError):
+            raise TableQueryError("Unsupported filter")
+    return txns
+
+
+def _keyset_q(key, values, descending):
+    """Select the rows after values in the (key) ordering, expanded as (a > x) OR (a = x AND b > y) OR ..."""
+    lookup = "lt" if descending else "gt"
+    q = Q()
+    equal = {}
+    for field, value in zip(key, values):
+        q |= Q(**equal, **{f"{field}__{lookup}": value})
+        equal[field] = value
+    return q
+
+
+async def aget_keyset_page(txns, sort, size, cursor=None):
+    """Return (rows, next_cursor) for one page of the filtered transactions.
+
+    Pages are selected with a keyset cursor holding the last row's sort key instead of an offset, so every page costs
+    the same no matter how deep into the table it is. The key is the sorted column followed by (date, description, pk)
+    which matches the default ordering and the (user, date) index.
+    """
+    sort_field, descending = "date", False
+    if sort:
+        try:
+            sort_field, descending = SORT_FIELDS[sort[0]["field"]], sort[0]["dir"] == "desc"
+        except (KeyError, TypeError):
+            raise TableQueryError("Unsupported sort")
+    key = [sort_field] + [field for field in ("date", "description", "pk") if field != sort_field]
+    txns = txns.order_by(*[f"-{field}" if descending else field for field in key])
+
+    if cursor:
+        try:
+            values = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise TableQueryError("Invalid cursor")
+        txns = txns.filter(_keyset_q(key, values, descending))
+
+    rows = [
+        row
+        async for row in txns.values(
+            "date", "description", "pk", "amount", "category_override", "cat_name", "accnt_name",
+        )[: size + 1]
+    ]
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = signing.dumps([str(rows[-1][field]) if field in ("date", "amount") else rows[-1][field] for field in key], salt=CURSOR_SALT)
+    table_rows = [
+        {
+            "date": row["date"],
+            "accnt": row["accnt_name"],
+            "amnt": row["amount"],
+            "cat": row["cat_name"],
+            "desc": row["description"],
+            "cat_o": row["category_override"],
+            "idx": row["pk"],
+        }
+        for row in rows
+    ]
+    return table_rows, next_cursor
+
+
+async def aestimate_count(queryset):
+    """Count the rows of queryset exactly up to TABLE_EXACT_COUNT_LIMIT. Larger results use the planner's row estimate
+    on PostgreSQL rather than a full COUNT(*). Returns (count, is_estimate)."""
+    limit = settings.TABLE_EXACT_COUNT_LIMIT
+    count = await queryset.order_by()[: limit + 1].acount()
+    if count <= limit:
+        return count, False
+    if connection.vendor == "postgresql":
+        plan = json.loads(await queryset.order_by().aexplain(format="json"))
+        return max(int(plan[0]["Plan"]["Plan Rows"]), count), True
+    return count, True
@@ -0,0 +1,11 @@
+import shutil
+import tempfile
+from django.test import override_settings
+
+
+def use_temp_media_root(test_case):
+    """Point MEDIA_ROOT at a temporary directory for the rest of a test, so staged and raw uploads are not left in the
+    real media root where they would clash with later runs"""
+    media_root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    test_case.enterContext(override_settings(MEDIA_ROOT=media_root))
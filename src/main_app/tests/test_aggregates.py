@@ -0,0 +1,43 @@
+from decimal import Decimal
+from datetime import date
+from django.test import TestCase
+from django.contrib.auth.models import User
+from main_app.models import Account, Bank, Category, Transaction
+from main_app.aggregates import category_totals, monthly_totals, monthly_category_totals
+
+
+def quantize(rows):
+    """SQLite stores decimals as floats so its sums are only exact once rounded to cents"""
+    return [(*row[:-1], row[-1].quantize(Decimal("0.01"))) for row in rows]
+
+
+class AggregateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        self.gas = Category.objects.create(user=self.user, name="gas", priority=2)
+        for txn_date, category, amount in [
+            ("2024-01-05", self.food, "0.10"),
+            ("2024-01-20", self.food, "0.20"),
+            ("2024-02-01", self.food, "-0.30"),
+            ("2024-02-03", self.gas, "45.99"),
+        ]:
+            Transaction.objects.create(
+                user=self.user, date=txn_date, description="txn", category=category, category_override=False, account=self.account, amount=Decimal(amount)
+            )
+        other_user = User.objects.create_user(username="user2", password="password")
+        Transaction.objects.create(user=other_user, date="2024-01-01", description="txn", category_override=False, account=self.account, amount=1)
+        self.txns = Transaction.objects.filter(user=self.user)
+
+    def test_category_totals(self):
+        with self.assertNumQueries(1):
+            totals = [(row["category__name"], row["count"], row["total"]) for row in category_totals(self.txns)]
+        self.assertEqual(quantize(totals), [("food", 3, Decimal("0.00")), ("gas", 1, Decimal("45.99"))])
+
+    def test_monthly_totals(self):
+        totals = [(row["month"], row["count"], row["total"]) for row in monthly_totals(self.txns)]
+        self.assertEqual(quantize(totals), [(date(2024, 1, 1), 2, Decimal("0.30")), (date(2024, 2, 1), 2, Decimal("45.69"))])
+
+        totals = [(row["month"], row["category__name"], row["total"]) for row in monthly_category_totals(self.txns.filter(date__gte="2024-02-01"))]
+        self.assertEqual(quantize(totals), [(date(2024, 2, 1), "food", Decimal("-0.30")), (date(2024, 2, 1), "gas", Decimal("45.99"))])
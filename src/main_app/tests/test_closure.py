@@ -0,0 +1,80 @@
+from decimal import Decimal
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from main_app.forms import CategoryForm
+from main_app.models import Account, Bank, Category, CategoryClosure, Transaction
+from main_app.closure import get_ancestor_pks, get_descendant_pks, rebuild_category_closure
+from main_app.aggregates import rollup_totals, top_level_totals
+
+
+class CategoryClosureTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        self.groceries = Category.objects.create(user=self.user, name="groceries", priority=2, parent=self.food)
+        self.produce = Category.objects.create(user=self.user, name="produce", priority=3, parent=self.groceries)
+        self.restaurants = Category.objects.create(user=self.user, name="restaurants", priority=4, parent=self.food)
+        self.gas = Category.objects.create(user=self.user, name="gas", priority=5)
+
+    def links(self):
+        return set(CategoryClosure.objects.filter(descendant__user=self.user).values_list("ancestor__name", "descendant__name", "depth"))
+
+    def assert_matches_parents(self):
+        links = self.links()
+        rebuild_category_closure(self.user.pk)
+        self.assertEqual(links, self.links())
+
+    def test_tree(self):
+        self.assertEqual(get_ancestor_pks(self.produce.pk), {self.produce.pk, self.groceries.pk, self.food.pk})
+        self.assertEqual(get_descendant_pks(self.food.pk, include_self=False), {self.groceries.pk, self.produce.pk, self.restaurants.pk})
+        self.assertIn(("food", "produce", 2), self.links())
+        self.assert_matches_parents()
+
+    def test_move_and_delete(self):
+        self.groceries.parent = self.gas
+        self.groceries.save()
+        self.assertEqual(get_ancestor_pks(self.produce.pk), {self.produce.pk, self.groceries.pk, self.gas.pk})
+        self.assert_matches_parents()
+
+        self.groceries.parent = None
+        self.groceries.save()
+        self.assert_matches_parents()
+
+        self.groceries.parent = self.food
+        self.groceries.save()
+        self.groceries.delete()
+        self.assertEqual(get_ancestor_pks(self.produce.pk), {self.produce.pk})
+        self.assert_matches_parents()
+
+    def test_cycles_rejected(self):
+        self.food.parent = self.produce
+        with self.assertRaises(ValidationError):
+            self.food.full_clean()
+
+        form = CategoryForm({"name": "food", "priority": 1, "parent": self.produce.pk}, instance=self.food, user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertNotIn(self.groceries, form.fields["parent"].queryset)
+        self.assertIn(self.gas, form.fields["parent"].queryset)
+
+        # Saving a cycle directly fails before the row or the closure table are changed
+        links = self.links()
+        with self.assertRaises(ValidationError):
+            self.food.save()
+        self.assertIsNone(Category.objects.get(pk=self.food.pk).parent)
+        self.assertEqual(links, self.links())
+
+    def test_rollups(self):
+        account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        for category, amount in [(self.produce, "1.50"), (self.groceries, "2.00"), (self.restaurants, "10.00"), (self.gas, "40.00")]:
+            Transaction.objects.create(
+                user=self.user, date="2024-01-01", description="txn", category=category, category_override=False, account=account, amount=Decimal(amount)
+            )
+        txns = Transaction.objects.filter(user=self.user)
+
+        with self.assertNumQueries(1):
+            totals = {row["category_name"]: (row["count"], row["total"].quantize(Decimal("0.01"))) for row in top_level_totals(txns)}
+        self.assertEqual(totals, {"food": (3, Decimal("13.50")), "gas": (1, Decimal("40.00"))})
+
+        totals = {row["category_name"]: row["count"] for row in rollup_totals(txns)}
+        self.assertEqual(totals, {"food": 3, "groceries": 2, "produce": 1, "restaurants": 1, "gas": 1})
@@ -0,0 +1,379 @@
+import io
+import re
+import time
+import random
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from main_app.models import Account, Bank, Category, CategoryRule, RuleStats, Transaction
+from main_app.common import (
+    get_user_categorizer,
+    CategorizerCache,
+    get_recategorization_changes,
+    recategorize_changed_rules,
+    recategorize_transactions,
+    rule_stats,
+)
+from main_app.checks import check_categorizer_cache
+from main_app.regex_rules import compile_rule_regex
+
+
+def evaluate_rule(rule, description_text):
+    match rule.match_type:
+        case "equals":
+            return rule.match_text.lower() == description_text.lower()
+        case "contains":
+            return rule.match_text.lower() in description_text.lower()
+        case "regex":
+            return re.search(rule.match_text, description_text) is not None
+        case "starts_with":
+            return description_text.lower().startswith(rule.match_text.lower())
+        case "ends_with":
+            return description_text.lower().endswith(rule.match_text.lower())
+
+
+def reference_category(user, description_text):
+    """Per-rule evaluation the categorizer has to agree with"""
+    for cat in Category.objects.filter(user=user).order_by("priority", "pk"):
+        if any(evaluate_rule(rule, description_text) for rule in cat.rule_set.all()):
+            return cat
+    return Category.get_uncategorized(user)
+
+
+class CategorizerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        self.coffee = Category.objects.create(user=self.user, name="coffee", priority=0)
+        self.transport = Category.objects.create(user=self.user, name="transport", priority=2)
+        self.transfer = Category.objects.create(user=self.user, name="transfer", priority=3)
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="Market")
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="cafe")
+        CategoryRule.objects.create(category=self.coffee, match_type="starts_with", match_text="Starbucks")
+        CategoryRule.objects.create(category=self.coffee, match_type="ends_with", match_text="coffee co")
+        CategoryRule.objects.create(category=self.transport, match_type="regex", match_text=r"^UBER\s*\*?TRIP")
+        CategoryRule.objects.create(category=self.transport, match_type="equals", match_text="transit pass")
+        CategoryRule.objects.create(category=self.transfer, match_type="regex", match_text=r"(E-?TRANSFER)\s+\1?")
+        CategoryRule.objects.create(category=self.transfer, match_type="regex", match_text=r"cafe")
+
+    def test_priority_order(self):
+        categorizer = get_user_categorizer(self.user)
+        self.assertEqual(categorizer.get_category("STARBUCKS cafe #12"), self.coffee)
+        self.assertEqual(categorizer.get_category("corner cafe"), self.food)
+        self.assertEqual(categorizer.get_category("Blue Bottle Coffee Co"), self.coffee)
+        self.assertEqual(categorizer.get_category("Transit Pass"), self.transport)
+        self.assertEqual(categorizer.get_category("transit pass monthly"), Category.get_uncategorized(self.user))
+        self.assertEqual(categorizer.get_category("UBER *TRIP 123"), self.transport)
+        self.assertEqual(categorizer.get_category("uber trip"), Category.get_uncategorized(self.user))
+        self.assertEqual(categorizer.get_category("ETRANSFER SENT"), self.transfer)
+
+    def test_conditional_group_reference(self):
+        CategoryRule.objects.create(category=self.transport, match_type="regex", match_text=r"^(<)?abc(?(1)>)$")
+        categorizer = get_user_categorizer(self.user)
+        self.assertEqual(categorizer.get_category("abc"), self.transport)
+        self.assertEqual(categorizer.get_category("<abc>"), self.transport)
+        self.assertEqual(categorizer.get_category("<abc"), Category.get_uncategorized(self.user))
+
+    def test_matches_per_rule_evaluation(self):
+        categorizer = get_user_categorizer(self.user)
+        words = ["market", "MARKET", "cafe", "starbucks", "coffee co", "uber", "*trip", "UBER *TRIP", "transit pass", "e-transfer", "E-TRANSFER", "x", " "]
+        rand = random.Random(0)
+        for _ in range(500):
+            description = "".join(rand.choice(words) for _ in range(rand.randint(0, 4)))
+            self.assertEqual(categorizer.get_category(description), reference_category(self.user, description), description)
+
+    def test_categorize_many(self):
+        categorizer = get_user_categorizer(self.user)
+        descriptions = ["corner cafe", "STARBUCKS cafe #12", "gas", "corner cafe", "UBER *TRIP 123", "corner cafe"]
+        with mock.patch.object(categorizer, "get_rank", wraps=categorizer.get_rank) as get_rank:
+            category_pks = categorizer.categorize_many(descriptions)
+            self.assertEqual(get_rank.call_count, 4)
+            self.assertEqual(categorizer.categorize_many(iter(["gas", "corner cafe"])), [category_pks[2], category_pks[0]])
+            self.assertEqual(get_rank.call_count, 4)
+        self.assertEqual(category_pks, [categorizer.get_category(description).pk for description in descriptions])
+
+    def test_explain(self):
+        categorizer = get_user_categorizer(self.user)
+        words = ["market", "cafe", "starbucks", "coffee co", "UBER *TRIP", "transit pass", "E-TRANSFER", "x", " "]
+        rand = random.Random(1)
+        for _ in range(200):
+            description = "".join(rand.choice(words) for _ in range(rand.randint(0, 4)))
+            self.assertEqual(categorizer.explain(description)[0], categorizer.get_category(description), description)
+
+        category, trace = categorizer.explain("corner cafe")
+        self.assertEqual(category, self.food)
+        self.assertEqual([entry["category"] for entry in trace], [self.coffee, self.coffee, self.food, self.food])
+        self.assertEqual([entry["matched"] for entry in trace], [False, False, False, True])
+
+    def test_no_rules(self):
+        other_user = User.objects.create_user(username="user2", password="password")
+        categorizer = get_user_categorizer(other_user)
+        self.assertEqual(categorizer.get_category("anything"), Category.get_uncategorized(other_user))
+
+
+class RegexRuleSafetyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.transport = Category.objects.create(user=self.user, name="transport", priority=0)
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+
+    def test_rule_validation(self):
+        CategoryRule(category=self.transport, match_type="regex", match_text=r"^UBER\s*\*?TRIP").full_clean()
+        CategoryRule(category=self.transport, match_type="contains", match_text="(a+)+").full_clean()
+        CategoryRule(category=self.transport, match_type="regex", match_text=r"(cat|car)+\d{3}(-\d{3}){2}").full_clean()
+        for pattern in ["(unclosed", "[z-a]", "(a+)+$", r"(\w*\s?)*x", r"(a)(\1)+", "(a|a)*b", "^(a?){25}a{25}$", "(a|aa)+$"]:
+            with self.assertRaises(ValidationError, msg=pattern) as cm:
+                CategoryRule(category=self.transport, match_type="regex", match_text=pattern).full_clean()
+            self.assertIn("match_text", cm.exception.message_dict)
+
+    def test_slow_rules_time_out(self):
+        # Patterns the static check misses are still bounded by the per-description budget
+        self.addCleanup(compile_rule_regex.cache_clear)
+        compile_rule_regex.cache_clear()
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="aaa")
+        for pattern in ["(a|a)*b", "^(a?){25}a{25}$", "(a|aa)+$"]:
+            CategoryRule.objects.create(category=self.transport, match_type="regex", match_text=pattern)
+        with mock.patch("main_app.regex_rules._find_dangerous", return_value=None):
+            categorizer = get_user_categorizer(self.user)
+            self.assertEqual(categorizer.skipped_rules, [])
+            start = time.perf_counter()
+            with self.assertLogs("main_app.common", "WARNING"):
+                self.assertEqual(categorizer.get_category("a" * 30 + "!"), self.food)
+            self.assertEqual(categorizer.explain("a" * 30 + "!")[0], self.food)
+            self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(categorizer.get_category("aab"), self.transport)
+
+    def test_invalid_saved_rule_skipped(self):
+        # Rules saved before validation existed never match instead of failing categorization, and are listed
+        CategoryRule.objects.create(category=self.transport, match_type="regex", match_text="(unclosed")
+        CategoryRule.objects.create(category=self.transport, match_type="regex", match_text="(a+)+market")
+        CategoryRule.objects.create(category=self.food, match_type="regex", match_text="market")
+        with self.assertLogs("main_app.common", "WARNING"):
+            categorizer = get_user_categorizer(self.user)
+        self.assertEqual(categorizer.get_category("(unclosed aamarket"), self.food)
+        self.assertEqual(categorizer.explain("(unclosed aamarket")[0], self.food)
+        errors = {skipped["match_text"]: skipped["error"] for skipped in categorizer.skipped_rules if skipped["category"] == self.transport}
+        self.assertEqual(errors.keys(), {"(unclosed", "(a+)+market"})
+        self.assertIn("nested repeats", errors["(a+)+market"])
+
+        self.client.login(username="user1", password="password")
+        response = self.client.get(reverse("category_rules"))
+        self.assertContains(response, "These regex rules are skipped")
+        self.assertContains(response, "(a+)+market")
+
+
+class CategorizerCacheTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password")
+        self.user2 = User.objects.create_user(username="user2", password="password")
+        self.cat = Category.objects.create(user=self.user1, name="food", priority=1)
+        self.rule = CategoryRule.objects.create(category=self.cat, match_type="contains", match_text="market")
+
+    def test_cached_until_rules_change(self):
+        categorizer = get_user_categorizer(self.user1)
+        # Only the version stamp is read
+        with self.assertNumQueries(1):
+            self.assertIs(get_user_categorizer(self.user1), categorizer)
+
+        rule = CategoryRule.objects.create(category=self.cat, match_type="contains", match_text="grocer")
+        self.assertEqual(get_user_categorizer(self.user1).get_category("grocery store"), self.cat)
+
+        rule.delete()
+        self.assertNotEqual(get_user_categorizer(self.user1).get_category("grocery store"), self.cat)
+
+        self.cat.priority = 5
+        self.cat.save()
+        self.assertIsNot(get_user_categorizer(self.user1), categorizer)
+
+        self.cat.delete()
+        self.assertEqual(get_user_categorizer(self.user1).get_category("market"), Category.get_uncategorized(self.user1))
+
+    def test_other_processes_see_changes(self):
+        # A cache of another web or job worker process, the signals only run in the process saving the rules
+        other_process_cache = CategorizerCache(8)
+        categorizer = other_process_cache.get(self.user1)
+        CategoryRule.objects.create(category=self.cat, match_type="contains", match_text="grocer")
+        self.assertIsNot(other_process_cache.get(self.user1), categorizer)
+        self.assertEqual(other_process_cache.get(self.user1).get_category("grocery store"), self.cat)
+
+    def test_users_are_independent(self):
+        categorizer = get_user_categorizer(self.user1)
+        Category.objects.create(user=self.user2, name="food", priority=1)
+        self.assertIs(get_user_categorizer(self.user1), categorizer)
+
+    def test_lru_eviction(self):
+        cache = CategorizerCache(1)
+        categorizer = cache.get(self.user1)
+        self.assertIs(cache.get(self.user1), categorizer)
+        cache.get(self.user2)
+        self.assertIsNot(cache.get(self.user1), categorizer)
+
+    def test_shared_cache_backend(self):
+        cache = CategorizerCache(8, cache_alias="default")
+        other_process_cache = CategorizerCache(8, cache_alias="default")
+        cache.get(self.user1)
+        with self.assertNumQueries(0):
+            self.assertEqual(other_process_cache.get(self.user1).get_category("market"), self.cat)
+
+        # The stamp only changes once the transaction changing the rules commits
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            other_process_cache.invalidate(self.user1.pk)
+            CategoryRule.objects.filter(pk=self.rule.pk).update(match_text="grocer")
+            self.assertEqual(cache.get(self.user1).get_category("market"), self.cat)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(cache.get(self.user1).get_category("grocer"), self.cat)
+
+    def test_shared_cache_check(self):
+        with override_settings(CATEGORIZER_CACHE_ALIAS="default"):
+            self.assertEqual([error.id for error in check_categorizer_cache(None)], ["main_app.E002"])
+        with override_settings(CATEGORIZER_CACHE_ALIAS="missing"):
+            self.assertEqual([error.id for error in check_categorizer_cache(None)], ["main_app.E001"])
+        self.assertEqual(check_categorizer_cache(None), [])
+
+
+class RecategorizationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        self.coffee = Category.objects.create(user=self.user, name="coffee", priority=2)
+        self.food_rule = CategoryRule.objects.create(category=self.food, match_type="contains", match_text="market")
+        CategoryRule.objects.create(category=self.coffee, match_type="starts_with", match_text="starbucks")
+        categorizer = get_user_categorizer(self.user)
+        for description in ["market street", "starbucks market", "starbucks", "corner cafe", "gas"]:
+            Transaction.objects.create(
+                user=self.user,
+                date="2024-01-01",
+                description=description,
+                category=categorizer.get_category(description),
+                category_override=False,
+                account=self.account,
+                amount=1,
+            )
+        self.override = Transaction.objects.create(
+            user=self.user, date="2024-01-01", description="cafe", category=self.food, category_override=True, account=self.account, amount=1
+        )
+
+    @mock.patch("main_app.common.RECATEGORIZE_BATCH_SIZE", 2)
+    def test_batches(self):
+        self.food_rule.delete()
+        CategoryRule.objects.create(category=self.coffee, match_type="equals", match_text="gas")
+        progress = mock.Mock()
+        with mock.patch.object(Transaction.objects, "bulk_update", wraps=Transaction.objects.bulk_update) as bulk_update:
+            self.assertEqual(recategorize_transactions(self.user, get_user_categorizer(self.user), progress=progress), 3)
+        # Changed rows are written with the batch they were read in, progress reaches the total with the last batch
+        self.assertEqual([len(call.args[0]) for call in bulk_update.call_args_list], [2, 1])
+        self.assertEqual(progress.call_args_list, [mock.call(2, 5), mock.call(4, 5), mock.call(5, 5)])
+        self.assert_categories(
+            {"market street": "Uncategorized", "starbucks market": "coffee", "starbucks": "coffee", "corner cafe": "Uncategorized", "gas": "coffee"}
+        )
+
+    def assert_categories(self, expected):
+        actual = {txn.description: txn.category.name for txn in Transaction.objects.filter(user=self.user, category_override=False)}
+        self.assertEqual(actual, expected)
+        self.assertEqual(Transaction.objects.get(pk=self.override.pk).category, self.food)
+
+    def test_unchanged_rules(self):
+        categorizer = get_user_categorizer(self.user)
+        self.assertIsNone(get_recategorization_changes(categorizer, categorizer))
+
+    def test_added_rule(self):
+        old_categorizer = get_user_categorizer(self.user)
+        CategoryRule.objects.create(category=self.coffee, match_type="contains", match_text="cafe")
+        self.assertEqual(recategorize_changed_rules(self.user, old_categorizer, get_user_categorizer(self.user)), 1)
+        self.assert_categories(
+            {"market street": "food", "starbucks market": "food", "starbucks": "coffee", "corner cafe": "coffee", "gas": "Uncategorized"}
+        )
+
+    def test_removed_rule_and_reorder(self):
+        old_categorizer = get_user_categorizer(self.user)
+        self.food_rule.delete()
+        self.assertEqual(recategorize_changed_rules(self.user, old_categorizer, get_user_categorizer(self.user)), 2)
+        self.assert_categories(
+            {"market street": "Uncategorized", "starbucks market": "coffee", "starbucks": "coffee", "corner cafe": "Uncategorized", "gas": "Uncategorized"}
+        )
+
+        old_categorizer = get_user_categorizer(self.user)
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="market")
+        self.coffee.priority = 0
+        self.coffee.save()
+        self.assertEqual(recategorize_changed_rules(self.user, old_categorizer, get_user_categorizer(self.user)), 1)
+        self.assert_categories(
+            {"market street": "food", "starbucks market": "coffee", "starbucks": "coffee", "corner cafe": "Uncategorized", "gas": "Uncategorized"}
+        )
+
+    def test_removed_category(self):
+        old_categorizer = get_user_categorizer(self.user)
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="starbucks")
+        self.coffee.delete()
+        self.assertEqual(recategorize_changed_rules(self.user, old_categorizer, get_user_categorizer(self.user)), 1)
+        self.assert_categories(
+            {"market street": "food", "starbucks market": "food", "starbucks": "food", "corner cafe": "Uncategorized", "gas": "Uncategorized"}
+        )
+
+    def test_recategorize_all_command(self):
+        CategoryRule.objects.create(category=self.coffee, match_type="contains", match_text="cafe")
+        stdout = io.StringIO()
+        call_command("recategorize_all", processes=1, stdout=stdout)
+        self.assertIn("Recategorized 1 transactions for 1 users", stdout.getvalue())
+        self.assert_categories(
+            {"market street": "food", "starbucks market": "food", "starbucks": "coffee", "corner cafe": "coffee", "gas": "Uncategorized"}
+        )
+
+
+class RuleStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.food = Category.objects.create(user=self.user, name="food", priority=0)
+        self.market = CategoryRule.objects.create(category=self.food, match_type="contains", match_text="market")
+        self.grocer = CategoryRule.objects.create(category=self.food, match_type="regex", match_text="grocer")
+
+    def test_disabled_by_default(self):
+        get_user_categorizer(self.user).categorize_many(["market", "gas"])
+        rule_stats.flush()
+        self.assertFalse(RuleStats.objects.exists())
+
+    @override_settings(CATEGORIZER_STATS=True)
+    def test_record_and_flush(self):
+        categorizer = get_user_categorizer(self.user)
+        category_pks = categorizer.categorize_many(["market", "gas", "market", "grocer"])
+        self.assertEqual(category_pks, [self.food.pk, Category.get_uncategorized(self.user).pk, self.food.pk, self.food.pk])
+        rule_stats.flush()
+
+        market_stats, grocer_stats = RuleStats.objects.get(rule=self.market), RuleStats.objects.get(rule=self.grocer)
+        # Evaluations are counted per transaction like hits, the repeated "market" description counts twice
+        self.assertEqual((market_stats.hits, market_stats.evaluations), (2, 4))
+        self.assertEqual((grocer_stats.hits, grocer_stats.evaluations), (1, 2))
+        self.assertGreater(market_stats.eval_time, 0)
+
+        categorizer.categorize_many(["market"])
+        rule_stats.flush()
+        self.assertEqual(RuleStats.objects.get(rule=self.market).hits, 3)
+
+        # Recategorizing flushes the statistics it recorded
+        account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        for description in ["market", "market"]:
+            Transaction.objects.create(
+                user=self.user, date="2024-01-01", description=description, category=self.food, category_override=False, account=account, amount=1
+            )
+        recategorize_transactions(self.user, categorizer)
+        self.assertEqual(RuleStats.objects.get(rule=self.market).hits, 5)
+
+        # Statistics of an edited rule are reset
+        self.grocer.match_text = "grocery"
+        self.grocer.save()
+        self.assertFalse(RuleStats.objects.filter(rule=self.grocer).exists())
+
+    def test_category_rules_page(self):
+        RuleStats.objects.create(rule=self.market, hits=10, evaluations=10, eval_time=0.001)
+        RuleStats.objects.create(rule=self.grocer, hits=0, evaluations=10, eval_time=0.01)
+        self.client.login(username="user1", password="password")
+        response = self.client.get(reverse("category_rules"), {"explain": "Grocer"})
+        self.assertEqual(response.context["explain"]["category"], Category.get_uncategorized(self.user))
+        self.assertEqual(len(response.context["explain"]["trace"]), 2)
+        self.assertEqual(response.context["rule_stats"]["hot"], [RuleStats.objects.get(rule=self.market)])
+        self.assertEqual(response.context["rule_stats"]["dead"], [RuleStats.objects.get(rule=self.grocer)])
+        self.assertEqual(response.context["rule_stats"]["slow"][0].rule, self.grocer)
@@ -0,0 +1,63 @@
+import io
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from main_app.models import Account, Bank, ParseRule
+from main_app.forms import FileSelectForm
+from main_app.detect import SNIFF_SIZE, detect_parse_rule, read_sample
+from main_app.tests import use_temp_media_root
+
+
+class DetectParseRuleTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.header_rule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="header", date_fmt_str="%Y-%m-%d", start_line=1, date_col=0, desc_col=1, amount_col=2
+        )
+        self.semicolon_rule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="semicolon", date_fmt_str="%d/%m/%Y", csv_delim=";", date_col=0, desc_col=1, amount_col=2
+        )
+        self.date_last_rule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="date last", date_fmt_str="%Y-%m-%d", date_col=2, desc_col=0, amount_col=1
+        )
+
+    def detect(self, text):
+        return detect_parse_rule(io.BytesIO(text.encode("utf-8")), self.user)
+
+    def test_detect(self):
+        self.assertEqual(self.detect("Date,Desc,Amount\n2024-01-02,Cafe,3.50\n2024-01-03,Gas,20\n"), self.header_rule)
+        self.assertEqual(self.detect("02/01/2024;Cafe;3,50\n03/01/2024;Gas;20\n"), self.semicolon_rule)
+        self.assertEqual(self.detect("Cafe,3.50,2024-01-02\nGas,20,2024-01-03\n"), self.date_last_rule)
+
+    def test_no_match(self):
+        message = "No parse rule matches the uploaded file. The file looks ',' delimited with dates formatted as %m/%d/%Y."
+        with self.assertRaisesMessage(ValidationError, message):
+            self.detect("01/31/2024,Cafe,3.50\n02/01/2024,Gas,20\n")
+
+    def test_ambiguous(self):
+        ParseRule.objects.create(
+            user=self.user, account=self.account, name="header 2", date_fmt_str="%Y-%m-%d", start_line=1, date_col=0, desc_col=1, amount_col=2
+        )
+        with self.assertRaisesMessage(ValidationError, "The uploaded file matches several parse rules (header, header 2), select one."):
+            self.detect("Date,Desc,Amount\n2024-01-02,Cafe,3.50\n")
+
+    def test_reads_only_the_start(self):
+        text = "Date,Desc,Amount\n" + "2024-01-02,Cafe,3.50\n" * (SNIFF_SIZE // 10) + "bad row\n"
+        file = io.BytesIO(text.encode("utf-8"))
+        self.assertTrue(read_sample(file).endswith(b"3.50\n"))
+        self.assertEqual(file.tell(), 0)
+        self.assertEqual(detect_parse_rule(file, self.user), self.header_rule)
+
+    def test_form_auto_detect(self):
+        file = SimpleUploadedFile("a.csv", b"Date,Desc,Amount\n2024-01-02,Cafe,3.50\n")
+        form = FileSelectForm({"choice": ""}, {"file": file}, user=self.user, defer_upload=True)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["choice"], str(self.header_rule.pk))
+
+        # A selected rule that can not parse the start of the file fails before the upload is queued
+        file = SimpleUploadedFile("a.csv", b"Date,Desc,Amount\n2024-01-02,Cafe,3.50\n")
+        form = FileSelectForm({"choice": self.semicolon_rule.pk}, {"file": file}, user=self.user, defer_upload=True)
+        self.assertFalse(form.is_valid())
@@ -0,0 +1,55 @@
+import json
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from main_app.models import Account, Bank, Category, Transaction
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        bank = Bank.objects.create(user=self.user, name="bnk")
+        self.account1 = Account.objects.create(bank=bank, name="act1")
+        self.account2 = Account.objects.create(bank=bank, name="act2")
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        for i, account in enumerate([self.account1, self.account2, self.account1]):
+            Transaction.objects.create(
+                user=self.user, date=f"2024-01-0{i + 1}", description=f"txn {i}", category=self.food, category_override=False, account=account, amount=i + 0.5
+            )
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse("transactions"), {"getCsv": "True", **params})
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        self.assertEqual(
+            self.export().splitlines(),
+            [
+                "Date,Account,Description,Category,Amount",
+                "2024-01-01,act1,txn 0,food,0.50",
+                "2024-01-02,act2,txn 1,food,1.50",
+                "2024-01-03,act1,txn 2,food,2.50",
+            ],
+        )
+
+    def test_ndjson_filters(self):
+        rows = [json.loads(line) for line in self.export(format="ndjson", start="2024-01-02", account=self.account1.pk).splitlines()]
+        self.assertEqual(rows, [{"id": rows[0]["id"], "date": "2024-01-03", "account": "act1", "description": "txn 2", "category": "food", "amount": "2.50"}])
+
+    def test_json_columns(self):
+        batch = json.loads(self.export(format="json-columns", end="2024-01-02"))
+        self.assertEqual(batch["date"], ["2024-01-01", "2024-01-02"])
+        self.assertEqual(batch["amount"], ["0.50", "1.50"])
+
+    @override_settings(SERVER_MODE="asgi")
+    async def test_asgi_export(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("transactions"), {"getCsv": "True"})
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(b"".join([chunk async for chunk in response.streaming_content]).decode().splitlines()), 4)
+
+    def test_invalid_export(self):
+        self.assertEqual(self.client.get(reverse("transactions"), {"getCsv": "True", "format": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("transactions"), {"getCsv": "True", "start": "01/02/2024"}).status_code, 400)
@@ -1,9 +1,11 @@
 import os
+import json
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from main_app.forms import ParseRuleForm, FileSelectForm
+from main_app.forms import ParseRuleForm, FileSelectForm, CategoryJsonFileForm
 from main_app.models import Account, Bank, ParseRule
+from main_app.tests import use_temp_media_root
 
 
 class ParseRuleFormTests(TestCase):
@@ -48,8 +50,20 @@ class ParseRuleFormTests(TestCase):
         self.assertFormError(bad_rule, None, "The same column index cannot be used more than once.")
 
 
+    def test_credit_debit_validation(self):
+        data = {"account": self.account1.pk, "name": "split", "date_fmt_str": "%Y-%m-%d", "date_col": 0, "desc_col": 1, "amount_col": 2}
+        self.assertTrue(ParseRuleForm({**data, "credit_col": 3}, user=self.user1).is_valid())
+        self.assertFalse(ParseRuleForm({**data, "credit_col": 2}, user=self.user1).is_valid())
+        self.assertTrue(ParseRuleForm({**data, "txn_type_col": 3, "debit_values": "DR"}, user=self.user1).is_valid())
+        form = ParseRuleForm({**data, "txn_type_col": 3}, user=self.user1)
+        self.assertFormError(form, None, "Enter the debit or credit indicator values.")
+        form = ParseRuleForm({**data, "txn_type_col": 3, "credit_col": 4, "debit_values": "DR"}, user=self.user1)
+        self.assertFormError(form, None, "A credit amount column cannot be combined with a credit/debit indicator.")
+
+
 class FileSelectFormTests(TestCase):
     def setUp(self):
+        use_temp_media_root(self)
         self.user1 = User.objects.create_user(username="user1", password="password")
         self.user2 = User.objects.create_user(username="user2", password="password")
         self.bank = Bank.objects.create(user=self.user1, name="bnk")
@@ -82,4 +96,19 @@ class FileSelectFormTests(TestCase):
         mock_file = self.get_mock_file(f"invalid1.csv")
         invalid_form = FileSelectForm({"choice": self.prule1.pk}, {"file": mock_file}, user=self.user1)
         self.assertFalse(invalid_form.is_valid())
-        self.assertFormError(invalid_form, None, "Invalid CSV file, all rows must have the same number of columns.")
\ No newline at end of file
+        self.assertFormError(invalid_form, None, "Invalid CSV file, all rows must have the same number of columns.")
+
+
+class CategoryJsonFileFormTests(TestCase):
+    def json_form(self, match_text):
+        data = [{"name": "transport", "priority": 1, "rules": [{"match_type": "regex", "match_text": match_text}]}]
+        return CategoryJsonFileForm(files={"json_file": SimpleUploadedFile("rules.json", json.dumps(data).encode("utf-8"))})
+
+    def test_regex_rules_validated(self):
+        self.assertTrue(self.json_form(r"^UBER\s*\*?TRIP").is_valid())
+        form = self.json_form("(unclosed")
+        self.assertFalse(form.is_valid())
+        self.assertIn("Invalid regular expression", form.errors["json_file"][0])
+        form = self.json_form("(a+)+$")
+        self.assertFalse(form.is_valid())
+        self.assertIn("nested repeats", form.errors["json_file"][0])
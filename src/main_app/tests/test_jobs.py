@@ -0,0 +1,148 @@
+import io
+import os
+import uuid
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from main_app.models import Account, Bank, Category, CategoryRule, Job, ParseRule, Transaction
+from main_app.jobs import JOB_HANDLERS, enqueue_job
+from main_app.staging import StagedUpload, get_staging_dir, get_staging_path, staged_upload_exists
+from main_app.tests import use_temp_media_root
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.prule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="prule1", date_fmt_str="%y-%d-%m", date_col=0, desc_col=1, amount_col=2
+        )
+        self.client.force_login(self.user)
+
+    def enqueue_upload(self, file_name):
+        with open(f"{os.path.dirname(__file__)}/test_data/" + file_name, "rb") as file:
+            raw_file = default_storage.save(f"raw/{self.user.pk}", ContentFile(file.read()))
+        return enqueue_job(self.user, "upload", file=raw_file, parse_rule=self.prule.pk, upload_id=str(uuid.uuid4()))
+
+    def test_upload_job(self):
+        job = self.enqueue_upload("valid1.csv")
+        call_command("run_jobs", once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "done")
+        self.assertTrue(staged_upload_exists(self.user.pk, job.params["upload_id"]))
+        self.assertFalse(default_storage.exists(job.params["file"]))
+
+    def test_upload_view_enqueues_job(self):
+        with open(f"{os.path.dirname(__file__)}/test_data/valid1.csv", "rb") as file:
+            response = self.client.post(reverse("upload"), {"preview-upload": "Submit", "choice": self.prule.pk, "file": file})
+        job = response.context["job"]
+        self.assertEqual((job.job_type, job.status), ("upload", "queued"))
+        call_command("run_jobs", once=True, stdout=io.StringIO())
+        self.assertEqual(self.client.get(reverse("job_status", args=[job.pk])).json()["status"], "done")
+
+    def test_failed_upload_job(self):
+        job = self.enqueue_upload("invalid1.csv")
+        call_command("run_jobs", once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "Invalid CSV file, all rows must have the same number of columns.")
+
+        response = self.client.get(reverse("job_status", args=[job.pk]))
+        self.assertEqual(response.json()["status"], "failed")
+        self.client.force_login(User.objects.create_user(username="user2", password="password"))
+        self.assertEqual(self.client.get(reverse("job_status", args=[job.pk])).status_code, 404)
+
+    def test_stale_running_jobs_failed(self):
+        stale, alive = enqueue_job(self.user, "recategorize"), enqueue_job(self.user, "recategorize")
+        Job.objects.filter(pk=stale.pk).update(status="running", updated=timezone.now() - timedelta(hours=1))
+        Job.objects.filter(pk=alive.pk).update(status="running")
+        stdout = io.StringIO()
+        call_command("run_jobs", once=True, stdout=stdout)
+        self.assertIn("Failed 1 interrupted jobs", stdout.getvalue())
+        stale.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual((stale.status, stale.error), ("failed", "The job was interrupted, please try again."))
+        self.assertEqual(alive.status, "running")
+
+    def test_job_errors_logged(self):
+        job = enqueue_job(self.user, "recategorize")
+        with mock.patch.dict(JOB_HANDLERS, {"recategorize": mock.Mock(side_effect=RuntimeError)}), self.assertLogs("main_app.jobs", "ERROR"):
+            call_command("run_jobs", once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ("failed", "Internal server error."))
+
+    @override_settings(UPLOAD_PROCESSES=1)
+    def test_batch_upload(self):
+        account2 = Account.objects.create(bank=self.account.bank, name="act2")
+        prule2 = ParseRule.objects.create(user=self.user, account=account2, name="prule2", date_fmt_str="%y-%d-%m", date_col=0, desc_col=1, amount_col=2)
+
+        def post_batch(*files):
+            data = {"batch-upload": "Submit", "batch-TOTAL_FORMS": len(files) + 1, "batch-INITIAL_FORMS": 0}
+            for idx, (file_name, prule) in enumerate(files):
+                with open(f"{os.path.dirname(__file__)}/test_data/" + file_name, "rb") as file:
+                    data[f"batch-{idx}-file"] = SimpleUploadedFile(file_name, file.read())
+                data[f"batch-{idx}-choice"] = prule.pk
+            job = self.client.post(reverse("upload"), data).context["job"]
+            call_command("run_jobs", once=True, stdout=io.StringIO())
+            job.refresh_from_db()
+            return job
+
+        job = post_batch(("valid1.csv", self.prule), ("valid1.csv", self.prule), ("valid1.csv", prule2))
+        self.assertEqual((job.job_type, job.status, job.progress), ("batch_upload", "done", 9))
+        # The parts staged for each file are removed once merged
+        self.assertEqual([name for name in os.listdir(get_staging_dir(self.user.pk)) if name.startswith(job.params["upload_id"])], [job.params["upload_id"]])
+        with StagedUpload(get_staging_path(self.user.pk, job.params["upload_id"])) as staged_upload:
+            self.assertEqual([row[4] for row in staged_upload], [self.account.pk] * 6 + [account2.pk] * 3)
+            # The second copy of the statement for the same account is flagged as duplicates
+            self.assertEqual([staged_upload.is_duplicate(idx) for idx in range(len(staged_upload))], [False] * 3 + [True] * 3 + [False] * 3)
+        self.assertFalse(any(default_storage.exists(raw_file) for raw_file, _, _ in job.params["files"]))
+
+        # The start of each file is checked before the job is queued
+        response = self.client.post(
+            reverse("upload"),
+            {
+                "batch-upload": "Submit",
+                "batch-TOTAL_FORMS": 1,
+                "batch-INITIAL_FORMS": 0,
+                "batch-0-file": SimpleUploadedFile("a.csv", b"24-01-01,a,1\n24-01-02,b\n"),
+                "batch-0-choice": self.prule.pk,
+            },
+        )
+        self.assertEqual(response.context["batch_formset"].errors, [{"__all__": ["Invalid CSV file, all rows must have the same number of columns."]}])
+
+        upload_job = self.enqueue_upload("invalid1.csv")
+        job = enqueue_job(self.user, "batch_upload", files=[[upload_job.params["file"], self.prule.pk, "invalid1.csv"]], upload_id=str(uuid.uuid4()))
+        upload_job.delete()
+        call_command("run_jobs", once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "invalid1.csv: Invalid CSV file, all rows must have the same number of columns.")
+        self.assertFalse([name for name in os.listdir(get_staging_dir(self.user.pk)) if name.startswith(job.params["upload_id"])])
+
+    def test_recategorize_job(self):
+        cat = Category.objects.create(user=self.user, name="food", priority=1)
+        txn = Transaction.objects.create(
+            user=self.user,
+            date="2024-01-01",
+            description="market",
+            category=Category.get_uncategorized(self.user),
+            category_override=False,
+            account=self.account,
+            amount=1,
+        )
+        CategoryRule.objects.create(category=cat, match_type="contains", match_text="market")
+        job = enqueue_job(self.user, "recategorize", categories=[], rules=[["contains", "market"]])
+        call_command("run_jobs", once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        txn.refresh_from_db()
+        self.assertEqual(job.status, "done")
+        self.assertEqual(txn.category, cat)
+        self.assertFalse(Job.objects.filter(status="queued").exists())
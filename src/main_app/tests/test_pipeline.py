@@ -0,0 +1,262 @@
+import io
+import os
+import json
+import uuid
+import random
+import importlib
+from collections import Counter
+from decimal import Decimal
+from datetime import date, datetime
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from main_app.forms import FileSelectForm
+from main_app.models import Account, Bank, Category, CategoryRule, ParseRule, Transaction
+from main_app.readers import read_csv_rows
+from main_app.pipeline import parse_rows, bulk_create_transactions, flag_duplicate_rows, Fingerprinter
+from main_app.parsers import DateParser, AmountParser
+from main_app.staging import StagingWriter, StagedUpload, get_staging_dir, get_staging_path, staged_upload_exists
+from main_app.tests import use_temp_media_root
+
+
+class PipelineTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.prule = ParseRule.objects.create(
+            user=self.user,
+            account=self.account,
+            name="prule",
+            date_fmt_str="%Y-%m-%d",
+            start_line=1,
+            date_col=0,
+            desc_col=1,
+            sub_desc_col=2,
+            amount_col=3,
+            negate_amount=True,
+        )
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="market")
+        self.client.force_login(self.user)
+
+    def test_parse_rows(self):
+        file = io.StringIO("Date,Desc,Sub,Amount\n2024-01-02, Market , st,\"$1,234.50\"\n2024-01-03,Gas,,-3\n")
+        rows = list(parse_rows(read_csv_rows(file, self.prule), self.prule))
+        self.assertEqual(rows, [(1, datetime(2024, 1, 2), "Market st", Decimal("-1234.50")), (2, datetime(2024, 1, 3), "Gas ", Decimal("3.00"))])
+
+    def test_exact_amounts(self):
+        file = io.StringIO("header\n" + "".join(f"2024-01-02,a,,{amount}\n" for amount in ["0.1", "0.2", "-0.3", "19.999", "1e2", "1.005", "-2.125"]))
+        amounts = [row[3] for row in parse_rows(read_csv_rows(file, self.prule), self.prule)]
+        self.assertEqual([str(amount) for amount in amounts], ["-0.10", "-0.20", "0.30", "-20.00", "-100.00", "-1.01", "2.13"])
+        self.assertEqual(sum(amounts[:3]), 0)
+
+    def test_amount_formats(self):
+        file = io.StringIO("header\n" + "".join(f'2024-01-02,a,,"{amount}"\n' for amount in ["$1,234.50", "(12.50)", " (3) ", "-$0.5"]))
+        self.assertEqual([str(row[3]) for row in parse_rows(read_csv_rows(file, self.prule), self.prule)], ["-1234.50", "12.50", "3.00", "0.50"])
+
+        self.prule.decimal_comma = True
+        file = io.StringIO("header\n" + "".join(f'2024-01-02,a,,"{amount}"\n' for amount in ["1.234,50", "1 234,5", "(0,99)", "12"]))
+        self.assertEqual([str(row[3]) for row in parse_rows(read_csv_rows(file, self.prule), self.prule)], ["-1234.50", "-1234.50", "0.99", "-12.00"])
+
+    def parse_amounts(self, parse_rule, text):
+        return [str(row[3]) for row in parse_rows(read_csv_rows(io.StringIO(text), parse_rule), parse_rule)]
+
+    def test_credit_debit_indicator(self):
+        prule = ParseRule(date_fmt_str="%Y-%m-%d", date_col=0, desc_col=1, amount_col=2, txn_type_col=3, debit_values="DR, debit", credit_values="CR")
+        self.assertEqual(self.parse_amounts(prule, "2024-01-02,a,5,DR\n2024-01-02,b,-5,cr\n2024-01-02,c,1.5, Debit \n"), ["-5.00", "5.00", "-1.50"])
+        with self.assertRaisesMessage(ValidationError, "Unknown credit/debit indicator (x) on line 1."):
+            self.parse_amounts(prule, "2024-01-02,a,5,DR\n2024-01-02,b,5,X\n")
+
+        # With only debit values configured every other value is a credit
+        prule.credit_values, prule.negate_amount = "", True
+        self.assertEqual(self.parse_amounts(prule, "2024-01-02,a,5,DR\n2024-01-02,b,5,\n"), ["5.00", "-5.00"])
+
+        # An indicator column without configured values leaves the amounts as they are in the file
+        prule.debit_values, prule.negate_amount = "", False
+        self.assertEqual(prule.get_sign_values(), ({}, None))
+        self.assertEqual(self.parse_amounts(prule, "2024-01-02,a,5,CR\n2024-01-02,b,-7,DR\n"), ["5.00", "-7.00"])
+
+    def test_debit_credit_columns(self):
+        prule = ParseRule(date_fmt_str="%Y-%m-%d", date_col=0, desc_col=1, amount_col=2, credit_col=3)
+        text = "2024-01-02,a,5,\n2024-01-02,b,,7.25\n2024-01-02,c,0.00,3\n2024-01-02,d,-2,\n"
+        self.assertEqual(self.parse_amounts(prule, text), ["-5.00", "7.25", "3.00", "-2.00"])
+        with self.assertRaisesMessage(ValidationError, "Line 0 has both a debit and a credit amount."):
+            self.parse_amounts(prule, "2024-01-02,a,5,1\n")
+        with self.assertRaisesMessage(ValidationError, "The value (x) on line 0 column 3 is not a number"):
+            self.parse_amounts(prule, "2024-01-02,a,,x\n")
+
+    def test_parse_errors(self):
+        with self.assertRaisesMessage(ValidationError, "The value (abc) on line 2 column 3 is not a number"):
+            list(parse_rows(read_csv_rows(io.StringIO("header\n2024-01-02,a,b,1\n2024-01-02,a,b,abc\n"), self.prule), self.prule))
+        for amount in ["nan", "inf", "1e13"]:
+            with self.assertRaisesMessage(ValidationError, f"The value ({amount}) on line 1 column 3 is not a number"):
+                list(parse_rows(read_csv_rows(io.StringIO(f"header\n2024-01-02,a,b,{amount}\n"), self.prule), self.prule))
+        with self.assertRaisesMessage(ValidationError, "Error parsing date on line 1."):
+            list(parse_rows(read_csv_rows(io.StringIO("header\n01/02/2024,a,b,1\n"), self.prule), self.prule))
+        with self.assertRaisesMessage(ValidationError, "Indexing error present on line 1."):
+            list(parse_rows(read_csv_rows(io.StringIO("header\n2024-01-02,a\n"), self.prule), self.prule))
+
+    @override_settings(UPLOAD_BATCH_SIZE=2)
+    def test_batched_insert(self):
+        txns = (
+            Transaction(
+                user=self.user, date="2024-01-01", description=f"txn {i}", category=self.food, category_override=False, account=self.account, amount=i
+            )
+            for i in range(5)
+        )
+        # One query per batch plus the savepoint
+        with self.assertNumQueries(5):
+            bulk_create_transactions(txns)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 5)
+
+    def stage_upload(self):
+        file = io.StringIO("Date,Desc,Sub,Amount\n2024-01-02,Market,st,10\n2024-01-03,Gas,,20\n2024-01-04,Cafe,,30\n")
+        form = FileSelectForm(user=self.user)
+        form.validate_upload(file, self.prule.pk)
+        return form
+
+    def get_preview_data(self, upload_id, **params):
+        response = self.client.get(reverse("upload_preview_data", args=[upload_id]), params)
+        # The WSGI test client is served a sync iterator, streamed without buffering
+        self.assertFalse(response.is_async)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_preview_data(self):
+        form = self.stage_upload()
+        self.assertEqual(
+            self.get_preview_data(form.upload_id, page=2, size=2),
+            {
+                "last_page": 2,
+                "last_row": 3,
+                "data": [{"idx": 2, "date": "2024-01-04", "desc": "Cafe ", "cat": "Uncategorized", "amnt": "-30.00", "accnt": "act", "dup": False}],
+            },
+        )
+        response = self.get_preview_data(form.upload_id)
+        self.assertEqual(
+            response["data"][0], {"idx": 0, "date": "2024-01-02", "desc": "Market st", "cat": "food", "amnt": "-10.00", "accnt": "act", "dup": False}
+        )
+        response = self.client.get(reverse("upload_preview_data", args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(TABLE_PAGE_SIZE=2)
+    def test_preview_data_default_page(self):
+        form = self.stage_upload()
+        response = self.get_preview_data(form.upload_id)
+        self.assertEqual(([row["idx"] for row in response["data"]], response["last_page"]), ([0, 1], 2))
+
+    @override_settings(SERVER_MODE="asgi")
+    async def test_preview_data_asgi(self):
+        form = await sync_to_async(self.stage_upload)()
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse("upload_preview_data", args=[form.upload_id]))
+        # Under ASGI the rows are streamed from an async iterator instead of being collected into a list first
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(json.loads(b"".join([chunk async for chunk in response.streaming_content]))["data"]), 3)
+
+    def test_upload_and_commit(self):
+        form = self.stage_upload()
+        changes = {"changes": {"1": {"category": self.food.pk, "override": True}}, "deleted": [2]}
+        self.client.post(reverse("upload_preview", args=[form.upload_id]), json.dumps(changes), content_type="application/json")
+
+        txns = Transaction.objects.filter(user=self.user).order_by("date")
+        self.assertEqual([(txn.description, txn.category, txn.category_override, txn.amount) for txn in txns], [
+            ("Market st", self.food, False, -10.0),
+            ("Gas ", self.food, True, -20.0),
+        ])
+        self.assertFalse(staged_upload_exists(self.user.pk, form.upload_id))
+
+    def test_duplicate_uploads(self):
+        def upload(text, **change_data):
+            form = FileSelectForm(user=self.user)
+            form.validate_upload(io.StringIO("Date,Desc,Sub,Amount\n" + text), self.prule.pk)
+            with StagedUpload(get_staging_path(self.user.pk, form.upload_id)) as staged_upload:
+                duplicates = [staged_upload.is_duplicate(idx) for idx in range(len(staged_upload))]
+            changes = {"changes": {}, "deleted": [], **change_data}
+            self.client.post(reverse("upload_preview", args=[form.upload_id]), json.dumps(changes), content_type="application/json")
+            return duplicates
+
+        self.assertEqual(upload("2024-01-02,Cafe,,3.50\n2024-01-02,Cafe,,3.50\n2024-01-03,Gas,,20\n"), [False, False, False])
+        # The overlapping statement repeats the cafe transactions with different spacing and case, plus a third new one
+        with self.assertNumQueries(1):
+            list(flag_duplicate_rows([(1, None, "", 0, 0, "a"), (2, None, "", 0, 0, "b")]))
+        self.assertEqual(upload("2024-01-02,CAFE ,,3.5\n2024-01-02, cafe,,3.50\n2024-01-02,Cafe,,3.50\n2024-01-04,Gas,,20\n"), [True, True, False, False])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 5)
+
+        self.assertEqual(upload("2024-01-04,Gas,,20\n", keep_duplicates=True), [True])
+        self.assertEqual(Transaction.objects.filter(user=self.user, description="Gas ", date="2024-01-04").count(), 2)
+
+    def test_backfilled_fingerprints(self):
+        migration = importlib.import_module("main_app.migrations.0005_transaction_fingerprint")
+        # The float amounts stored before 0007 hash like the decimal amounts of the same rows uploaded today
+        occurrences, fingerprinter = Counter(), Fingerprinter()
+        for amount, decimal_amount in [(1.005, "1.01"), (0.1 + 0.2, "0.30"), (-20.0, "-20.00"), (1.005, "1.01")]:
+            backfilled = migration.get_fingerprint(occurrences, 7, date(2024, 1, 2), amount, " Cafe  X")
+            self.assertEqual(backfilled, fingerprinter(7, date(2024, 1, 2), Decimal(decimal_amount), "cafe x"))
+
+
+class ParserTests(TestCase):
+    def test_dates_match_strptime(self):
+        rand = random.Random(0)
+        for date_fmt in ["%Y-%m-%d", "%y-%d-%m", "%d/%m/%Y", "%Y%m%d", "%m/%d/%y", "%Y-%m-%d %H:%M:%S", "%d %b %Y"]:
+            parse_date = DateParser(date_fmt)
+            for _ in range(2000):
+                text = list(datetime(rand.randint(1, 9999), rand.randint(1, 12), rand.randint(1, 28)).strftime(date_fmt))
+                for _ in range(rand.randint(0, 2)):
+                    text[rand.randrange(len(text))] = rand.choice("0123456789-/ ")
+                text = "".join(text)
+                try:
+                    expected = datetime.strptime(text, date_fmt)
+                except ValueError:
+                    with self.assertRaises(ValueError, msg=(date_fmt, text)):
+                        parse_date(text)
+                else:
+                    self.assertEqual(parse_date(text), expected, (date_fmt, text))
+
+    def test_amounts_match_replace(self):
+        parse_amount = AmountParser()
+        for text in ["$1,234.50", " 7 ", "-1e2", "1_000", "+3", "$", "1,2,3"]:
+            cleaned = parse_amount.clean(text)
+            self.assertEqual(cleaned, text.replace("$", "").replace(",", ""))
+            try:
+                expected = Decimal(cleaned)
+            except ArithmeticError:
+                with self.assertRaises(ArithmeticError):
+                    parse_amount(cleaned)
+            else:
+                self.assertEqual(parse_amount(cleaned), expected)
+
+
+class StagingTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(username="user1", password="password")
+
+    def test_round_trip(self):
+        rows = [(date(2024, 1, i % 28 + 1), f"caf\u00e9 {i}" * (i % 3), i, Decimal(i * 7 - 1000).scaleb(-2), 7) for i in range(StagingWriter.BLOCK_SIZE + 10)]
+        fingerprinter = Fingerprinter()
+        fingerprints = [fingerprinter(7, row[0], row[3], row[1]) for row in rows]
+        with StagingWriter(get_staging_path(self.user.pk, "upload")) as writer:
+            for idx, (row, fingerprint) in enumerate(zip(rows, fingerprints)):
+                writer.append(*row, fingerprint, idx % 5 == 0)
+        with StagedUpload(get_staging_path(self.user.pk, "upload")) as staged_upload:
+            self.assertEqual(len(staged_upload), len(rows))
+            self.assertEqual(staged_upload.get_row(5), rows[5])
+            self.assertEqual(list(staged_upload), rows)
+            self.assertEqual([staged_upload.get_fingerprint(idx) for idx in range(len(rows))], fingerprints)
+            self.assertEqual([staged_upload.is_duplicate(idx) for idx in range(len(rows))], [idx % 5 == 0 for idx in range(len(rows))])
+
+    def test_empty_and_failed_uploads(self):
+        with StagingWriter(get_staging_path(self.user.pk, "empty")):
+            pass
+        with StagedUpload(get_staging_path(self.user.pk, "empty")) as staged_upload:
+            self.assertEqual(list(staged_upload), [])
+
+        with self.assertRaises(ValueError):
+            with StagingWriter(get_staging_path(self.user.pk, "failed")) as writer:
+                writer.append(date(2024, 1, 1), "txn", 1, Decimal("1.00"), 1, "0" * 40)
+                raise ValueError
+        self.assertFalse(staged_upload_exists(self.user.pk, "failed"))
+        self.assertEqual(os.listdir(get_staging_dir(self.user.pk)), ["empty"])
@@ -0,0 +1,118 @@
+import io
+import openpyxl
+from decimal import Decimal
+from datetime import datetime
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from main_app.forms import FileSelectForm
+from main_app.models import Account, Bank, ParseRule
+from main_app.detect import detect_parse_rule
+from main_app.pipeline import parse_rows
+from main_app.readers import read_rows, iter_ofx_transactions
+from main_app.tests import use_temp_media_root
+
+OFX_SGML = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<CURDEF>CAD
+<BANKTRANLIST>
+<DTSTART>20240101
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20240102120000[-5:EST]
+<TRNAMT>-3.50
+<FITID>1001
+<NAME>Cafe
+<MEMO>Card 1234
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20240103
+<TRNAMT>1,200.00
+<FITID>1002
+<NAME>Payroll &amp; Co
+</STMTTRN>
+</BANKTRANLIST>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+OFX_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<?OFX OFXHEADER="200" VERSION="220"?>
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>20240102</DTPOSTED><TRNAMT>-3.50</TRNAMT><FITID>1001</FITID><NAME>Cafe</NAME></STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+def make_workbook(rows):
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    file = io.BytesIO()
+    workbook.save(file)
+    return file.getvalue()
+
+
+class ReaderTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.xlsx_rule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="xlsx", file_format="xlsx", date_fmt_str="%Y-%m-%d", start_line=1, date_col=0, desc_col=1, amount_col=2
+        )
+        self.ofx_rule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="ofx", file_format="ofx", date_fmt_str="%Y%m%d", date_col=0, desc_col=1, sub_desc_col=2, amount_col=3
+        )
+        self.csv_rule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="csv", date_fmt_str="%Y-%m-%d", start_line=1, date_col=0, desc_col=1, amount_col=2
+        )
+
+    def parse(self, data, parse_rule):
+        return [(row[1], row[2], row[3]) for row in parse_rows(read_rows(io.BytesIO(data), parse_rule), parse_rule)]
+
+    def test_xlsx(self):
+        data = make_workbook(
+            [["Date", "Desc", "Amount"], [datetime(2024, 1, 2), "Cafe", 3.5], [], ["2024-01-03", "Gas", "20"], [datetime(2024, 1, 4), None, -1]]
+        )
+        self.assertEqual(
+            self.parse(data, self.xlsx_rule),
+            [(datetime(2024, 1, 2), "Cafe", Decimal("3.50")), (datetime(2024, 1, 3), "Gas", Decimal("20.00")), (datetime(2024, 1, 4), "", Decimal("-1.00"))],
+        )
+        with self.assertRaisesMessage(ValidationError, "The uploaded file is not a valid Excel workbook."):
+            self.parse(b"Date,Desc,Amount\n", self.xlsx_rule)
+
+    def test_ofx(self):
+        rows = [(datetime(2024, 1, 2), "Cafe Card 1234", Decimal("-3.50")), (datetime(2024, 1, 3), "Payroll & Co ", Decimal("1200.00"))]
+        self.assertEqual(self.parse(OFX_SGML.encode(), self.ofx_rule), rows)
+        self.assertEqual(self.parse(OFX_XML.encode(), self.ofx_rule), [(datetime(2024, 1, 2), "Cafe ", Decimal("-3.50"))])
+        # Tags split across chunks are read the same as whole ones
+        for chunk_size in (1, 7, 64):
+            self.assertEqual(list(iter_ofx_transactions(io.StringIO(OFX_SGML), chunk_size)), list(iter_ofx_transactions(io.StringIO(OFX_SGML))))
+
+    def test_detect_format(self):
+        self.assertEqual(detect_parse_rule(io.BytesIO(OFX_SGML.encode()), self.user), self.ofx_rule)
+        workbook = make_workbook([["Date", "Desc", "Amount"], [datetime(2024, 1, 2), "Cafe", 3.5]])
+        self.assertEqual(detect_parse_rule(io.BytesIO(workbook), self.user), self.xlsx_rule)
+        self.assertEqual(detect_parse_rule(io.BytesIO(b"Date,Desc,Amount\n2024-01-02,Cafe,3.50\n"), self.user), self.csv_rule)
+        with self.assertRaisesMessage(ValidationError, "No parse rule matches the uploaded Excel (XLSX) file."):
+            detect_parse_rule(io.BytesIO(make_workbook([["Cafe", "x", "y"]])), self.user)
+
+    def test_form_upload(self):
+        data = make_workbook([["Date", "Desc", "Amount"], [datetime(2024, 1, 2), "Cafe", 3.5], [datetime(2024, 1, 3), "Gas", 20]])
+        form = FileSelectForm({"choice": self.xlsx_rule.pk}, {"file": SimpleUploadedFile("a.xlsx", data)}, user=self.user)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.row_count, 2)
+
+        form = FileSelectForm({"choice": ""}, {"file": SimpleUploadedFile("a.qfx", OFX_SGML.encode())}, user=self.user)
+        self.assertTrue(form.is_valid())
+        self.assertEqual((form.cleaned_data["choice"], form.row_count), (str(self.ofx_rule.pk), 2))
+
+        # A CSV file selected with an Excel rule fails on its sample before being queued
+        form = FileSelectForm({"choice": self.xlsx_rule.pk}, {"file": SimpleUploadedFile("a.csv", b"Date,Desc,Amount\n")}, user=self.user, defer_upload=True)
+        self.assertFalse(form.is_valid())
@@ -0,0 +1,90 @@
+import json
+from django.test import TestCase
+from django.db.models import Q
+from django.urls import reverse
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from main_app.models import Account, Bank, Category, CategoryClosure, CategoryRule, Job, Transaction
+from main_app.rule_import import import_category_rules
+from main_app.common import MAX_FILTER_RULES, build_user_categorizer, get_recategorization_changes, get_recategorization_filter, recategorize_changed_rules
+
+RULE_FILE = [
+    {"name": "food", "priority": 1, "rules": [{"match_type": "contains", "match_text": "market"}, {"match_type": "contains", "match_text": "cafe"}]},
+    {"name": "transport", "priority": 2, "rules": [{"match_type": "starts_with", "match_text": "uber"}, {"match_type": "starts_with", "match_text": "uber"}]},
+]
+
+
+class RuleImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.parent = Category.objects.create(user=self.user, name="living", priority=0)
+        self.food = Category.objects.create(user=self.user, name="food", priority=5, parent=self.parent)
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="market")
+        CategoryRule.objects.create(category=self.food, match_type="equals", match_text="bakery")
+
+    def test_upsert(self):
+        report = import_category_rules(self.user, RULE_FILE)
+        self.assertEqual(report, {"categories_created": 1, "categories_updated": 1, "rules_created": 2, "rules_unchanged": 1})
+
+        food = Category.objects.get(pk=self.food.pk)
+        self.assertEqual((food.priority, food.parent), (1, self.parent))
+        self.assertEqual(set(food.rule_set.values_list("match_type", "match_text")), {("contains", "market"), ("contains", "cafe"), ("equals", "bakery")})
+        transport = Category.objects.get(user=self.user, name="transport")
+        self.assertEqual(list(transport.rule_set.values_list("match_type", "match_text")), [("starts_with", "uber")])
+        self.assertTrue(CategoryClosure.objects.filter(ancestor=transport, descendant=transport).exists())
+
+        with self.assertNumQueries(5):
+            report = import_category_rules(self.user, RULE_FILE)
+        self.assertEqual(report, {"categories_created": 0, "categories_updated": 0, "rules_created": 0, "rules_unchanged": 3})
+        self.assertEqual(CategoryRule.objects.filter(category__user=self.user).count(), 4)
+
+    def test_import_view(self):
+        account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        Transaction.objects.create(
+            user=self.user,
+            date="2024-01-01",
+            description="uber trip",
+            category=Category.get_uncategorized(self.user),
+            category_override=False,
+            account=account,
+            amount=1,
+        )
+        self.client.login(username="user1", password="password")
+
+        def post_file():
+            data = {
+                "save-changes": "Save",
+                "json_file": SimpleUploadedFile("rules.json", json.dumps(RULE_FILE).encode("utf-8")),
+                "category_set-TOTAL_FORMS": 0,
+                "category_set-INITIAL_FORMS": 0,
+            }
+            return self.client.post(reverse("category_rules"), data, follow=True)
+
+        response = post_file()
+        self.assertIn("2 rules created", str(list(response.context["messages"])[0]))
+        job = Job.objects.get(user=self.user, job_type="recategorize")
+        self.assertEqual(job.params["rules"], [["contains", "cafe"], ["starts_with", "uber"]])
+
+        # Importing the same file again changes nothing, so no recategorization is queued
+        response = post_file()
+        self.assertIn("0 rules created", str(list(response.context["messages"])[0]))
+        self.assertEqual(Job.objects.filter(user=self.user, job_type="recategorize").count(), 1)
+
+    def test_large_import_recategorizes_with_a_scan(self):
+        account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        uncategorized = Category.get_uncategorized(self.user)
+        for description in ["shop 7", "shop 1999", "gas"]:
+            Transaction.objects.create(
+                user=self.user, date="2024-01-01", description=description, category=uncategorized, category_override=False, account=account, amount=1
+            )
+        old_categorizer = build_user_categorizer(self.user)
+        rules = [{"match_type": "ends_with", "match_text": f"shop {idx}"} for idx in range(2000)]
+        import_category_rules(self.user, [{"name": "shops", "priority": 3, "rules": rules}])
+        new_categorizer = build_user_categorizer(self.user)
+
+        changes = get_recategorization_changes(old_categorizer, new_categorizer)
+        self.assertGreater(len(changes["rules"]), MAX_FILTER_RULES)
+        self.assertEqual(get_recategorization_filter(changes), Q())
+        self.assertEqual(recategorize_changed_rules(self.user, old_categorizer, new_categorizer), 2)
+        shops = Category.objects.get(user=self.user, name="shops")
+        self.assertEqual(set(Transaction.objects.filter(category=shops).values_list("description", flat=True)), {"shop 7", "shop 1999"})
@@ -0,0 +1,74 @@
+import io
+import json
+from decimal import Decimal
+from datetime import date
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from main_app.forms import FileSelectForm
+from main_app.models import Account, Bank, Category, CategoryRule, MonthlySummary, ParseRule, Transaction
+from main_app.common import get_user_categorizer, recategorize_changed_rules
+from main_app.tests import use_temp_media_root
+
+
+class MonthlySummaryTests(TestCase):
+    def setUp(self):
+        use_temp_media_root(self)
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.prule = ParseRule.objects.create(
+            user=self.user, account=self.account, name="prule", date_fmt_str="%Y-%m-%d", start_line=1, date_col=0, desc_col=1, amount_col=2
+        )
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        CategoryRule.objects.create(category=self.food, match_type="contains", match_text="market")
+        self.client.force_login(self.user)
+        self.upload("2024-01-02,Market,10.25\n2024-01-30,Market,4.75\n2024-02-03,Gas,20\n2024-03-01,Cafe,3.50\n")
+
+    def upload(self, text):
+        form = FileSelectForm(user=self.user)
+        form.validate_upload(io.StringIO("Date,Desc,Amount\n" + text), self.prule.pk)
+        changes = json.dumps({"changes": {}, "deleted": []})
+        self.client.post(reverse("upload_preview", args=[form.upload_id]), changes, content_type="application/json")
+
+    def summaries(self):
+        return sorted((row.month, row.category.name, row.count, row.total.quantize(Decimal("0.01"))) for row in MonthlySummary.objects.filter(user=self.user))
+
+    def test_upload(self):
+        uncategorized = "Uncategorized"
+        self.assertEqual(
+            self.summaries(),
+            [
+                (date(2024, 1, 1), "food", 2, Decimal("15.00")),
+                (date(2024, 2, 1), uncategorized, 1, Decimal("20.00")),
+                (date(2024, 3, 1), uncategorized, 1, Decimal("3.50")),
+            ],
+        )
+        self.upload("2024-03-09,Market,1\n")
+        self.assertEqual(self.summaries()[2:], [(date(2024, 3, 1), uncategorized, 1, Decimal("3.50")), (date(2024, 3, 1), "food", 1, Decimal("1.00"))])
+
+    def test_edits_and_deletes(self):
+        gas, cafe = Transaction.objects.get(description="Gas"), Transaction.objects.get(description="Cafe")
+        changes = {"changes": {str(gas.pk): {"category": self.food.pk, "override": True}}, "deleted": [cafe.pk]}
+        self.client.post(reverse("transactions"), json.dumps(changes), content_type="application/json")
+        self.assertEqual(self.summaries(), [(date(2024, 1, 1), "food", 2, Decimal("15.00")), (date(2024, 2, 1), "food", 1, Decimal("20.00"))])
+
+    def test_recategorization_and_category_delete(self):
+        old_categorizer = get_user_categorizer(self.user)
+        cafe = Category.objects.create(user=self.user, name="cafe", priority=0)
+        CategoryRule.objects.create(category=cafe, match_type="equals", match_text="cafe")
+        recategorize_changed_rules(self.user, old_categorizer, get_user_categorizer(self.user))
+        self.assertEqual(self.summaries()[2], (date(2024, 3, 1), "cafe", 1, Decimal("3.50")))
+
+        self.food.delete()
+        self.assertEqual(self.summaries()[0], (date(2024, 1, 1), "Uncategorized", 2, Decimal("15.00")))
+
+    def test_rebuild(self):
+        expected = self.summaries()
+        Transaction.objects.filter(description="Gas").update(amount=5)
+        MonthlySummary.objects.filter(user=self.user).first().delete()
+        stdout = io.StringIO()
+        call_command("rebuild_summaries", user=self.user.pk, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Rebuilt 3 monthly summaries\n")
+        expected[1] = (date(2024, 2, 1), "Uncategorized", 1, Decimal("5.00"))
+        self.assertEqual(self.summaries(), expected)
@@ -0,0 +1,118 @@
+import json
+import asyncio
+import time
+import base64
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth.models import User
+from main_app import views
+from main_app.superset import SupersetClient, AsyncSupersetClient
+
+
+def make_token(lifetime):
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": time.time() + lifetime}).encode()).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+class StubSuperset(BaseHTTPRequestHandler):
+    """Minimal Superset API recording the requests it receives"""
+
+    calls = []
+
+    def respond(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.calls.append(("GET", self.path))
+        responses = {
+            "/api/v1/security/csrf_token": {"result": "csrf"},
+            "/api/v1/dashboard/": {"result": [{"id": 1, "dashboard_title": "other"}, {"id": 7, "dashboard_title": "expenses_dashboard"}]},
+            "/api/v1/dataset/": {"result": [{"id": 3, "table_name": "expenses_dataset"}]},
+            "/api/v1/dashboard/7/embedded": {"result": {"uuid": "embed-uuid"}},
+        }
+        self.respond(responses[self.path])
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.calls.append(("POST", self.path))
+        if self.path == "/api/v1/security/login":
+            self.respond({"access_token": make_token(900)})
+        else:
+            assert self.headers["X-CSRFToken"] == "csrf"
+            self.respond({"token": make_token(300) + body["rls"][0]["clause"]})
+
+    def log_message(self, *args):
+        pass
+
+
+class SupersetClientTests(TestCase):
+    def setUp(self):
+        StubSuperset.calls = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubSuperset)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client_ = SupersetClient(f"http://127.0.0.1:{self.server.server_port}/api/v1/", "admin", "admin")
+        self.user1 = User.objects.create_user(username="user1", password="password")
+        self.user2 = User.objects.create_user(username="user2", password="password")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def embed(self, user):
+        dashboard_id = self.client_.get_dashboard_id("expenses_dashboard")
+        dataset_id = self.client_.get_dataset_id("expenses_dataset")
+        return self.client_.get_guest_token(user, dashboard_id, dataset_id), self.client_.get_embedded_uuid(dashboard_id)
+
+    def test_cached_calls(self):
+        token, uuid = self.embed(self.user1)
+        self.assertTrue(token.endswith(f"user_id={self.user1.pk}"))
+        self.assertEqual(uuid, "embed-uuid")
+        self.assertEqual(len(StubSuperset.calls), 6)
+
+        # Everything is cached for the same user, a new user only needs a guest token
+        self.assertEqual(self.embed(self.user1), (token, uuid))
+        self.assertEqual(len(StubSuperset.calls), 6)
+        self.embed(self.user2)
+        self.assertEqual(StubSuperset.calls[6:], [("POST", "/api/v1/security/guest_token")])
+
+    def test_expired_tokens_are_refreshed(self):
+        self.embed(self.user1)
+        self.client_.access_expiry = time.time()
+        self.client_.guest_tokens = {key: (token, time.time()) for key, (token, expiry) in self.client_.guest_tokens.items()}
+        self.embed(self.user1)
+        self.assertEqual(
+            StubSuperset.calls[6:],
+            [("POST", "/api/v1/security/login"), ("GET", "/api/v1/security/csrf_token"), ("POST", "/api/v1/security/guest_token")],
+        )
+
+    def test_async_client(self):
+        client = AsyncSupersetClient(self.client_.api_endpoint, "admin", "admin")
+
+        async def embed(user):
+            dashboard_id, dataset_id = await asyncio.gather(client.get_dashboard_id("expenses_dashboard"), client.get_dataset_id("expenses_dataset"))
+            return await asyncio.gather(client.get_guest_token(user, dashboard_id, dataset_id), client.get_embedded_uuid(dashboard_id))
+
+        token, uuid = asyncio.run(embed(self.user1))
+        self.assertTrue(token.endswith(f"user_id={self.user1.pk}"))
+        self.assertEqual(uuid, "embed-uuid")
+        self.assertEqual(len(StubSuperset.calls), 6)
+        self.assertEqual(asyncio.run(embed(self.user1)), [token, uuid])
+        self.assertEqual(len(StubSuperset.calls), 6)
+
+    def test_dashboard_view(self):
+        # The default WSGI server uses the pooled sync client
+        self.assertIs(views.dashboard, views.sync_dashboard)
+        self.client.force_login(self.user1)
+        with mock.patch("main_app.views.get_superset_client", return_value=self.client_):
+            response = self.client.get(reverse("dashboard"))
+            self.assertContains(response, "embed-uuid")
+            self.client.get(reverse("dashboard"))
+        self.assertEqual(len(StubSuperset.calls), 6)
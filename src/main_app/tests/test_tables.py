@@ -0,0 +1,122 @@
+import json
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from main_app.models import Account, Bank, Category, Transaction
+
+
+class TransactionTableTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        for i in range(25):
+            Transaction.objects.create(
+                user=self.user,
+                date=f"2024-01-{i % 5 + 1:02}",
+                description=f"market {i % 3}" if i % 2 else f"gas {i % 3}",
+                category=self.food if i % 2 else Category.get_uncategorized(self.user),
+                category_override=False,
+                account=self.account,
+                amount=i,
+            )
+        other_user = User.objects.create_user(username="user2", password="password")
+        Transaction.objects.create(
+            user=other_user, date="2024-01-01", description="other", category_override=False, account=self.account, amount=0
+        )
+        self.client.force_login(self.user)
+
+    def get_page(self, **params):
+        params = {key: json.dumps(value) if key in ["sort", "filter"] else value for key, value in params.items()}
+        response = self.client.get(reverse("transaction_data"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_all_pages(self, **params):
+        rows = []
+        response = self.get_page(page=1, size=7, **params)
+        while True:
+            rows += response["data"]
+            if not response["next_cursor"]:
+                return rows
+            response = self.get_page(page=response["last_page"], size=7, cursor=response["next_cursor"], **params)
+
+    def test_keyset_pages(self):
+        response = self.get_page(page=1, size=7)
+        self.assertEqual((response["last_page"], response["last_row"], response["estimated_count"]), (2, 25, False))
+
+        rows = self.get_all_pages()
+        expected = Transaction.objects.filter(user=self.user).order_by("date", "description", "pk")
+        self.assertEqual([row["idx"] for row in rows], [txn.pk for txn in expected])
+
+    def test_sort_and_filter(self):
+        rows = self.get_all_pages(sort=[{"field": "amnt", "dir": "desc"}])
+        self.assertEqual([row["amnt"] for row in rows], [f"{i}.00" for i in range(24, -1, -1)])
+
+        rows = self.get_all_pages(sort=[{"field": "cat", "dir": "asc"}], filter=[{"field": "desc", "type": "like", "value": "MARKET"}])
+        self.assertEqual(len(rows), 12)
+        self.assertTrue(all(row["cat"] == "food" for row in rows))
+
+        rows = self.get_all_pages(filter=[{"field": "cat", "type": "=", "value": "Uncategorized"}, {"field": "amnt", "type": ">=", "value": 20}])
+        self.assertEqual(sorted(row["amnt"] for row in rows), ["20.00", "22.00", "24.00"])
+
+    @override_settings(TABLE_EXACT_COUNT_LIMIT=10)
+    def test_count_limit(self):
+        response = self.get_page(page=1, size=7)
+        self.assertTrue(response["estimated_count"])
+        self.assertGreaterEqual(response["last_row"], 11)
+
+    def test_invalid_params(self):
+        for params in [{"cursor": "bad"}, {"sort": "[{\"field\": \"user\"}]"}, {"filter": "[{\"field\": \"desc\", \"type\": \"regex\", \"value\": \"x\"}]"}]:
+            response = self.client.get(reverse("transaction_data"), {"page": 2, **params})
+            self.assertEqual(response.status_code, 400)
+
+
+class TransactionEditTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.account = Account.objects.create(bank=Bank.objects.create(user=self.user, name="bnk"), name="act")
+        self.food = Category.objects.create(user=self.user, name="food", priority=1)
+        self.food.rule_set.create(match_type="contains", match_text="market")
+        self.txns = [
+            Transaction.objects.create(
+                user=self.user, date="2024-01-01", description=description, category=self.food, category_override=True, account=self.account, amount=1
+            )
+            for description in ["market", "gas", "cafe"]
+        ]
+        self.other_category = Category.objects.create(user=User.objects.create_user(username="user2", password="password"), name="other", priority=1)
+        self.client.force_login(self.user)
+
+    def post_changes(self, changes, deleted=[]):
+        return self.client.post(reverse("transactions"), json.dumps({"changes": changes, "deleted": deleted}), content_type="application/json")
+
+    def test_batch_edit(self):
+        uncategorized = Category.get_uncategorized(self.user)
+        changes = {
+            self.txns[0].pk: {"category": None, "override": False},
+            self.txns[1].pk: {"category": None, "override": False},
+            self.txns[2].pk: {"category": uncategorized.pk, "override": True},
+        }
+        # The query count does not depend on the number of edited rows, 5 of the queries refresh the monthly summary
+        with self.assertNumQueries(15):
+            response = self.post_changes(changes)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(txn.category, txn.category_override) for txn in Transaction.objects.filter(user=self.user).order_by("pk")],
+            [(self.food, False), (uncategorized, False), (uncategorized, True)],
+        )
+
+    def test_row_errors(self):
+        response = self.post_changes(
+            {
+                self.txns[0].pk: {"category": self.other_category.pk, "override": True},
+                self.txns[1].pk: {"category": self.food.pk, "override": True},
+                0: {"category": self.food.pk, "override": True},
+            },
+            deleted=[self.txns[2].pk],
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"errors": {str(self.txns[0].pk): "Category does not exist.", "0": "Transaction does not exist."}})
+        # Nothing is saved when any row fails
+        self.assertEqual(Transaction.objects.filter(user=self.user, category_override=True).count(), 3)
+        self.assertEqual(self.post_changes({}, deleted="x").status_code, 400)
@@ -9,8 +9,11 @@ urlpatterns = [
     path("category-rules/", views.category_rules, name="category_rules"),
     path("accounts/", views.accounts, name="accounts"),
     path("upload/", views.UploadView.as_view(), name="upload"),
-    path("upload-preview/", views.UploadPreviewView.as_view(), name="upload_preview"),
+    path("upload-preview/<uuid:upload_id>/", views.UploadPreviewView.as_view(), name="upload_preview"),
+    path("upload-preview/<uuid:upload_id>/data/", views.upload_preview_data, name="upload_preview_data"),
     path("transactions/", views.TransactionView.as_view(), name="transactions"),
+    path("transactions/data/", views.transaction_data, name="transaction_data"),
+    path("jobs/<int:job_id>/", views.job_status, name="job_status"),
     path("accounts/login/", auth_views.LoginView.as_view(next_page="upload", extra_context={"login_page": True}), name="login"),
     path("accounts/logout/", auth_views.LogoutView.as_view(next_page="login"), name="logout"),
     path("accounts/register/", views.register, name="register"),
@@ -1,69 +1,68 @@
-from django.shortcuts import render
-import csv
+from django.shortcuts import render, get_object_or_404
 import json
-import os
-import requests
-from datetime import datetime
+import uuid
+import asyncio
+from datetime import date
+from asgiref.sync import sync_to_async
 from django.views import View
 from django.shortcuts import redirect
 from django.forms import inlineformset_factory
 from django.urls import reverse
-from django.http import JsonResponse, HttpResponse
-from django.db.models import Q, F
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.contrib import messages
 from django.contrib.auth import login, forms as auth_forms
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.files.storage import default_storage
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.contrib.auth.decorators import login_required
-from .models import ParseRule, CategoryRule, Category, Transaction, Account, Bank
-from .forms import ParseRuleForm, FileSelectForm, CategoryForm, AccountForm, AccountFormset, BankForm, CategoryJsonFileForm
-from .common import get_category, get_user_categorization_dicts
+from .models import ParseRule, CategoryRule, Category, Transaction, Account, Bank, Job
+from .forms import ParseRuleForm, FileSelectForm, BatchUploadFormset, CategoryForm, AccountForm, AccountFormset, BankForm, CategoryJsonFileForm
+from .common import get_user_categorizer, invalidate_user_categorizer, get_recategorization_changes, get_rule_stats_report, rule_stats
+from .jobs import enqueue_job
+from .rule_import import import_category_rules
+from .superset import get_superset_client, get_async_superset_client
+from .pipeline import bulk_create_transactions
+from .summaries import get_month, refresh_monthly_summaries
+from .tables import (
+    get_page_bounds,
+    stream_table_data,
+    streaming_content,
+    parse_table_params,
+    filter_transactions,
+    aget_keyset_page,
+    aestimate_count,
+    TableQueryError,
+)
+from .export import EXPORT_FORMATS, ExportError, filter_export, iter_export_rows
+from .staging import StagedUpload, get_staging_path, staged_upload_exists, delete_staged_upload
 
 
 @login_required
-def dashboard(request):
-    superset_host = os.getenv("SUPERSET_HOST", "")
-    superset_port = os.getenv("SUPERSET_PORT", "")
-    superset_username = os.getenv("SUPERSET_USERNAME", "")
-    superset_pass = os.getenv("SUPERSET_PASSWORD", "")
-    superset_api_endpoint = f"{superset_host}:{superset_port}/api/v1/"
-    session = requests.Session()
-
-    resp = session.post(superset_api_endpoint + "security/login", json={"username": superset_username, "password": superset_pass, "provider": "db"})
-    access_token = resp.json()["access_token"]
-
-    resp = session.get(superset_api_endpoint + "security/csrf_token", headers={"Authorization": f"Bearer {access_token}"})
-    csrf_token = resp.json()["result"]
-
-    resp = session.get(superset_api_endpoint + "dashboard/", headers={"Authorization": f"Bearer {access_token}"})
-    dashboards = resp.json()["result"]
-    dashboard_id = None
-    for dashboard in dashboards:
-        if dashboard["dashboard_title"] == "expenses_dashboard":
-            dashboard_id = dashboard["id"]
-            break
-
-    resp = session.get(superset_api_endpoint + "dataset/", headers={"Authorization": f"Bearer {access_token}"})
-    datasets = resp.json()["result"]
-    dataset_id = None
-    for dataset in datasets:
-        if dataset["table_name"] == "expenses_dataset":
-            dataset_id = dataset["id"]
-            break
-
-    body = {
-        "resources": [{"id": f"{dashboard_id}", "type": "dashboard"}],
-        "rls": [{"clause": f"user_id={request.user.pk}", "dataset": dataset_id}],
-        "user": {"first_name": request.user.username, "last_name": request.user.username, "username": request.user.username},
-    }
-    resp = session.post(
-        superset_api_endpoint + "security/guest_token", headers={"Authorization": f"Bearer {access_token}", "X-CSRFToken": csrf_token}, json=body
-    )
-
-    uuid_resp = session.get(superset_api_endpoint + f"dashboard/{dashboard_id}" + "/embedded", headers={"Authorization": f"Bearer {access_token}"})
-
-    return render(request, "dashboard.html", {"guest_token": resp.json()["token"], "db_uuid": uuid_resp.json()["result"]["uuid"]})
+def sync_dashboard(request):
+    client = get_superset_client()
+    dashboard_id = client.get_dashboard_id("expenses_dashboard")
+    dataset_id = client.get_dataset_id("expenses_dataset")
+    guest_token = client.get_guest_token(request.user, dashboard_id, dataset_id)
+    return render(request, "dashboard.html", {"guest_token": guest_token, "db_uuid": client.get_embedded_uuid(dashboard_id)})
+
+
+@login_required
+async def async_dashboard(request):
+    user = await request.auser()
+    client = get_async_superset_client()
+    dashboard_id, dataset_id = await asyncio.gather(client.get_dashboard_id("expenses_dashboard"), client.get_dataset_id("expenses_dataset"))
+    guest_token, db_uuid = await asyncio.gather(client.get_guest_token(user, dashboard_id, dataset_id), client.get_embedded_uuid(dashboard_id))
+    # Template context processors read the session and user synchronously
+    return await sync_to_async(render)(request, "dashboard.html", {"guest_token": guest_token, "db_uuid": db_uuid})
+
+
+# Under WSGI every async view call runs on a new event loop, which would leave the async client without a reusable
+# connection pool, so the pooled sync client is used instead
+dashboard = async_dashboard if settings.SERVER_MODE == "asgi" else sync_dashboard
 
 
 @login_required
@@ -81,89 +80,154 @@ def parse_rules(request):
 
 class UploadView(LoginRequiredMixin, View):
     def get(self, request):
-        return render(request, "upload.html", {"form": FileSelectForm(user=request.user)})
+        return self.render_upload(request)
 
     def post(self, request):
         if "preview-upload" in request.POST:
-            form = FileSelectForm(request.POST, request.FILES, user=request.user)
+            form = FileSelectForm(request.POST, request.FILES, user=request.user, defer_upload=True)
             if form.is_valid():
-                return redirect(reverse("upload_preview"))
+                # The file is validated and staged by the job worker, the page polls the job until it is done
+                raw_file = default_storage.save(f"raw/{request.user.pk}", form.cleaned_data["file"])
+                job = enqueue_job(request.user, "upload", file=raw_file, parse_rule=int(form.cleaned_data["choice"]), upload_id=str(uuid.uuid4()))
+                return self.render_upload(request, job=job)
             else:
-                return render(request, "upload.html", {"form": form})
+                return self.render_upload(request, form=form)
+        if "batch-upload" in request.POST:
+            batch_formset = BatchUploadFormset(request.POST, request.FILES, prefix="batch", form_kwargs={"user": request.user})
+            if batch_formset.is_valid():
+                # The files are parsed in parallel by the job and staged together as one upload
+                files = [
+                    [
+                        default_storage.save(f"raw/{request.user.pk}", form.cleaned_data["file"]),
+                        int(form.cleaned_data["choice"]),
+                        form.cleaned_data["file"].name,
+                    ]
+                    for form in batch_formset
+                    if form.cleaned_data
+                ]
+                job = enqueue_job(request.user, "batch_upload", files=files, upload_id=str(uuid.uuid4()))
+                return self.render_upload(request, job=job)
+            return self.render_upload(request, batch_formset=batch_formset)
+        return self.render_upload(request)
+
+    @staticmethod
+    def render_upload(request, form=None, batch_formset=None, job=None):
+        return render(
+            request,
+            "upload.html",
+            {
+                "form": form or FileSelectForm(user=request.user),
+                "batch_formset": batch_formset or BatchUploadFormset(prefix="batch", form_kwargs={"user": request.user}),
+                "job": job,
+            },
+        )
 
 
 class UploadPreviewView(LoginRequiredMixin, View):
-    def get(self, request):
-        if default_storage.exists(f"{request.user.pk}"):
-            # "getTxnData" set during tabulator ajax query
-            if "getTxnData" in request.GET and default_storage.exists(f"{request.user.pk}"):
-                with default_storage.open(f"{request.user.pk}", "r") as file:
-                    reader = csv.DictReader(file)
-                    table_data = []
-                    for row in reader:
-                        row["cat"] = Category.objects.get(pk=row["cat"]).name
-                        row["accnt"] = Account.objects.get(pk=row["accnt"]).name
-                        table_data.append(row)
-                    return JsonResponse(table_data, safe=False)
-            else:
-                categories = [(cat.pk, cat.name) for cat in Category.objects.filter(user=request.user)]
-                return render(
-                    request,
-                    "tables.html",
-                    {
-                        "override_values": categories,
-                        "row_select_title": "Ommit",
-                        "confirm_btn_txt": "Upload Tansactions",
-                        "page_url": reverse("upload_preview"),
-                    },
-                )
+    def get(self, request, upload_id):
+        if staged_upload_exists(request.user.pk, str(upload_id)):
+            categories = [(cat.pk, cat.name) for cat in Category.objects.filter(user=request.user)]
+            return render(
+                request,
+                "tables.html",
+                {
+                    "override_values": categories,
+                    "row_select_title": "Ommit",
+                    "confirm_btn_txt": "Upload Tansactions",
+                    "page_url": reverse("upload_preview", args=[upload_id]),
+                    "data_url": reverse("upload_preview_data", args=[upload_id]),
+                    "remote_pagination": True,
+                    "show_duplicates": True,
+                },
+            )
         else:
             return redirect(reverse("upload"))
 
-    def post(self, request):
+    def post(self, request, upload_id):
         change_data = json.loads(request.body)
-        if "cancel" not in change_data and default_storage.exists(f"{request.user.pk}"):
-            with default_storage.open(f"{request.user.pk}", "r") as file:
-                reader = csv.DictReader(file)
-
-                categories_dict = {category.pk: category for category in Category.objects.filter(user=request.user)}
-                accounts_dict = {account.pk: account for account in Account.objects.filter(bank__user=request.user)}
-                categorization_dicts = get_user_categorization_dicts(request.user)
-                txns = []
-                row_idx = 0
-
-                for row in reader:
-                    if row_idx in change_data["deleted"]:
-                        row_idx += 1
-                        continue
-
-                    # Change the category if it was overridden
-                    cat = categories_dict.get(int(row["cat"]))
-                    cat_o = False
-                    if str(row_idx) in change_data["changes"]:
-                        if change_data["changes"][str(row_idx)]["override"]:
-                            cat = categories_dict.get(change_data["changes"][str(row_idx)]["category"])
-                        else:
-                            cat = get_category(categorization_dicts, row["desc"])
-                        cat_o = change_data["changes"][str(row_idx)]["override"]
-
-                    txn = Transaction(
-                        user=request.user,
-                        date=datetime.fromisoformat(row["date"]),
-                        description=row["desc"],
-                        category=cat,
-                        account=accounts_dict.get(int(row["accnt"])),
-                        amount=row["amnt"],
-                        category_override=cat_o,
-                    )
-                    txns.append(txn)
-                    row_idx += 1
-                Transaction.objects.bulk_create(txns)
-            # if "cancel-upload" in request.POST: Nothing to do, just redirect and delete cached file
-
-        default_storage.delete(f"{request.user.pk}")
+        if "cancel" not in change_data and staged_upload_exists(request.user.pk, str(upload_id)):
+            with StagedUpload(get_staging_path(request.user.pk, str(upload_id))) as staged_upload, transaction.atomic():
+                # Rows flagged as duplicates are skipped unless kept, conflicts with transactions committed since the
+                # upload was staged are skipped by the fingerprint constraint
+                bulk_create_transactions(self.get_transactions(request.user, staged_upload, change_data), ignore_conflicts=True)
+                refresh_monthly_summaries(request.user.pk, {get_month(date.fromordinal(day)) for day in set(staged_upload.dates)})
+            rule_stats.flush()
+            # if "cancel-upload" in request.POST: Nothing to do, just redirect and delete the staged upload
+
+        delete_staged_upload(request.user.pk, str(upload_id))
         return redirect(reverse("upload"))
 
+    @staticmethod
+    def get_transactions(user, staged_upload, change_data):
+        """Yield the transactions to create from the staged rows, applying the edits made in the preview table"""
+        categories_dict = {category.pk: category for category in Category.objects.filter(user=user)}
+        accounts_dict = {account.pk: account for account in Account.objects.filter(bank__user=user)}
+        categorizer = get_user_categorizer(user)
+        deleted_rows = set(change_data["deleted"])
+        keep_duplicates = change_data.get("keep_duplicates", False)
+        # Rows whose override was removed go back to the categorizer's choice
+        reverted_rows = [int(row_idx) for row_idx, change in change_data["changes"].items() if not change["override"]]
+        reverted_categories = dict(zip(reverted_rows, categorizer.categorize_many(staged_upload.get_description(row_idx) for row_idx in reverted_rows)))
+
+        for row_idx, (row_date, description, category_pk, amount, account_pk) in enumerate(staged_upload):
+            if row_idx in deleted_rows:
+                continue
+            fingerprint = staged_upload.get_fingerprint(row_idx)
+            if staged_upload.is_duplicate(row_idx):
+                if not keep_duplicates:
+                    continue
+                # A kept duplicate can not share the fingerprint of the transaction it duplicates
+                fingerprint = None
+
+            # Change the category if it was overridden
+            cat = categories_dict.get(category_pk)
+            cat_o = False
+            if str(row_idx) in change_data["changes"]:
+                if change_data["changes"][str(row_idx)]["override"]:
+                    cat = categories_dict.get(change_data["changes"][str(row_idx)]["category"])
+                else:
+                    cat = categories_dict.get(reverted_categories[row_idx])
+                cat_o = change_data["changes"][str(row_idx)]["override"]
+
+            yield Transaction(
+                user=user,
+                date=row_date,
+                description=description,
+                category=cat,
+                account=accounts_dict.get(account_pk),
+                amount=amount,
+                category_override=cat_o,
+                fingerprint=fingerprint,
+            )
+
+
+@login_required
+def upload_preview_data(request, upload_id):
+    """Page of a staged upload requested by the preview table"""
+    if not staged_upload_exists(request.user.pk, str(upload_id)):
+        return JsonResponse({"error": "Upload does not exist"}, status=404)
+    staged_upload = StagedUpload(get_staging_path(request.user.pk, str(upload_id)))
+    start, stop, last_page = get_page_bounds(request, len(staged_upload))
+    category_names = dict(Category.objects.filter(user=request.user).values_list("pk", "name"))
+    account_names = dict(Account.objects.filter(bank__user=request.user).values_list("pk", "name"))
+
+    def rows():
+        with staged_upload:
+            for idx in range(start, stop):
+                row_date, description, category_pk, amount, account_pk = staged_upload.get_row(idx)
+                yield {
+                    "idx": idx,
+                    "date": row_date.isoformat(),
+                    "desc": description,
+                    "cat": category_names.get(category_pk),
+                    "amnt": amount,
+                    "accnt": account_names.get(account_pk),
+                    "dup": staged_upload.is_duplicate(idx),
+                }
+
+    content = stream_table_data(rows(), last_page=last_page, last_row=len(staged_upload))
+    return StreamingHttpResponse(streaming_content(content), content_type="application/json")
+
 
 @login_required
 def category_rules(request):
@@ -183,17 +247,19 @@ def category_rules(request):
         ]
         upload_form = CategoryJsonFileForm(request.POST, request.FILES)
         if category_formset.is_valid() and upload_form.is_valid() and all(formset.is_valid() for formset in rule_formsets):
+            old_categorizer = get_user_categorizer(request.user)
+
             # Load JSON file if provided
             if upload_form.cleaned_data["json_file"] and hasattr(upload_form, "json_data"):
-                cats = []
-                rules = []
-                for json_entry in upload_form.json_data:
-                    new_category = Category(user=request.user, name=json_entry["name"], priority=json_entry["priority"], parent=None)
-                    cats.append(new_category)
-                    for rule in json_entry["rules"]:
-                        rules.append(CategoryRule(category=new_category, match_type=rule["match_type"], match_text=rule["match_text"]))
-                Category.objects.bulk_create(cats, update_conflicts=True, update_fields=["priority", "parent"], unique_fields=["name", "user"])
-                CategoryRule.objects.bulk_create(rules)
+                report = import_category_rules(request.user, upload_form.json_data)
+                if report["categories_created"] or report["categories_updated"] or report["rules_created"]:
+                    # bulk_create does not send post_save signals
+                    invalidate_user_categorizer(request.user.pk)
+                messages.success(
+                    request,
+                    "Imported rule file: {categories_created} categories created, {categories_updated} categories updated, "
+                    "{rules_created} rules created, {rules_unchanged} rules already existed.".format(**report),
+                )
 
             # Save cateogries and rules
             category_formset.save()
@@ -202,13 +268,11 @@ def category_rules(request):
                     rule_formset.instance = category_form.instance
                     rule_formset.save()
 
-            # Update transactions with new categories
-            txns = Transaction.objects.filter(Q(user=request.user) & Q(category_override=False))
-            categorization_dicts = get_user_categorization_dicts(request.user)
-            for txn in txns:
-                txn.category = get_category(categorization_dicts, txn.description)
-            Transaction.objects.bulk_update(txns, ["category"])
-
+            # Update the transactions affected by the rule changes in the background
+            changes = get_recategorization_changes(old_categorizer, get_user_categorizer(request.user))
+            if changes is not None:
+                job = enqueue_job(request.user, "recategorize", **changes)
+                return redirect(reverse(category_rules) + f"?job={job.pk}")
             return redirect(reverse(category_rules))
         categoryIsValid = [(category_form.is_valid() and rule_formset.is_valid()) for category_form, rule_formset in zip(category_formset, rule_formsets)]
     # if "cancel-changes" in request.POST: Nothing to do, just redirect
@@ -232,6 +296,14 @@ def category_rules(request):
         )
     else:
         context = {"category_formset": category_formset, "zipped_lists": zip(category_formset, rule_formsets, categoryIsValid), "upload_form": upload_form}
+        if request.GET.get("job", "").isdigit():
+            context["job"] = Job.objects.filter(user=request.user, pk=request.GET["job"]).first()
+        categorizer = get_user_categorizer(request.user)
+        if request.GET.get("explain"):
+            category, trace = categorizer.explain(request.GET["explain"])
+            context["explain"] = {"description": request.GET["explain"], "category": category, "trace": trace}
+        context["skipped_rules"] = categorizer.skipped_rules
+        context["rule_stats"] = get_rule_stats_report(request.user)
         return render(request, "category_rules.html", context)
 
 
@@ -266,23 +338,17 @@ def accounts(request):
 
 class TransactionView(LoginRequiredMixin, View):
     def get(self, request):
-        # "getTxnData" set during tabulator ajax query
-        if "getTxnData" in request.GET:
-            txns = Transaction.objects.filter(user=request.user).values(
-                "date", accnt=F("account__name"), amnt=F("amount"), cat=F("category__name"), desc=F("description"), cat_o=F("category_override"), idx=F("pk")
-            )
-            table_data = []
-            for txn in txns:
-                table_data.append(txn)
-            return JsonResponse(table_data, safe=False)
-        elif "getCsv" in request.GET:
-            txns = Transaction.objects.filter(user=request.user).values("date", "account__name", "amount", "category__name", "description")
-            response = HttpResponse(content_type="text/csv")
-            response["Content-Disposition"] = 'attachment; filename="transactions.csv"'
-            writer = csv.writer(response)
-            writer.writerow(["Date", "Account", "Description", "Category", "Amount"])
-            for txn in txns:
-                writer.writerow([txn["date"], txn["account__name"], txn["description"], txn["category__name"], txn["amount"]])
+        if "getCsv" in request.GET:
+            # format, start, end and account parameters allow pulling filtered slices in other formats
+            if request.GET.get("format", "csv") not in EXPORT_FORMATS:
+                return HttpResponse(status=400)
+            stream, content_type, extension = EXPORT_FORMATS[request.GET.get("format", "csv")]
+            try:
+                txns = filter_export(Transaction.objects.filter(user=request.user), request.GET)
+            except ExportError:
+                return HttpResponse(status=400)
+            response = StreamingHttpResponse(streaming_content(stream(iter_export_rows(txns))), content_type=content_type)
+            response["Content-Disposition"] = f'attachment; filename="transactions.{extension}"'
             return response
         else:
             categories = [(cat.pk, cat.name) for cat in Category.objects.filter(user=request.user)]
@@ -294,7 +360,9 @@ class TransactionView(LoginRequiredMixin, View):
                     "row_select_title": "Delete",
                     "confirm_btn_txt": "Save changes",
                     "page_url": reverse("transactions"),
+                    "data_url": reverse("transaction_data"),
                     "downloadable": True,
+                    "keyset_pagination": True,
                 },
             )
 
@@ -303,22 +371,67 @@ class TransactionView(LoginRequiredMixin, View):
         if "cancel" in change_data:
             return HttpResponse(status=200)
         try:
-            changed_txns = Transaction.objects.filter(Q(user=request.user) & Q(pk__in=[*change_data["changes"]]))
-            categorization_dicts = get_user_categorization_dicts(request.user)
-            for change_idx, change in change_data["changes"].items():
-                changed_txn = changed_txns.get(pk=change_idx)
-                if change["override"]:
-                    changed_txn.category = Category.objects.filter(user=request.user).get(pk=change["category"])
+            changes = {int(change_idx): change for change_idx, change in change_data["changes"].items()}
+            deleted_rows = [int(row) for row in change_data["deleted"]]
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return JsonResponse({"errors": {"__all__": "Invalid change data."}}, status=400)
+
+        changed_txns = Transaction.objects.filter(user=request.user).in_bulk(changes.keys())
+        categories = Category.objects.filter(user=request.user).in_bulk()
+        categorizer = get_user_categorizer(request.user)
+        errors = {}
+        reverted_txns = []
+        for change_idx, change in changes.items():
+            changed_txn = changed_txns.get(change_idx)
+            if changed_txn is None:
+                errors[change_idx] = "Transaction does not exist."
+            elif not isinstance(change, dict) or not isinstance(change.get("override"), bool):
+                errors[change_idx] = "Invalid change."
+            elif change["override"]:
+                if change.get("category") not in categories:
+                    errors[change_idx] = "Category does not exist."
                 else:
-                    changed_txn.category = get_category(categorization_dicts, changed_txn.description)
-                changed_txn.category_override = change["override"]
-                changed_txn.save()
+                    changed_txn.category = categories[change["category"]]
+                    changed_txn.category_override = True
+            else:
+                reverted_txns.append(changed_txn)
+        if errors:
+            return JsonResponse({"errors": errors}, status=400)
+        for changed_txn, category_pk in zip(reverted_txns, categorizer.categorize_many(txn.description for txn in reverted_txns)):
+            changed_txn.category_id = category_pk
+            changed_txn.category_override = False
+
+        deleted_txns = Transaction.objects.filter(Q(pk__in=deleted_rows) & Q(user=request.user))
+        with transaction.atomic():
+            months = {get_month(txn.date) for txn in changed_txns.values()} | set(deleted_txns.dates("date", "month"))
+            Transaction.objects.bulk_update(changed_txns.values(), ["category", "category_override"], batch_size=settings.UPLOAD_BATCH_SIZE)
+            deleted_txns.delete()
+            refresh_monthly_summaries(request.user.pk, months)
+        rule_stats.flush()
+        return HttpResponse(status=200)
 
-            deleted_rows = change_data["deleted"]
-            Transaction.objects.filter(Q(pk__in=deleted_rows) & Q(user=request.user)).delete()
-            return HttpResponse(status=200)
-        except Exception as e:
-            return HttpResponse(status=400)
+
+@login_required
+async def transaction_data(request):
+    """Keyset paginated page of transactions requested by the transaction table"""
+    user = await request.auser()
+    try:
+        sort, filters, size, page, cursor = parse_table_params(request)
+        txns = filter_transactions(Transaction.objects.filter(user=user), filters)
+        table_data, next_cursor = await aget_keyset_page(txns, sort, size, cursor)
+    except TableQueryError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    response = {"last_page": page + 1 if next_cursor else page, "next_cursor": next_cursor}
+    # The count is only needed once per sort/filter, when the first page is loaded
+    if not cursor:
+        response["last_row"], response["estimated_count"] = await aestimate_count(txns)
+    return JsonResponse({**response, "data": table_data})
+
+
+@login_required
+def job_status(request, job_id):
+    job = get_object_or_404(Job, pk=job_id, user=request.user)
+    return JsonResponse({"status": job.status, "progress": job.progress, "total": job.total, "error": job.error})
 
 
 def register(request):